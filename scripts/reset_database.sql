@@ -30,3 +30,11 @@ CREATE TABLE Rules (
     rule         text    NOT NULL,
     PRIMARY KEY (node_id, rule_number, is_bootstrap)
 );
+
+-- See src/frontend/checkpoint.py.
+CREATE TABLE Checkpoints (
+    node_id         bigint  NOT NULL,
+    collection_name text    NOT NULL,
+    time            integer NOT NULL,
+    PRIMARY KEY (node_id, collection_name, time)
+);
@@ -59,6 +59,9 @@ Todo:
 
 from ctypes import * #cdll
 import argparse
+import hashlib
+import importlib.util
+import os
 from os import system
 from os import close
 import yaml
@@ -250,6 +253,61 @@ def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
         construct_mapping)
     return yaml.load(stream, OrderedLoader)
 
+# grammars are read from this directory, whatever the working directory, and
+# the parsers TatSu generates for them are cached in its __pycache__.
+GRAMMAR_DIR = os.path.dirname(os.path.abspath(__file__))
+PARSER_CACHE_DIR = os.path.join(GRAMMAR_DIR, '__pycache__')
+
+# sha1 of TatSu version and grammar text -> parser, so that a grammar is
+# compiled at most once per process.
+_parsers = {}
+
+def load_parser(grammar_file):
+  """return a parser for a TatSu grammar in GRAMMAR_DIR
+
+  Compiling a grammar is much slower than parsing a rule with it, so the
+  parser TatSu generates is written to PARSER_CACHE_DIR, named by the sha1 of
+  the TatSu version and the grammar's text, and later runs import it rather
+  than compile the grammar again. Editing the grammar or upgrading TatSu
+  changes the hash, so stale parsers are never used.
+
+  Args:
+    grammar_file (str): file name of the grammar, e.g. 'fluent2.tatsu'
+
+  Returns:
+    tatsu.parsing.Parser: parser whose parse method takes the text to parse
+  """
+  with open(os.path.join(GRAMMAR_DIR, grammar_file)) as f:
+    grammar = f.read()
+  # generated parsers import TatSu's runtime, which changes between versions
+  key = tatsu.__version__ + '\n' + grammar
+  digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+  if digest in _parsers:
+    return _parsers[digest]
+
+  module_name = os.path.splitext(grammar_file)[0] + '_' + digest
+  path = os.path.join(PARSER_CACHE_DIR, module_name + '.py')
+  if not os.path.exists(path):
+    source = tatsu.to_python_sourcecode(grammar, name='FLUENT',
+                                        filename=grammar_file)
+    try:
+      os.makedirs(PARSER_CACHE_DIR, exist_ok=True)
+      # write then rename, so that a concurrent run never imports half a file
+      fd, tmp = tempfile.mkstemp(dir=PARSER_CACHE_DIR, suffix='.tmp')
+      with os.fdopen(fd, 'w') as f:
+        f.write(source)
+      os.replace(tmp, path)
+    except OSError:
+      # e.g. a read-only checkout; use the grammar uncached
+      _parsers[digest] = tatsu.compile(grammar)
+      return _parsers[digest]
+
+  spec = importlib.util.spec_from_file_location(module_name, path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  _parsers[digest] = module.FLUENTParser()
+  return _parsers[digest]
+
 def fluent_prologue(name, args):
   """Generate C++ file preamble.
 
@@ -469,11 +527,11 @@ def translate_rules(rules, collection_wrap):
       "
   """
   retval = ''
+  parser = load_parser('fluent.tatsu')
   for k, v in rules.items():
-    grammar = open('./fluent.tatsu').read()
     sem = BloomSemantics();
     setattr(sem, "cwrap", collection_wrap)
-    v = tatsu.parse(grammar, k +': ' + v, parseinfo=True, semantics=sem)
+    v = parser.parse(k +': ' + v, parseinfo=True, semantics=sem)
     retval += ("      auto " + v)
   retval += ("      return std::make_tuple(" + ",".join(rules.keys()) + ");\n")
   return retval
@@ -614,10 +672,9 @@ def fullparse(specFile):
     text of the C++ file
   """
   spec = open(specFile).read()
-  grammar = open('./fluent2.tatsu').read()
   sem = BloomSemantics();
   setattr(sem, "cwrap", "")
-  parser = tatsu.compile(grammar)
+  parser = load_parser('fluent2.tatsu')
   retval = parser.parse(spec, semantics=sem)
 
   return retval
@@ -0,0 +1,59 @@
+"""Time fullparse against Bloom specs with more and more rules.
+
+Every spec declares a program with `--rules` rules (1, 10, 50, and 100 by
+default) that project and map a handful of collections, e.g.
+
+    r7: c3 <= c2.project<1, 0>()
+
+fluent2.tatsu parses a program's rules recursively, so much longer programs
+exceed python's recursion limit.
+
+The parser for fluent2.tatsu is loaded once, before any spec is timed (see
+load_parser), so the times are of parsing and code generation alone. For
+example,
+
+    python bl2fluent_bench.py --rules 10,50,100
+
+prints a CSV of rules and seconds.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import bl2fluent
+
+def spec(num_rules):
+  # the text of a spec with `num_rules` rules
+  rules = []
+  for i in range(num_rules):
+    if i % 2 == 0:
+      rhs = 'c{}.project<1, 0>()'.format(i % 5)
+    else:
+      rhs = 'c{}.map(t ```c++ {{ return t; }}```)'.format(i % 5)
+    rules.append('r{}: c{} <= {}'.format(i, (i + 1) % 5, rhs))
+  return 'Bench(std::string address) {\n' + ';\n'.join(rules) + '\n}\n'
+
+def bench():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--rules", default="1,10,50,100",
+                      help="Comma-separated numbers of rules.")
+  args = parser.parse_args()
+
+  bl2fluent.load_parser('fluent2.tatsu')
+  print("rules,seconds")
+  for num_rules in [int(n) for n in args.rules.split(",")]:
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        f.write(spec(num_rules))
+      start = time.time()
+      bl2fluent.fullparse(path)
+      seconds = time.time() - start
+    finally:
+      os.remove(path)
+    print("{},{:.3f}".format(num_rules, seconds))
+
+if __name__ == "__main__":
+  bench()
@@ -1,6 +1,8 @@
-import tatsu
+import os
 from pprint import pprint
 
+from bl2fluent import GRAMMAR_DIR, load_parser
+
 class BloomSemantics(object):
   """docstring for BloomSemantics"""
   def logic(self, ast):
@@ -69,9 +71,8 @@ class BloomSemantics(object):
 
 
 
-grammar = open('./fluent2.tatsu').read()
-bloom = open('./test.txt').read()
+bloom = open(os.path.join(GRAMMAR_DIR, 'test.txt')).read()
 sem = BloomSemantics()
 setattr(sem, 'cwrap', 'lra::make_collection')
-result = tatsu.parse(grammar, bloom, semantics=sem)
+result = load_parser('fluent2.tatsu').parse(bloom, semantics=sem)
 print(result)
\ No newline at end of file
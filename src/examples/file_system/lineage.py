@@ -1,3 +1,52 @@
+import bisect
+import json
+
+# Indexes for the queries below, as (table, index, definition) triples, which
+# the frontend creates with `main.py --ensure-indexes` (see indexes.py). The
+# byte range index lets read_lineage fetch only the writes that overlap a
+# read, however long the history of writes to other offsets. Range types are
+# postgres-only, so sqlite exports (see frontend/sqlite_db.py) don't have it.
+INDEXES = [(
+    "file_system_server_write_request",
+    "file_system_server_write_request_bytes_idx",
+    "USING gist (int4range(start, start + octet_length(data)))",
+)]
+
+# The queries below also run against sqlite exports (see
+# frontend/sqlite_db.py), which have no arrays or range types. A sqlite
+# cursor's connection has no server_version.
+def postgres(cur):
+    return hasattr(cur.connection, "server_version")
+
+def overlaps_sql(cur):
+    """SQL for whether write W overlaps the bytes [R.a, R.b). Against
+    postgres it's a range overlap, which the index above answers. Against
+    sqlite we compare the bounds instead, skipping empty writes as empty
+    ranges do."""
+    if postgres(cur):
+        return ("int4range(W.start, W.start + octet_length(W.data)) && "
+                "int4range(R.a, R.b)")
+    return ("W.start < R.b AND R.a < W.start + octet_length(W.data) AND "
+            "octet_length(W.data) > 0")
+
+def ids_sql(cur, ids):
+    """SQL for a set of ids, for use after IN, and its arguments."""
+    if postgres(cur):
+        return ("SELECT unnest(%s::bigint[])", (ids,))
+    # sqlite has no arrays, so the ids are passed as a JSON list.
+    return ("SELECT value FROM json_each(%s)", (json.dumps(ids),))
+
+def ranges_sql(cur, starts, stops):
+    """SQL for a relation R(a, b) of byte ranges [a, b), for use in a FROM
+    clause, and its arguments."""
+    if postgres(cur):
+        return ("unnest(%s::integer[], %s::integer[]) AS R(a, b)",
+                (starts, stops))
+    return ("""(SELECT json_extract(value, '$[0]') AS a,
+                       json_extract(value, '$[1]') AS b
+                FROM json_each(%s)) AS R""",
+            (json.dumps(zip(starts, stops)),))
+
 def overlap((a, b), (x, y)):
     return not (y < a or x > b)
 
@@ -13,39 +62,45 @@ def subsumes((a, b), (x, y)):
     return a <= x and b >= y
 
 class DisjointRanges(object):
+    """A set of integers, stored as the sorted inclusive bounds of its
+    maximal ranges. Looking up the ranges that overlap a range is a binary
+    search, so unions and coverage checks take O(log n) comparisons (plus
+    an O(n) memmove when ranges are merged or inserted).
+
+        ranges = DisjointRanges()
+        ranges.union((0, 9))   # False
+        ranges.union((10, 19)) # False
+        ranges.union((5, 15))  # True
+        ranges.covers((0, 19)) # True
+    """
     def __init__(self):
-        self.ranges = []
-
-    def condense(self):
-        """Combine consecutive ranges."""
-        ranges = self.ranges[0:1]
-        for (a, b) in self.ranges[1:]:
-            (x, y) = ranges[-1]
-            if y + 1 == a:
-                ranges[-1] = (x, b)
-            else:
-                ranges.append((a, b))
-        self.ranges = ranges
-
-    def union(self, r):
-        enumerated = enumerate(self.ranges)
-        overlaps = [(i, rng) for (i, rng) in enumerated if overlap(rng, r)]
-
-        subsumed = False
-        if len(overlaps) == 0:
-            self.ranges.append(r)
-            self.ranges.sort(key=lambda (a, b): a)
-        elif len(overlaps) == 1 and subsumes(overlaps[0][1], r):
-            subsumed = True
-        else:
-            for (i, rng) in overlaps:
-                r = union(rng, r)
-            (low, _) = overlaps[0]
-            (high, _) = overlaps[-1]
-            self.ranges[low:high + 1] = [r]
-
-        self.condense()
-        return subsumed
+        self.starts = []
+        self.stops = []
+
+    @property
+    def ranges(self):
+        return zip(self.starts, self.stops)
+
+    def covers(self, (a, b)):
+        """Whether every integer in [a, b] is in the set."""
+        i = bisect.bisect_right(self.starts, a) - 1
+        return i >= 0 and self.stops[i] >= b
+
+    def union(self, (x, y)):
+        """Add [x, y] to the set, and return whether it was already in it."""
+        if self.covers((x, y)):
+            return True
+
+        # Ranges [i, j) overlap or are adjacent to [x, y], and are replaced
+        # by their union with it.
+        i = bisect.bisect_left(self.stops, x - 1)
+        j = bisect.bisect_right(self.starts, y + 1)
+        if i < j:
+            x = min(x, self.starts[i])
+            y = max(y, self.stops[j - 1])
+        self.starts[i:j] = [x]
+        self.stops[i:j] = [y]
+        return False
 
     def __str__(self):
         return str(self.ranges)
@@ -54,35 +109,74 @@ class DisjointRanges(object):
         return str(self.ranges)
 
 def read_lineage(cur, id_):
+    return read_lineage_batch(cur, [id_])[id_]
+
+def read_lineage_batch(cur, ids):
+    """A dict mapping every read in `ids` to its lineage: the writes before
+    it that last wrote the bytes it read. The frontend uses this rather than
+    read_lineage to trace many reads at once."""
+    (ids_query, ids_args) = ids_sql(cur, list(set(ids)))
     cur.execute("""
-        SELECT time_inserted, start, stop
+        SELECT time_inserted, start, stop, id
         FROM file_system_server_read_request
-        WHERE id = %s;
-    """, (id_, ))
+        WHERE id IN ({});
+    """.format(ids_query), ids_args)
     rows = cur.fetchall()
-    assert len(rows) == 1
-    row = rows[0]
-    (time, a, b) = row
-    b = b - 1
+    assert len(rows) == len(set(ids))
+    lineage = {id_: [] for (_, _, _, id_) in rows}
+    # Empty reads depend on no writes.
+    reads = [(time, a, b - 1, id_) for (time, a, b, id_) in rows if a < b]
+    ranges = {id_: DisjointRanges() for (_, _, _, id_) in reads}
+    if len(reads) == 0:
+        return lineage
 
-    cur.execute("""
-        SELECT hash, time_inserted, start, data
-        FROM file_system_server_write_request
-        WHERE time_inserted < %s
-        ORDER BY time_inserted DESC;
-    """, (time,))
-    lineage = []
-    ranges = DisjointRanges()
-    for (hash_, time, start, data) in cur.fetchall():
-        (x, y) = (start, start + len(data) - 1)
-        if overlap((a, b), (x, y)):
-            (x, y) = intersect((x, y), (a, b))
-            subsumed = ranges.union((x, y))
-            if not subsumed:
-                id_ = ("file_system_server", "write_request", hash_, time)
-                lineage.append(id_)
-
-        if ranges.ranges == [(a, b)]:
-            return lineage
+    # Only writes that overlap a read can be in its lineage, and once the
+    # writes we've seen cover a read, older writes can't be either. So we
+    # sweep once over the writes that overlap any read, newest first, through
+    # a server-side cursor a batch at a time. A read is started once the
+    # sweep passes its time and finished once it's covered, and the sweep
+    # stops when every read is finished.
+    spans = DisjointRanges()
+    for (_, a, b, _) in reads:
+        spans.union((a, b))
+    pending = sorted(reads)  # Reads not yet started, newest last.
+    started = []             # The (a, b, id_) of unfinished reads, sorted.
+    longest = max(b - a for (_, a, b, _) in reads)
+    (spans_query, spans_args) = ranges_sql(cur, spans.starts,
+                                           [b + 1 for b in spans.stops])
+    with cur.connection.cursor(name="read_lineage") as writes:
+        writes.itersize = 1000
+        writes.execute("""
+            SELECT DISTINCT W.hash, W.time_inserted, W.start, W.data
+            FROM {}, file_system_server_write_request W
+            WHERE W.time_inserted < %s AND {}
+            ORDER BY W.time_inserted DESC;
+        """.format(spans_query, overlaps_sql(cur)),
+            spans_args + (pending[-1][0],))
+        for (hash_, time, start, data) in writes:
+            while len(pending) > 0 and pending[-1][0] > time:
+                (_, a, b, id_) = pending.pop()
+                bisect.insort(started, (a, b, id_))
+
+            # The started reads that overlap the write start in [x - longest,
+            # y].
+            (x, y) = (start, start + len(data) - 1)
+            low = bisect.bisect_left(started, (x - longest,))
+            high = bisect.bisect_left(started, (y + 1,))
+            finished = []
+            for (a, b, id_) in started[low:high]:
+                if not overlap((a, b), (x, y)):
+                    continue
+                subsumed = ranges[id_].union(intersect((x, y), (a, b)))
+                if not subsumed:
+                    lineage[id_].append(
+                        ("file_system_server", "write_request", hash_, time))
+                if ranges[id_].covers((a, b)):
+                    finished.append((a, b, id_))
+            for read in finished:
+                started.remove(read)
+
+            if len(pending) == 0 and len(started) == 0:
+                break
 
     return lineage
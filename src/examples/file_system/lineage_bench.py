@@ -0,0 +1,78 @@
+"""Time read_lineage against a long history of small, scattered writes.
+
+The history has `--writes` writes (100,000 by default) of 1 to 16 bytes at
+random offsets of a file four bytes per write long, and a single read of the
+whole file after them. Few bytes are overwritten, so the read's lineage has
+most of the writes and the set of bytes covered is fragmented into many
+ranges until the very end. For example,
+
+    python lineage_bench.py --writes 1000,10000,100000
+
+prints a CSV of writes, lineage size, and seconds.
+"""
+
+import argparse
+import random
+import time
+
+import lineage
+
+class FakeCursor(object):
+    # Answers read_lineage's queries from memory: the read is `read` and the
+    # writes, newest first, are `writes`. Named cursors are fake cursors
+    # too, so that cur.connection.cursor(name) works.
+    def __init__(self, read, writes):
+        self.read = read
+        self.writes = writes
+        self.rows = []
+        self.connection = self
+
+    def cursor(self, name=None):
+        return FakeCursor(self.read, self.writes)
+
+    def execute(self, query, args=None):
+        if "read_request" in query:
+            self.rows = [self.read]
+        else:
+            self.rows = self.writes
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        pass
+
+def history(num_writes):
+    # The (time_inserted, start, stop, id) of the read and the (hash,
+    # time_inserted, start, data) of every write, newest first.
+    size = 4 * num_writes
+    writes = []
+    for time_ in range(num_writes, 0, -1):
+        data = "x" * random.randint(1, 16)
+        start = random.randint(0, size - len(data))
+        writes.append((random.getrandbits(63), time_, start, data))
+    return ((num_writes + 1, 0, size, 0), writes)
+
+def bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--writes", default="100000",
+                        help="Comma-separated numbers of writes.")
+    args = parser.parse_args()
+
+    print "writes,lineage,seconds"
+    for num_writes in [int(n) for n in args.writes.split(",")]:
+        (read, writes) = history(num_writes)
+        cur = FakeCursor(read, writes)
+        start = time.time()
+        result = lineage.read_lineage(cur, 0)
+        seconds = time.time() - start
+        print "{},{},{:.3f}".format(num_writes, len(result), seconds)
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "frontend"))
+
+import psycopg2
+import sqlite_db
+
+import lineage
+
+SCHEMA = """
+    CREATE {temp} TABLE file_system_server_read_request (
+        time_inserted integer, id bigint, start integer, stop integer);
+    CREATE {temp} TABLE file_system_server_write_request (
+        hash bigint, time_inserted integer, start integer, data text);
+"""
+
+# Read and write ids are random 64-bit integers (see common/rand_util.h).
+BIG = 2 ** 62
+
+READS = [(3, BIG + 1, 0, 4), (2, BIG + 2, 1, 3), (3, 5, 2, 2)]
+WRITES = [(BIG + 10, 1, 0, "aaaa"), (BIG + 20, 2, 2, "bb")]
+
+def write(hash_, time):
+    return ("file_system_server", "write_request", hash_, time)
+
+def fill(cur):
+    for read in READS:
+        cur.execute("""
+            INSERT INTO file_system_server_read_request
+            VALUES (%s, %s, %s, %s);
+        """, read)
+    for w in WRITES:
+        cur.execute("""
+            INSERT INTO file_system_server_write_request
+            VALUES (%s, %s, %s, %s);
+        """, w)
+
+class ReadLineageTest(object):
+    # Run against the cursor self.cur by the subclasses below.
+    def test_read_lineage(self):
+        self.assertEqual(lineage.read_lineage(self.cur, BIG + 1),
+                         [write(BIG + 20, 2), write(BIG + 10, 1)])
+        self.assertEqual(lineage.read_lineage(self.cur, BIG + 2),
+                         [write(BIG + 10, 1)])
+
+    def test_read_lineage_batch(self):
+        self.assertEqual(
+            lineage.read_lineage_batch(self.cur, [BIG + 1, BIG + 2, 5]),
+            {BIG + 1: [write(BIG + 20, 2), write(BIG + 10, 1)],
+             BIG + 2: [write(BIG + 10, 1)],
+             5: []})
+
+class SqliteReadLineageTest(ReadLineageTest, unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "trace.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA.format(temp=""))
+        conn.close()
+
+        conn = sqlite_db.connect(path)
+        self.addCleanup(conn.close)
+        self.cur = conn.cursor()
+        fill(self.cur)
+
+@unittest.skipUnless(os.environ.get("FLUENT_TEST_DSN"),
+                     "FLUENT_TEST_DSN names no postgres database")
+class PostgresReadLineageTest(ReadLineageTest, unittest.TestCase):
+    def setUp(self):
+        # The tables are temporary, so they're dropped with the connection.
+        conn = psycopg2.connect(os.environ["FLUENT_TEST_DSN"])
+        self.addCleanup(conn.close)
+        self.cur = conn.cursor()
+        self.cur.execute(SCHEMA.format(temp="TEMPORARY"))
+        fill(self.cur)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,576 @@
+"""A columnar, memory-mapped archive of a lineage database.
+
+Analytics over a node's whole history shouldn't compete with the nodes
+writing to postgres, so export writes every `{node}_{collection}` table and
+every `{node}_lineage` table to its own file in an archive directory, along
+with a manifest.json holding the metadata of every node (see metadata.py):
+
+    python archive.py --dsn "dbname=vagrant" --out archive/
+
+Every file is laid out like the binary columnar format in columnar.py:
+
+    uint32    the length L of the JSON header below, in bytes
+    L bytes   a JSON header, padded with spaces so that the columns below
+              start at a multiple of 8 bytes
+    columns   one little-endian fixed-width array of `length` values per entry
+              [name, struct format] of the header's "columns", each padded
+              with zeros to a multiple of 8 bytes
+
+The header also has "min_time" and "max_time", the smallest and largest
+logical time in the file (or null if it's empty), so that readers can skip
+files that can't have what they're looking for.
+
+A collection file `{node}_{collection}.col` has the collection's rows sorted
+by (time_inserted, hash), in the columns
+
+    int64 hash, physical_time_inserted, physical_time_deleted
+    uint64 values_end
+    int32 time_inserted, time_deleted, by_hash
+
+where physical times are microseconds since the epoch (or -2**63 if null),
+time_deleted is -1 if null, and by_hash is the indexes of the rows sorted by
+(hash, time_inserted). The non-header columns of every row follow the
+columns as one JSON list per row; row i ends values_end[i] bytes in.
+Timestamps are ISO 8601 strings, and numerics (e.g. the numeric(20) columns
+that hold unsigned 64-bit integers) are decimal strings, which a JSON number
+would round.
+
+A lineage file `{node}_lineage.lin` has the node's lineage rows sorted by
+(collection_name, tuple_hash, time), in the columns
+
+    int64 tuple_hash, dep_tuple_hash, dep_node_id, dep_time, physical_time
+    int32 time, rule_number, by_dep
+    int16 collection, dep_collection
+    uint8 inserted
+
+where dep_time and rule_number are -1 if null and by_dep is the indexes of
+the rows sorted by (dep_node_id, dep_collection_name, dep_tuple_hash,
+dep_time). Collection names are codes into the header's sorted "collections"
+list.
+
+Archive reads an archive by memory-mapping its files, so that a lookup only
+touches the pages it needs:
+
+    archive = Archive("archive/")
+    archive.collection_at("node", "collection", 42)
+    archive.backwards_lineage("node", "collection", hash_, 42)
+"""
+
+import argparse
+import collections
+import datetime
+import decimal
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import psycopg2
+import psycopg2.tz
+
+import indexes
+import metadata
+
+NULL_TIME = -1
+NULL_MICROS = -2**63
+
+COLLECTION_COLUMNS = [
+    ("hash", "q"), ("physical_time_inserted", "q"),
+    ("physical_time_deleted", "q"), ("values_end", "Q"),
+    ("time_inserted", "i"), ("time_deleted", "i"), ("by_hash", "i"),
+]
+LINEAGE_COLUMNS = [
+    ("tuple_hash", "q"), ("dep_tuple_hash", "q"), ("dep_node_id", "q"),
+    ("dep_time", "q"), ("physical_time", "q"), ("time", "i"),
+    ("rule_number", "i"), ("by_dep", "i"), ("collection", "h"),
+    ("dep_collection", "h"), ("inserted", "B"),
+]
+
+UTC = psycopg2.tz.FixedOffsetTimezone(offset=0)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+def to_micros(dt):
+    if dt is None:
+        return NULL_MICROS
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+
+def from_micros(micros):
+    if micros == NULL_MICROS:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+def or_null(x, null):
+    return null if x is None else x
+
+def padding(n):
+    return "\0" * (-n % 8)
+
+def json_default(x):
+    if isinstance(x, (datetime.datetime, datetime.date)):
+        return x.isoformat()
+    elif isinstance(x, decimal.Decimal):
+        return str(x)
+    raise TypeError(repr(x))
+
+# Writing #####################################################################
+class _Column(object):
+    # The packed values of a column, spooled to a temporary file.
+    def __init__(self, name, format_):
+        self.name = name
+        self.format = format_
+        self.file = tempfile.TemporaryFile()
+
+    def extend(self, values):
+        self.file.write(struct.pack("<{}{}".format(len(values), self.format),
+                                    *values))
+
+def write_file(path, header, columns, length, blob=None):
+    header = dict(header, length=length,
+                  columns=[[c.name, c.format] for c in columns])
+    data = json.dumps(header)
+    data += " " * (-(4 + len(data)) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<I", len(data)))
+        f.write(data)
+        for c in columns:
+            c.file.seek(0)
+            shutil.copyfileobj(c.file, f)
+            f.write(padding(length * struct.calcsize(c.format)))
+            c.file.close()
+        if blob is not None:
+            blob.seek(0)
+            shutil.copyfileobj(blob, f)
+            blob.close()
+
+def widen(zone, times):
+    # The (min, max) zone map `zone` extended to cover `times`.
+    (low, high) = (min(times), max(times))
+    if zone[0] is None:
+        return (low, high)
+    return (min(zone[0], low), max(zone[1], high))
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def write_collection(path, node_name, collection_name, column_names, rows,
+                     by_hash, batch_size=10000):
+    """Write a collection file. `rows` are the rows of the collection's table
+    sorted by (time_inserted, hash), and `by_hash` their indexes sorted by
+    (hash, time_inserted). Both may be iterators."""
+    columns = collections.OrderedDict(
+        (name, _Column(name, format_))
+        for (name, format_) in COLLECTION_COLUMNS)
+    blob = tempfile.TemporaryFile()
+    (length, values_end, zone) = (0, 0, (None, None))
+    for batch in batches(rows, batch_size):
+        ends = []
+        for row in batch:
+            values = json.dumps(list(row[5:]), default=json_default)
+            blob.write(values)
+            values_end += len(values)
+            ends.append(values_end)
+        columns["hash"].extend([r[0] for r in batch])
+        columns["physical_time_inserted"].extend(
+            [to_micros(r[3]) for r in batch])
+        columns["physical_time_deleted"].extend(
+            [to_micros(r[4]) for r in batch])
+        columns["values_end"].extend(ends)
+        columns["time_inserted"].extend([r[1] for r in batch])
+        columns["time_deleted"].extend([or_null(r[2], NULL_TIME)
+                                        for r in batch])
+        zone = widen(zone, [r[1] for r in batch] +
+                     [r[2] for r in batch if r[2] is not None])
+        length += len(batch)
+    for batch in batches(by_hash, batch_size):
+        columns["by_hash"].extend(batch)
+
+    header = {
+        "kind": "collection",
+        "node_name": node_name,
+        "collection_name": collection_name,
+        "column_names": column_names,
+        "min_time": zone[0],
+        "max_time": zone[1],
+    }
+    write_file(path, header, columns.values(), length, blob)
+
+def write_lineage(path, node_name, collection_names, rows, by_dep,
+                  batch_size=10000):
+    """Write a lineage file. `rows` are (collection_name, tuple_hash, time,
+    dep_node_id, dep_collection_name, dep_tuple_hash, dep_time, rule_number,
+    inserted, physical_time) sorted by (collection_name, tuple_hash, time),
+    and `by_dep` their indexes sorted by (dep_node_id, dep_collection_name,
+    dep_tuple_hash, dep_time). `collection_names` has every collection name
+    in rows."""
+    collection_names = sorted(set(collection_names))
+    assert len(collection_names) < 2**15, len(collection_names)
+    codes = {name: i for (i, name) in enumerate(collection_names)}
+    columns = collections.OrderedDict(
+        (name, _Column(name, format_)) for (name, format_) in LINEAGE_COLUMNS)
+    (length, zone) = (0, (None, None))
+    for batch in batches(rows, batch_size):
+        columns["tuple_hash"].extend([r[1] for r in batch])
+        columns["dep_tuple_hash"].extend([r[5] for r in batch])
+        columns["dep_node_id"].extend([r[3] for r in batch])
+        columns["dep_time"].extend([or_null(r[6], NULL_TIME) for r in batch])
+        columns["physical_time"].extend([to_micros(r[9]) for r in batch])
+        columns["time"].extend([r[2] for r in batch])
+        columns["rule_number"].extend([or_null(r[7], -1) for r in batch])
+        columns["collection"].extend([codes[r[0]] for r in batch])
+        columns["dep_collection"].extend([codes[r[4]] for r in batch])
+        columns["inserted"].extend([int(r[8]) for r in batch])
+        zone = widen(zone, [r[2] for r in batch])
+        length += len(batch)
+    for batch in batches(by_dep, batch_size):
+        columns["by_dep"].extend(batch)
+
+    header = {
+        "kind": "lineage",
+        "node_name": node_name,
+        "collections": collection_names,
+        "min_time": zone[0],
+        "max_time": zone[1],
+    }
+    write_file(path, header, columns.values(), length)
+
+def stream(conn, query, args=None, batch_size=10000):
+    # The rows of a query, read through a server-side cursor.
+    with conn.cursor(name="archive") as cur:
+        cur.itersize = batch_size
+        cur.execute(query, args)
+        for row in cur:
+            yield row
+
+def export_collection(conn, directory, node_name, collection_name,
+                      column_names):
+    table = "{}_{}".format(node_name, collection_name)
+    rows = stream(conn, """
+        SELECT *
+        FROM {}
+        ORDER BY time_inserted, hash;
+    """.format(table))
+    by_hash = (i for (i,) in stream(conn, """
+        SELECT i
+        FROM (SELECT ROW_NUMBER() OVER (ORDER BY time_inserted, hash) - 1
+                       AS i,
+                     hash, time_inserted
+              FROM {}) R
+        ORDER BY hash, time_inserted;
+    """.format(table)))
+    write_collection(os.path.join(directory, table + ".col"), node_name,
+                     collection_name, column_names, rows, by_hash)
+
+def export_lineage(conn, directory, node_name):
+    table = "{}_lineage".format(node_name)
+    # Collection names are sorted bytewise, like python sorts them.
+    order = """
+        collection_name COLLATE "C", tuple_hash, time, dep_node_id,
+        dep_collection_name COLLATE "C", dep_tuple_hash, dep_time,
+        rule_number, inserted, physical_time
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT collection_name FROM {0}
+            UNION
+            SELECT dep_collection_name FROM {0};
+        """.format(table))
+        collection_names = [name for (name,) in cur.fetchall()]
+    rows = stream(conn, """
+        SELECT collection_name, tuple_hash, time, dep_node_id,
+               dep_collection_name, dep_tuple_hash, dep_time, rule_number,
+               inserted, physical_time
+        FROM {}
+        ORDER BY {};
+    """.format(table, order))
+    by_dep = (i for (i,) in stream(conn, """
+        SELECT i
+        FROM (SELECT ROW_NUMBER() OVER (ORDER BY {}) - 1 AS i, *
+              FROM {}) R
+        ORDER BY dep_node_id, dep_collection_name COLLATE "C",
+                 dep_tuple_hash, COALESCE(dep_time, %s);
+    """.format(order, table), (NULL_TIME,)))
+    write_lineage(os.path.join(directory, table + ".lin"), node_name,
+                  collection_names, rows, by_dep)
+
+def export(conn, directory, out=None):
+    """Export the lineage database on `conn` to an archive in `directory`,
+    writing a line per file to `out` if it isn't None. Every table is read
+    in the same snapshot."""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    with conn.cursor() as cur:
+        cache = metadata.MetadataCache()
+        cache.refresh(cur)
+    nodes = cache.all_nodes()
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump({"version": 1, "nodes": nodes}, f, indent=2)
+
+    for node in nodes:
+        exports = []
+        for (collection_name, collection) in node["collections"].items():
+            exports.append(("{}_{}".format(node["name"], collection_name),
+                            export_collection,
+                            (node["name"], collection_name,
+                             collection["column_names"])))
+        exports.append(("{}_lineage".format(node["name"]), export_lineage,
+                        (node["name"],)))
+        for (table, f, args) in exports:
+            with conn.cursor() as cur:
+                if not indexes.table_exists(cur, table):
+                    continue
+            start = time.time()
+            f(conn, directory, *args)
+            if out is not None:
+                out.write("{:<48} {:>8.2f}s\n".format(table,
+                                                      time.time() - start))
+    conn.rollback()
+
+# Reading #####################################################################
+def lower_bound(n, key, target):
+    # The first i in [0, n) with key(i) >= target, or n.
+    (lo, hi) = (0, n)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(mid) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def visible_at(time_inserted, time_deleted, time):
+    # The same as visible_at in main.py.
+    return ((time_inserted == time and time_inserted == time_deleted) or
+            (time_inserted <= time and (time_deleted is None or
+                                        time_deleted > time)))
+
+class ArchiveFile(object):
+    """A memory-mapped collection or lineage file."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (header_length,) = struct.unpack_from("<I", self._mmap, 0)
+        self.header = json.loads(self._mmap[4:4 + header_length])
+        self.length = self.header["length"]
+        self._columns = {}
+        offset = 4 + header_length
+        for (name, format_) in self.header["columns"]:
+            self._columns[name] = (offset, "<" + format_,
+                                   struct.calcsize(format_))
+            size = self.length * struct.calcsize(format_)
+            offset += size + len(padding(size))
+        self._blob_offset = offset
+
+    def get(self, column, i):
+        (offset, format_, size) = self._columns[column]
+        return struct.unpack_from(format_, self._mmap, offset + i * size)[0]
+
+    def slice(self, column, start, stop):
+        (offset, format_, size) = self._columns[column]
+        return struct.unpack_from("<{}{}".format(stop - start, format_[1:]),
+                                  self._mmap, offset + start * size)
+
+    def blob(self, start, stop):
+        return self._mmap[self._blob_offset + start:self._blob_offset + stop]
+
+    def close(self):
+        self._mmap.close()
+
+class CollectionFile(ArchiveFile):
+    def row(self, i):
+        """The i'th row, like a row of the collection's table."""
+        start = 0 if i == 0 else self.get("values_end", i - 1)
+        values = json.loads(self.blob(start, self.get("values_end", i)))
+        time_deleted = self.get("time_deleted", i)
+        return tuple([
+            self.get("hash", i),
+            self.get("time_inserted", i),
+            None if time_deleted == NULL_TIME else time_deleted,
+            from_micros(self.get("physical_time_inserted", i)),
+            from_micros(self.get("physical_time_deleted", i)),
+        ] + values)
+
+    def at(self, time):
+        """The rows of the tuples in the collection at logical time `time`,
+        sorted by (time_inserted, hash)."""
+        min_time = self.header["min_time"]
+        if min_time is None or time < min_time:
+            return []
+        # Only the rows inserted at or before `time` are read.
+        stop = lower_bound(self.length,
+                           lambda i: self.get("time_inserted", i), time + 1)
+        inserted = self.slice("time_inserted", 0, stop)
+        deleted = self.slice("time_deleted", 0, stop)
+        return [self.row(i) for i in xrange(stop)
+                if (inserted[i] == time and deleted[i] == time) or
+                   deleted[i] == NULL_TIME or deleted[i] > time]
+
+    def find(self, hash_, time=None, max_time=None):
+        """The row of the tuple `hash_` inserted at `time` or, if time is
+        None, the latest insertion at or before `max_time`. None if there
+        isn't one."""
+        key = lambda j: (self.get("hash", self.get("by_hash", j)),
+                         self.get("time_inserted", self.get("by_hash", j)))
+        if time is not None:
+            j = lower_bound(self.length, key, (hash_, time))
+            if j < self.length and key(j) == (hash_, time):
+                return self.row(self.get("by_hash", j))
+        else:
+            j = lower_bound(self.length, key, (hash_, max_time + 1)) - 1
+            if j >= 0 and key(j)[0] == hash_:
+                return self.row(self.get("by_hash", j))
+        return None
+
+class LineageFile(ArchiveFile):
+    def _code(self, collection_name):
+        collections_ = self.header["collections"]
+        i = lower_bound(len(collections_), lambda i: collections_[i],
+                        collection_name)
+        if i < len(collections_) and collections_[i] == collection_name:
+            return i
+        return None
+
+    def backwards(self, collection_name, hash_, time):
+        """The (dep_node_id, dep_collection_name, dep_tuple_hash, dep_time)
+        of every dependency of a tuple inserted at `time`."""
+        code = self._code(collection_name)
+        (min_time, max_time) = (self.header["min_time"],
+                                self.header["max_time"])
+        if (code is None or min_time is None or
+                not min_time <= time <= max_time):
+            return []
+        key = lambda i: (self.get("collection", i), self.get("tuple_hash", i),
+                         self.get("time", i))
+        deps = []
+        i = lower_bound(self.length, key, (code, hash_, time))
+        while i < self.length and key(i) == (code, hash_, time):
+            dep_time = self.get("dep_time", i)
+            deps.append((self.get("dep_node_id", i),
+                         self.header["collections"][
+                             self.get("dep_collection", i)],
+                         self.get("dep_tuple_hash", i),
+                         None if dep_time == NULL_TIME else dep_time))
+            i += 1
+        return deps
+
+    def forwards(self, dep_node_id, dep_collection_name, dep_hash, dep_time):
+        """The (collection_name, tuple_hash, time) of every tuple derived
+        from a tuple."""
+        code = self._code(dep_collection_name)
+        if code is None:
+            return []
+        def key(j):
+            i = self.get("by_dep", j)
+            return (self.get("dep_node_id", i), self.get("dep_collection", i),
+                    self.get("dep_tuple_hash", i), self.get("dep_time", i))
+        target = (dep_node_id, code, dep_hash, or_null(dep_time, NULL_TIME))
+        dependents = []
+        j = lower_bound(self.length, key, target)
+        while j < self.length and key(j) == target:
+            i = self.get("by_dep", j)
+            dependents.append((
+                self.header["collections"][self.get("collection", i)],
+                self.get("tuple_hash", i), self.get("time", i)))
+            j += 1
+        return dependents
+
+class Archive(object):
+    """An archive written by export. Files are opened the first time they're
+    needed and stay mapped until close.
+
+        archive = Archive("archive/")
+        for row in archive.collection_at("node", "collection", 42):
+            ...
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f,
+                                 object_pairs_hook=collections.OrderedDict)
+        self.nodes = collections.OrderedDict(
+            (node["name"], node) for node in manifest["nodes"])
+        self._node_names = {node["id"]: node["name"]
+                            for node in self.nodes.values()}
+        self._files = {}
+
+    def _file(self, cls, name):
+        if name not in self._files:
+            path = os.path.join(self.directory, name)
+            self._files[name] = cls(path) if os.path.exists(path) else None
+        return self._files[name]
+
+    def collection(self, node_name, collection_name):
+        return self._file(CollectionFile,
+                          "{}_{}.col".format(node_name, collection_name))
+
+    def lineage(self, node_name):
+        return self._file(LineageFile, "{}_lineage.lin".format(node_name))
+
+    def collection_at(self, node_name, collection_name, time):
+        f = self.collection(node_name, collection_name)
+        return [] if f is None else f.at(time)
+
+    def tuple_(self, node_name, collection_name, hash_, time=None,
+               max_time=None):
+        f = self.collection(node_name, collection_name)
+        return None if f is None else f.find(hash_, time, max_time)
+
+    def backwards_lineage(self, node_name, collection_name, hash_, time):
+        """The (node_name, collection_name, hash, time) of every dependency of
+        the tuple `hash_` as it was at logical time `time`."""
+        f = self.collection(node_name, collection_name)
+        t = None if f is None else f.find(hash_, max_time=time)
+        lineage = self.lineage(node_name)
+        if t is None or lineage is None or not visible_at(t[1], t[2], time):
+            return []
+        return [(self._node_names[node_id], c, h, t_)
+                for (node_id, c, h, t_) in lineage.backwards(collection_name,
+                                                             hash_, t[1])]
+
+    def forwards_lineage(self, node_name, collection_name, hash_, time):
+        """The (node_name, collection_name, hash, time) of every tuple derived
+        from the tuple `hash_` inserted at `time`, by any node."""
+        node_id = self.nodes[node_name]["id"]
+        dependents = []
+        for name in self.nodes:
+            lineage = self.lineage(name)
+            if lineage is not None:
+                dependents.extend((name, c, h, t) for (c, h, t) in
+                                  lineage.forwards(node_id, collection_name,
+                                                   hash_, time))
+        return dependents
+
+    def close(self):
+        for f in self._files.values():
+            if f is not None:
+                f.close()
+        self._files = {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    parser.add_argument("--out", required=True,
+                        help="The directory to write the archive to.")
+    args = parser.parse_args()
+
+    start = time.time()
+    export(psycopg2.connect(args.dsn), args.out, out=sys.stdout)
+    print "Archived to {} in {:.2f}s.".format(args.out, time.time() - start)
+
+if __name__ == "__main__":
+    main()
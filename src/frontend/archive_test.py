@@ -0,0 +1,91 @@
+import datetime
+import decimal
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import archive
+
+def physical_time(time):
+    return (datetime.datetime(2017, 6, 1, tzinfo=archive.UTC) +
+            datetime.timedelta(milliseconds=10 * time))
+
+# The rows of a collection `c` of node `n`, sorted by (time_inserted, hash):
+# 3 is inserted at 1 and deleted at 2, 1 is inserted at 1 and 3, and 2 is
+# inserted and deleted at 2.
+ROWS = [
+    (1, 1, 2, physical_time(1), physical_time(2), "a", 10),
+    (3, 1, None, physical_time(1), None, "c", 30),
+    (2, 2, 2, physical_time(2), physical_time(2), "b", 20),
+    (1, 3, None, physical_time(3), None, "a", 11),
+]
+
+# Tuple 1 inserted at 3 was derived from 2 and from network tuple 7 of node
+# m; 3 was derived from 1 inserted at 1.
+LINEAGE = [
+    ("c", 1, 3, 1, "c", 2, 2, 0, True, physical_time(3)),
+    ("c", 1, 3, 2, "d", 7, None, None, True, None),
+    ("c", 3, 1, 1, "c", 1, 1, 0, True, physical_time(1)),
+]
+
+def sorted_indexes(rows, key):
+    return [i for (i, _) in sorted(enumerate(rows), key=lambda r: key(r[1]))]
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump({"version": 1, "nodes": [
+                {"id": 1, "name": "n", "collections": {"c": {}}},
+                {"id": 2, "name": "m", "collections": {"d": {}}},
+            ]}, f)
+        archive.write_collection(
+            os.path.join(directory, "n_c.col"), "n", "c", ["s", "x"], ROWS,
+            sorted_indexes(ROWS, lambda r: (r[0], r[1])), batch_size=3)
+        archive.write_lineage(
+            os.path.join(directory, "n_lineage.lin"), "n", ["c", "d"],
+            LINEAGE,
+            sorted_indexes(LINEAGE, lambda r: (r[3], r[4], r[5], r[6])))
+        self.archive = archive.Archive(directory)
+        self.addCleanup(self.archive.close)
+
+    def test_point_in_time(self):
+        self.assertEqual(self.archive.collection_at("n", "c", 0), [])
+        self.assertEqual(self.archive.collection_at("n", "c", 1), ROWS[:2])
+        self.assertEqual(self.archive.collection_at("n", "c", 2), ROWS[1:3])
+        self.assertEqual(self.archive.collection_at("n", "c", 9),
+                         [ROWS[1], ROWS[3]])
+        self.assertEqual(self.archive.tuple_("n", "c", 1, time=1), ROWS[0])
+        self.assertEqual(self.archive.tuple_("n", "c", 1, max_time=9), ROWS[3])
+        self.assertEqual(self.archive.tuple_("n", "c", 1, time=2), None)
+        self.assertEqual(self.archive.tuple_("n", "d", 1, time=1), None)
+
+    def test_lineage(self):
+        lineage = self.archive.backwards_lineage("n", "c", 1, 5)
+        self.assertEqual(sorted(lineage),
+                         [("m", "d", 7, None), ("n", "c", 2, 2)])
+        self.assertEqual(self.archive.backwards_lineage("n", "c", 1, 2), [])
+        self.assertEqual(self.archive.backwards_lineage("n", "c", 3, 1),
+                         [("n", "c", 1, 1)])
+        self.assertEqual(self.archive.forwards_lineage("n", "c", 1, 1),
+                         [("n", "c", 3, 1)])
+        self.assertEqual(self.archive.forwards_lineage("m", "d", 7, None),
+                         [("n", "c", 1, 3)])
+        self.assertEqual(self.archive.forwards_lineage("n", "c", 2, 9), [])
+
+    def test_numerics_are_exact(self):
+        # numeric(20) columns hold unsigned 64-bit integers, which a double
+        # would round.
+        path = os.path.join(self.archive.directory, "n_e.col")
+        rows = [(1, 1, None, physical_time(1), None,
+                 decimal.Decimal(2 ** 64 - 1))]
+        archive.write_collection(path, "n", "e", ["x"], rows, [0])
+        f = archive.CollectionFile(path)
+        self.addCleanup(f.close)
+        self.assertEqual(f.row(0)[5], str(2 ** 64 - 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+
+# The SQL the frontend's queries need differs between databases in only a few
+# places: passing a list of keys to join against, looking up the latest
+# insertion of each key, converting timestamps, and listing column types. A
+# backend supplies those pieces along with the pool that the frontend checks
+# connections out of, and tells databases apart so that responses cached from
+# one are never served for another (see main.etag_).
+
+class PostgresBackend(object):
+    """The lineage database fluent nodes write to, through a
+    db.ConnectionPool.
+
+        backend = PostgresBackend(db.ConnectionPool("dbname=vagrant"))
+        (keys, args) = backend.keys([("hash", "bigint", [1, 2])])
+        cur.execute("SELECT K.i, K.hash FROM " + keys, args)
+    """
+    name = "postgres"
+
+    # Whether collections with sql black box lineage can be expanded. Their
+    # lineage is computed by plpgsql functions.
+    sql_lineage = True
+
+    # An expression that changes whenever a row of Nodes is replaced (see
+    # metadata.MetadataCache).
+    node_version = "xmin::text"
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._identity = None
+        self._identity_lock = threading.Lock()
+
+    def identity(self, get_conn):
+        """A string that identifies the database: the cluster's system
+        identifier, which initdb picks at random, and the database's name.
+        It's fetched once, with the connection `get_conn()` returns (e.g.
+        the request's, so that no second one is checked out of the pool)."""
+        with self._identity_lock:
+            if self._identity is None:
+                with get_conn().cursor() as cur:
+                    cur.execute("""
+                        SELECT system_identifier, current_database()
+                        FROM pg_control_system();
+                    """)
+                    self._identity = "postgres {} {}".format(*cur.fetchone())
+            return self._identity
+
+    def keys(self, columns):
+        """A relation K with one row for every key in `columns`, for use in a
+        FROM clause, and its arguments. `columns` is a list of (name, type,
+        values) triples, and K has a column for each named `name`, plus a
+        column `i` numbering the keys from 1."""
+        sql = "unnest({}) WITH ORDINALITY AS K({}, i)".format(
+            ", ".join("%s::{}[]".format(type_) for (_, type_, _) in columns),
+            ", ".join(name for (name, _, _) in columns))
+        return (sql, tuple(values for (_, _, values) in columns))
+
+    def latest_insertions(self, table, keys):
+        """A query for `K.i, T.*` where T is, for every key of `keys` (with
+        columns hash, time, and max_time), the row of `table` inserted at
+        K.time or, if K.time is NULL, the latest row inserted at or before
+        K.max_time."""
+        return """
+            SELECT K.i, T.*
+            FROM {},
+                 LATERAL (
+                   SELECT *
+                   FROM {} T
+                   WHERE T.hash = K.hash AND
+                         (T.time_inserted = K.time OR
+                          (K.time IS NULL AND T.time_inserted <= K.max_time))
+                   ORDER BY T.time_inserted DESC
+                   LIMIT 1
+                 ) T
+        """.format(keys, table)
+
+    def epoch_ms(self, column):
+        """SQL for a timestamp column in milliseconds since the epoch."""
+        return "(EXTRACT(EPOCH FROM {}) * 1000)::bigint".format(column)
+
+    def column_types(self, tables):
+        """A query for the (table, column, type) of every column of `tables`,
+        with table names in lower case and types named the way
+        information_schema.columns names them, and its arguments."""
+        query = """
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_name IN ({});
+        """.format(", ".join("%s" for _ in tables))
+        return (query, tuple(t.lower() for t in tables))
+
+class SqliteBackend(object):
+    """A single-file database exported from postgres by sqlite_db.py, through
+    a sqlite_db.ConnectionPool. Lookups run in-process, so there are no round
+    trips to a database server.
+
+        backend = SqliteBackend(sqlite_db.ConnectionPool("trace.db"))
+    """
+    name = "sqlite"
+    sql_lineage = False
+    node_version = "NULL"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def identity(self, get_conn):
+        # An exported file is never modified by the frontend, so a new export
+        # at the same path has a new modification time.
+        stat = os.stat(self.pool.path)
+        return "sqlite {} {}".format(os.path.abspath(self.pool.path),
+                                     stat.st_mtime)
+
+    def keys(self, columns):
+        # sqlite has no arrays, so the keys are passed as a JSON list of rows.
+        sql = "(SELECT {}, key + 1 AS i FROM json_each(%s)) AS K".format(
+            ", ".join("json_extract(value, '$[{}]') AS {}".format(j, name)
+                      for (j, (name, _, _)) in enumerate(columns)))
+        rows = zip(*[values for (_, _, values) in columns])
+        return (sql, (json.dumps(rows),))
+
+    def latest_insertions(self, table, keys):
+        # sqlite has no LATERAL joins, so we find the time of the insertion
+        # with a correlated subquery that the primary key answers.
+        return """
+            SELECT K.i, T.*
+            FROM {0}, {1} T
+            WHERE T.hash = K.hash AND T.time_inserted = (
+                    SELECT MAX(T2.time_inserted)
+                    FROM {1} T2
+                    WHERE T2.hash = K.hash AND
+                          (T2.time_inserted = K.time OR
+                           (K.time IS NULL AND
+                            T2.time_inserted <= K.max_time)))
+        """.format(keys, table)
+
+    def epoch_ms(self, column):
+        return ("CAST(ROUND((julianday({}) - 2440587.5) * 86400000) "
+                "AS INTEGER)".format(column))
+
+    def column_types(self, tables):
+        # sqlite_db.py declares columns with the postgres names of their
+        # types, which sqlite upper cases if it knows them, followed by
+        # words that only pick their affinity (e.g. "numeric text").
+        query = " UNION ALL ".join(
+            "SELECT %s, name, "
+            "lower(substr(type, 1, instr(type || ' ', ' ') - 1)) "
+            "FROM pragma_table_info(%s)"
+            for _ in tables) + ";"
+        return (query, tuple(x for t in tables for x in (t.lower(), t)))
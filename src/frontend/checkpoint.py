@@ -0,0 +1,267 @@
+"""Checkpointed snapshots of collections for fast time travel.
+
+Reading the state of a collection `c` of node `n` at logical time `t` means
+scanning the entire history in `n_c` for tuples that were alive at `t`, so
+reads get slower the longer a node runs. To avoid that, we periodically
+materialize the set of tuples alive at every K'th logical time:
+
+    -- One row for every checkpoint of every collection.
+    CREATE TABLE Checkpoints (
+        node_id         bigint  NOT NULL,
+        collection_name text    NOT NULL,
+        time            integer NOT NULL,
+        PRIMARY KEY (node_id, collection_name, time)
+    );
+
+    -- The (hash, time_inserted) keys of the tuples in n_c alive at `time`.
+    CREATE TABLE n_c_checkpoint (
+        time          integer NOT NULL,
+        hash          bigint  NOT NULL,
+        time_inserted integer NOT NULL,
+        PRIMARY KEY (time, hash, time_inserted)
+    );
+
+The state of `n_c` at time `t` is then the tuples in the latest checkpoint at
+or before `t` that haven't been deleted by `t`, plus the tuples inserted after
+the checkpoint that are visible at `t` (see execute_time_travel). Only times
+that a node has moved past are checkpointed, since the state of a node at its
+current time can still change.
+
+Checkpoints can be built once for an existing database or continuously by a
+background thread:
+
+    python checkpoint.py --dsn "dbname=vagrant" --interval 1000
+    python checkpoint.py --dsn "dbname=vagrant" --interval 1000 --watch 10
+"""
+
+import argparse
+import threading
+import time
+
+import psycopg2
+
+import db
+
+# Whether the Checkpoints table exists. Databases created before checkpoints
+# were introduced don't have it. scripts/reset_database.sql recreates it after
+# dropping it, so once we've found it, we don't look again.
+_catalog_exists = False
+
+def ensure_catalog(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS Checkpoints (
+            node_id         bigint  NOT NULL,
+            collection_name text    NOT NULL,
+            time            integer NOT NULL,
+            PRIMARY KEY (node_id, collection_name, time)
+        );
+    """)
+
+def ensure_checkpoint_table(cur, node_name, collection_name):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS {}_{}_checkpoint (
+            time          integer NOT NULL,
+            hash          bigint  NOT NULL,
+            time_inserted integer NOT NULL,
+            PRIMARY KEY (time, hash, time_inserted)
+        );
+    """.format(node_name, collection_name))
+
+def catalog_exists(cur):
+    global _catalog_exists
+    if not _catalog_exists:
+        cur.execute("SELECT to_regclass('checkpoints') IS NOT NULL;")
+        _catalog_exists = cur.fetchone()[0]
+    return _catalog_exists
+
+def nearest_checkpoint(cur, node_name, collection_name, time):
+    """The latest checkpoint time <= `time`, or None if there isn't one."""
+    if not catalog_exists(cur):
+        return None
+    cur.execute("""
+        SELECT MAX(C.time)
+        FROM Nodes N, Checkpoints C
+        WHERE N.name = %s AND N.id = C.node_id AND C.collection_name = %s AND
+              C.time <= %s;
+    """, (node_name, collection_name, time))
+    return cur.fetchone()[0]
+
+def time_travel_query(node_name, collection_name, checkpoint_time, time):
+    """A query (and its arguments) for the tuples in a collection at `time`.
+
+    If `checkpoint_time` is None, the query scans the collection's entire
+    history. Otherwise, it reads the checkpoint at `checkpoint_time` and only
+    the history after it. The rows returned are the rows of the collection's
+    table in either case.
+    """
+    table = "{}_{}".format(node_name, collection_name)
+    if checkpoint_time is None:
+        query = """
+            SELECT *
+            FROM {0}
+            WHERE (time_inserted = %s AND time_inserted = time_deleted) OR
+                  (time_inserted <= %s AND (time_deleted IS NULL OR
+                                            time_deleted > %s))
+        """.format(table)
+        return (query, (time, time, time))
+
+    # Every tuple in the checkpoint was inserted at or before the checkpoint
+    # and was alive right after it, so the two halves of the union are
+    # disjoint. The last disjunct picks up tuples inserted and deleted at
+    # `time` when `time` is the checkpoint time itself.
+    query = """
+        SELECT T.*
+        FROM {0}_checkpoint K, {0} T
+        WHERE K.time = %s AND K.hash = T.hash AND
+              K.time_inserted = T.time_inserted AND
+              (T.time_deleted IS NULL OR T.time_deleted > %s)
+        UNION ALL
+        SELECT *
+        FROM {0}
+        WHERE (time_inserted > %s AND
+               ((time_inserted = %s AND time_inserted = time_deleted) OR
+                (time_inserted <= %s AND (time_deleted IS NULL OR
+                                          time_deleted > %s)))) OR
+              (time_inserted = %s AND time_deleted = %s)
+    """.format(table)
+    return (query, (checkpoint_time, time, checkpoint_time, time, time, time,
+                    time, time))
+
+def execute_time_travel(cur, node_name, collection_name, time):
+    """Execute a query for the tuples in a collection at logical time `time`.
+
+    The nearest checkpoint is used if there is one. The results are left in
+    `cur` for the caller to fetch.
+    """
+    checkpoint_time = nearest_checkpoint(cur, node_name, collection_name, time)
+    cur.execute(*time_travel_query(node_name, collection_name,
+                                   checkpoint_time, time))
+
+def node_max_time(cur, node_name):
+    """The largest logical time at which `node_name` inserted or deleted a
+    tuple, or None if it hasn't yet."""
+    cur.execute("""
+        SELECT C.collection_name
+        FROM Nodes N, Collections C
+        WHERE N.name = %s AND N.id = C.node_id;
+    """, (node_name,))
+    collection_names = [t[0] for t in cur.fetchall()]
+    if len(collection_names) == 0:
+        return None
+
+    cur.execute("SELECT GREATEST({});".format(", ".join("""
+        (SELECT GREATEST(MAX(time_inserted), MAX(time_deleted)) FROM {}_{})
+    """.format(node_name, c) for c in collection_names)))
+    return cur.fetchone()[0]
+
+def build_checkpoints(cur, node_name, collection_name, interval, max_time):
+    """Checkpoint a collection at every multiple of `interval` that comes
+    after its latest checkpoint and before `max_time`. Returns the number of
+    checkpoints built."""
+    ensure_checkpoint_table(cur, node_name, collection_name)
+    cur.execute("SELECT id FROM Nodes WHERE name = %s;", (node_name,))
+    (node_id,) = cur.fetchone()
+
+    latest = nearest_checkpoint(cur, node_name, collection_name, max_time)
+    if latest is None:
+        checkpoint_time = interval
+    else:
+        checkpoint_time = (latest // interval + 1) * interval
+
+    num_built = 0
+    while checkpoint_time < max_time:
+        # Each checkpoint is built from the one before it, so building a
+        # checkpoint only reads the history since the previous checkpoint.
+        (query, args) = time_travel_query(node_name, collection_name, latest,
+                                          checkpoint_time)
+        cur.execute("""
+            INSERT INTO {}_{}_checkpoint (time, hash, time_inserted)
+            SELECT %s, L.hash, L.time_inserted
+            FROM ({}) L
+            WHERE L.time_deleted IS NULL OR L.time_deleted > %s;
+        """.format(node_name, collection_name, query),
+        (checkpoint_time,) + args + (checkpoint_time,))
+        cur.execute("""
+            INSERT INTO Checkpoints (node_id, collection_name, time)
+            VALUES (%s, %s, %s);
+        """, (node_id, collection_name, checkpoint_time))
+        latest = checkpoint_time
+        checkpoint_time += interval
+        num_built += 1
+    return num_built
+
+def build_all_checkpoints(conn, interval):
+    """Build missing checkpoints for every collection of every node. Each
+    collection is committed separately. Returns the number of checkpoints
+    built."""
+    with conn.cursor() as cur:
+        ensure_catalog(cur)
+        conn.commit()
+        cur.execute("""
+            SELECT N.name, C.collection_name
+            FROM Nodes N, Collections C
+            WHERE N.id = C.node_id
+            ORDER BY N.name, C.collection_name;
+        """)
+        node_collections = cur.fetchall()
+
+        num_built = 0
+        max_times = {}
+        for (node_name, collection_name) in node_collections:
+            if node_name not in max_times:
+                max_times[node_name] = node_max_time(cur, node_name)
+            if max_times[node_name] is None:
+                continue
+            num_built += build_checkpoints(cur, node_name, collection_name,
+                                           interval, max_times[node_name])
+            conn.commit()
+        return num_built
+
+class Checkpointer(threading.Thread):
+    """A daemon thread that builds checkpoints every `period` seconds using a
+    connection from `pool`."""
+    def __init__(self, pool, interval, period):
+        super(Checkpointer, self).__init__(name="checkpointer")
+        self.daemon = True
+        self.pool = pool
+        self.interval = interval
+        self.period = period
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                with self.pool.connection() as conn:
+                    build_all_checkpoints(conn, self.interval)
+            except (psycopg2.Error, db.PoolTimeout):
+                # The database may be unreachable or a node may be in the
+                # middle of creating its tables. Either way, we'll try again
+                # next period.
+                pass
+            self._stopped.wait(self.period)
+
+    def stop(self):
+        self._stopped.set()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build checkpoints for an existing lineage database.")
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    parser.add_argument("--interval", type=int, default=1000,
+                        help="Logical time between checkpoints.")
+    parser.add_argument("--watch", type=float, default=None,
+                        help="Keep building checkpoints every WATCH seconds.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    while True:
+        start = time.time()
+        num_built = build_all_checkpoints(conn, args.interval)
+        print "Built {} checkpoint(s) in {:.2f}s.".format(
+            num_built, time.time() - start)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    main()
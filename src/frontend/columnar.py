@@ -0,0 +1,152 @@
+"""A compact, columnar encoding of the tuples in a collection.
+
+/node_collection normally returns a collection's tuples as a list of rows,
+which repeats the five header columns (hash, time_inserted, time_deleted,
+physical_time_inserted, physical_time_deleted) for every tuple. With
+?format=columnar, the tuples are sorted by (time_inserted, hash) and sent in
+blocks of consecutive tuples, each with one list per column instead:
+
+    {
+      "type": ..., "column_names": ..., "lineage_type": ...,
+      "format": "columnar",
+      "blocks": [
+        {
+          "length": <number of tuples in the block>,
+          "columns": [
+            <hash of every tuple, as a string>,
+            <time_inserted, as deltas from the previous tuple's
+             time_inserted>,
+            <time_deleted - time_inserted, or null>,
+            <physical_time_inserted in milliseconds since the epoch, as
+             deltas from the previous tuple's physical_time_inserted>,
+            <physical_time_deleted - physical_time_inserted in
+             milliseconds, or null>,
+            <the first non-header column>,
+            ...
+          ]
+        },
+        ...
+      ]
+    }
+
+Sorting by time_inserted keeps the deltas small, and the first delta of a
+block is from 0. /node_collection and /node_snapshot stream a block per batch
+of tuples they read, so, like their rows, a collection is never held in
+memory. With ?format=columnar&encoding=binary, the header columns are instead
+sent as little-endian fixed-width arrays of absolute values:
+
+    uint32    the length L of the JSON header below, in bytes
+    L bytes   a JSON header like the one above, except that it has the
+              "length" n and "columns" of a single block in place of
+              "blocks", and "columns" only has the non-header columns;
+              padded with spaces so that the arrays below start at a
+              multiple of 8 bytes
+    int64[n]  hash
+    float64[n] physical_time_inserted, in milliseconds since the epoch
+    float64[n] physical_time_deleted, or NaN
+    int32[n]  time_inserted
+    int32[n]  time_deleted, or -1
+
+It's built in memory, so it's for API clients of /node_collection. The UI
+reads snapshots in the JSON encoding. fluent.decode_columnar and
+fluent.decode_columnar_binary in static/index.js decode the two.
+"""
+
+import decimal
+import struct
+
+import flask
+
+HEADER_COLUMNS = 5
+
+def postgres_epoch_ms(column):
+    return "(EXTRACT(EPOCH FROM {}) * 1000)::bigint".format(column)
+
+def query(time_travel_query, epoch_ms=postgres_epoch_ms):
+    """Wraps a query for the rows of a collection (see
+    checkpoint.time_travel_query) into a query for the rows encode_json and
+    encode_binary expect: sorted by (time_inserted, hash) and with the
+    physical times, in milliseconds since the epoch, appended. `epoch_ms`
+    returns the SQL for a timestamp column in milliseconds (see
+    backends.py)."""
+    return """
+        SELECT C.*, {}, {}
+        FROM ({}) C
+        ORDER BY C.time_inserted, C.hash
+    """.format(epoch_ms("C.physical_time_inserted"),
+               epoch_ms("C.physical_time_deleted"), time_travel_query)
+
+def deltas(xs):
+    return [x - prev for (prev, x) in zip([0] + xs[:-1], xs)]
+
+def offsets(xs, bases):
+    return [None if x is None else x - base for (x, base) in zip(xs, bases)]
+
+def escape_column(column):
+    # Every value in a column has the same type, so we only need to escape
+    # (see escape in main.py) columns of longs and decimals.
+    if any(type(x) in (long, decimal.Decimal) for x in column):
+        return [str(x) for x in column]
+    return list(column)
+
+def transpose(collection, rows):
+    columns = [list(c) for c in zip(*rows)]
+    if len(columns) == 0:
+        columns = [[] for _ in range(HEADER_COLUMNS + 2 +
+                                     len(collection["column_names"]))]
+    return columns
+
+def encode_block(collection, rows):
+    """The columnar JSON encoding of a block of `rows`, fetched with
+    query(...), of a collection with metadata `collection`, as a string."""
+    columns = transpose(collection, rows)
+    (hashes, times_inserted, times_deleted) = columns[:3]
+    (physical_inserted, physical_deleted) = columns[-2:]
+    return flask.json.dumps({
+        "length": len(rows),
+        "columns": [
+            [str(h) for h in hashes],
+            deltas(times_inserted),
+            offsets(times_deleted, times_inserted),
+            deltas(physical_inserted),
+            offsets(physical_deleted, physical_inserted),
+        ] + [escape_column(c) for c in columns[HEADER_COLUMNS:-2]],
+    })
+
+def encode_json(collection, rows):
+    """The columnar JSON encoding of `rows`, fetched with query(...), of a
+    collection with metadata `collection`, as a string, in a single block."""
+    encoded = dict(collection)
+    encoded["format"] = "columnar"
+    header = flask.json.dumps(encoded)
+    blocks = [encode_block(collection, rows)] if len(rows) > 0 else []
+    return header[:-1] + ', "blocks": [' + ",".join(blocks) + "]}"
+
+def encode_binary(collection, rows):
+    """The columnar binary encoding of `rows`, fetched with query(...), of a
+    collection with metadata `collection`, as a string of bytes."""
+    columns = transpose(collection, rows)
+    (hashes, times_inserted, times_deleted) = columns[:3]
+    (physical_inserted, physical_deleted) = columns[-2:]
+
+    header = dict(collection)
+    header["format"] = "columnar"
+    header["length"] = len(rows)
+    header["columns"] = [escape_column(c)
+                         for c in columns[HEADER_COLUMNS:-2]]
+    header = flask.json.dumps(header).encode("utf-8")
+    header += b" " * (-(4 + len(header)) % 8)
+
+    n = len(rows)
+    nan = float("nan")
+    return b"".join([
+        struct.pack("<I", len(header)),
+        header,
+        struct.pack("<{}q".format(n), *hashes),
+        struct.pack("<{}d".format(n), *physical_inserted),
+        struct.pack("<{}d".format(n), *[nan if t is None else t
+                                        for t in physical_deleted]),
+        struct.pack("<{}i".format(n), *times_inserted),
+        struct.pack("<{}i".format(n), *[-1 if t is None else t
+                                        for t in times_deleted]),
+    ])
@@ -0,0 +1,87 @@
+"""Compare the size and serialization time of collection encodings.
+
+A collection of `--tuples` tuples (1,000,000 by default) with an int and a
+string column is generated in memory, shaped like the rows psycopg2 returns,
+and serialized the way /node_collection serializes it with and without
+?format=columnar (see columnar.py), in a single block. For example,
+
+    python columnar_bench.py --tuples 1000000
+
+prints a CSV of encoding, bytes, gzipped bytes, and seconds.
+"""
+
+import argparse
+import datetime
+import random
+import time
+import zlib
+
+import psycopg2.tz
+
+import columnar
+import main
+
+def collection(num_tuples, deleted_fraction=0.1):
+    # Returns the rows of a collection as fetched for the row format and as
+    # fetched for the columnar format (see columnar.query).
+    utc = psycopg2.tz.FixedOffsetTimezone(offset=0)
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=utc)
+    start = datetime.datetime(2017, 6, 1, tzinfo=utc)
+    ms = lambda t: None if t is None else \
+        int((t - epoch).total_seconds() * 1000)
+
+    rows = []
+    columnar_rows = []
+    for i in range(num_tuples):
+        hash_ = long(random.getrandbits(64) - 2**63)
+        time_inserted = i // 10
+        physical_inserted = start + datetime.timedelta(milliseconds=i)
+        if random.random() < deleted_fraction:
+            time_deleted = time_inserted + random.randint(0, 100)
+            physical_deleted = physical_inserted + datetime.timedelta(
+                milliseconds=random.randint(0, 1000))
+        else:
+            (time_deleted, physical_deleted) = (None, None)
+        row = (hash_, time_inserted, time_deleted, physical_inserted,
+               physical_deleted, i, "tuple {}".format(i))
+        rows.append(row)
+        columnar_rows.append(row + (ms(physical_inserted),
+                                    ms(physical_deleted)))
+    return (rows, columnar_rows)
+
+def encode_rows(collection, rows):
+    # The same as node_collection_.
+    encoded = dict(collection)
+    encoded["tuples"] = [[main.escape(x) for x in t] for t in rows]
+    return main.flask.json.dumps(encoded)
+
+def bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tuples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    (rows, columnar_rows) = collection(args.tuples)
+    metadata = {
+        "type": "Table",
+        "column_names": ["i", "s"],
+        "lineage_type": "regular",
+    }
+    encodings = [
+        ("rows", lambda: encode_rows(metadata, rows)),
+        ("columnar", lambda: columnar.encode_json(metadata, columnar_rows)),
+        ("columnar binary",
+         lambda: columnar.encode_binary(metadata, columnar_rows)),
+    ]
+
+    print "encoding,bytes,gzipped bytes,seconds"
+    with main.app.app_context():
+        for (name, encode) in encodings:
+            start = time.time()
+            data = encode()
+            seconds = time.time() - start
+            print "{},{},{},{:.3f}".format(name, len(data),
+                                           len(zlib.compress(data, 6)),
+                                           seconds)
+
+if __name__ == "__main__":
+    bench()
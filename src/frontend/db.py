@@ -0,0 +1,153 @@
+import contextlib
+import threading
+import time
+
+import psycopg2
+
+# Errors after which a connection can no longer be trusted and should be
+# thrown away rather than returned to the pool.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool(object):
+    """A thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily: constructing a pool never touches the
+    database, so the frontend can start even if postgres is unreachable. At
+    most `maxconn` connections are open at once; a thread that wants a
+    connection when all of them are checked out blocks for up to `timeout`
+    seconds. Idle connections beyond the first `minconn` are closed once they
+    have been idle for `max_idle` seconds. Connections use `cursor_factory`
+    (e.g. an instrumented cursor class) if it isn't None.
+
+    A connection that has been idle for longer than `check_after` seconds is
+    pinged with `SELECT 1` before it is handed out. If the ping fails (e.g.
+    because postgres was restarted), the connection is transparently replaced
+    with a fresh one.
+
+        pool = ConnectionPool("dbname=vagrant", minconn=1, maxconn=8)
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+    """
+    def __init__(self, dsn, minconn=1, maxconn=8, timeout=30.0,
+                 check_after=10.0, max_idle=300.0, cursor_factory=None):
+        assert 0 <= minconn <= maxconn, (minconn, maxconn)
+        assert maxconn > 0, maxconn
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self.cursor_factory = cursor_factory
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = [] # (connection, time last returned) pairs.
+        self._size = 0  # The number of open or opening connections.
+
+    def getconn(self):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            while len(self._idle) == 0 and self._size >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout("no connection available after {}s"
+                                      .format(self.timeout))
+                self._cond.wait(remaining)
+
+            if len(self._idle) > 0:
+                (conn, last_used) = self._idle.pop()
+            else:
+                (conn, last_used) = (None, None)
+                self._size += 1
+
+        try:
+            if conn is not None and not self._healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = psycopg2.connect(self.dsn,
+                                        cursor_factory=self.cursor_factory)
+            return conn
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            # End the transaction psycopg2 implicitly opened so that the
+            # connection does not sit idle in transaction while pooled.
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed:
+                self._close(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.time()))
+                self._prune()
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            self.putconn(conn, discard=True)
+            raise
+        except:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            for (conn, _) in self._idle:
+                self._close(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle)}
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prune(self):
+        # Must be called with self._cond held. self._idle is used as a stack,
+        # so the connections idle the longest are at the front.
+        now = time.time()
+        while (len(self._idle) > self.minconn and
+               now - self._idle[0][1] > self.max_idle):
+            (conn, _) = self._idle.pop(0)
+            self._close(conn)
+            self._size -= 1
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
@@ -0,0 +1,200 @@
+"""Create the indexes the frontend's queries rely on.
+
+The tables a fluent node creates (see lineagedb/pqxx_client.h) are only
+indexed on their primary keys. For every node `n` and collection `c`
+registered in Nodes and Collections, we create
+
+    - indexes on n_c(time_inserted) and n_c(time_deleted), used to read the
+      tuples inserted or deleted in an interval of logical time (e.g. by
+      /node_collection_delta and checkpointed time travel); and
+    - an index on n_lineage(collection_name, tuple_hash, time), used to look
+      up the lineage of a tuple; and
+    - an index on n_lineage(dep_node_id, dep_collection_name, dep_tuple_hash,
+      dep_time), used to look up the tuples derived from a tuple; and
+    - an index on n_lineage(time), used to read the lineage of the tuples
+      inserted in an interval of logical time (e.g. by /live_tail); and
+    - an index on every user column of n_c with a searchable type (see
+      value_search.py), used to find tuples by value (by /search). Text
+      columns of unbounded length are indexed by their md5, since nodes
+      couldn't insert long values into a plain index on them, and plain
+      indexes on them that we created before are dropped.
+
+A python black box lineage script can also list indexes for its own queries
+in a global INDEXES of (table, index, definition) triples, e.g.
+
+    INDEXES = [("n_c", "n_c_x_idx", "USING gist (int4range(x, x + 1))")]
+
+which are created along with ours.
+
+Every representative query is timed before and after the indexes are created.
+
+    python indexes.py --dsn "dbname=vagrant"
+"""
+
+import argparse
+import sys
+import time
+
+import psycopg2
+
+import value_search
+
+# The table, and the (name, columns) of the indexes to create on it, for a
+# collection of a node and for the lineage of a node.
+def collection_indexes(node_name, collection_name):
+    table = "{}_{}".format(node_name, collection_name)
+    return (table, [(table + "_time_inserted_idx", "time_inserted"),
+                    (table + "_time_deleted_idx", "time_deleted")])
+
+def lineage_indexes(node_name):
+    table = "{}_lineage".format(node_name)
+    return (table, [(table + "_tuple_idx",
+                     "collection_name, tuple_hash, time"),
+                    (table + "_dep_idx",
+                     "dep_node_id, dep_collection_name, dep_tuple_hash, "
+                     "dep_time"),
+                    (table + "_time_idx", "time")])
+
+def column_types(cur, table):
+    """The (name, type) of every column of a table, with types named the way
+    information_schema.columns names them."""
+    cur.execute("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position;
+    """, (table.lower(),))
+    return cur.fetchall()
+
+def table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cur.fetchone()[0]
+
+def node_collections(cur):
+    """A dict mapping every node name to a list of its collection names."""
+    cur.execute("""
+        SELECT N.name, C.collection_name
+        FROM Nodes N LEFT OUTER JOIN Collections C ON N.id = C.node_id
+        ORDER BY N.name, C.collection_name;
+    """)
+    collections = {}
+    for (node_name, collection_name) in cur.fetchall():
+        collections.setdefault(node_name, [])
+        if collection_name is not None:
+            collections[node_name].append(collection_name)
+    return collections
+
+def script_indexes(cur):
+    """The (table, index, definition) of every index listed by a python
+    black box lineage script."""
+    cur.execute("""
+        SELECT name, python_lineage_script
+        FROM Nodes
+        WHERE python_lineage_script IS NOT NULL;
+    """)
+    indexes = []
+    for (node_name, script) in cur.fetchall():
+        namespace = {"__name__": "{}_lineage".format(node_name)}
+        exec compile(script, "<{} lineage>".format(node_name), "exec") \
+            in namespace
+        indexes += namespace.get("INDEXES", [])
+    return indexes
+
+def time_query(cur, query, args, repeat=3):
+    """The fastest of `repeat` executions of a query, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        cur.execute(query, args)
+        cur.fetchall()
+        elapsed = (time.time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def collection_probe(cur, table):
+    """A query typical of the frontend's reads of `table`, or None if the
+    table is empty."""
+    cur.execute("SELECT MAX(time_inserted) FROM {};".format(table))
+    (max_time,) = cur.fetchone()
+    if max_time is None:
+        return None
+    query = """
+        SELECT *
+        FROM {}
+        WHERE (time_inserted >= %s AND time_inserted <= %s) OR
+              (time_deleted >= %s AND time_deleted <= %s);
+    """.format(table)
+    return (query, (max_time - 1, max_time, max_time - 1, max_time))
+
+def lineage_probe(cur, table):
+    cur.execute("""
+        SELECT collection_name, tuple_hash, time
+        FROM {}
+        LIMIT 1;
+    """.format(table))
+    rows = cur.fetchall()
+    if len(rows) == 0:
+        return None
+    query = """
+        SELECT *
+        FROM {}
+        WHERE collection_name = %s AND tuple_hash = %s AND time = %s;
+    """.format(table)
+    return (query, rows[0])
+
+def ensure_indexes(conn, out=sys.stdout):
+    """Create every missing index, committing after each table, and write the
+    latency of a typical query on each table before and after to `out`."""
+    with conn.cursor() as cur:
+        tables = []
+        obsolete = {}
+        for (node_name, collection_names) in sorted(node_collections(cur)
+                                                    .items()):
+            for collection_name in collection_names:
+                (table, indexes) = collection_indexes(node_name,
+                                                      collection_name)
+                types = column_types(cur, table)
+                indexes += value_search.value_indexes(table, types)
+                obsolete[table] = value_search.obsolete_indexes(table, types)
+                tables.append(((table, indexes), collection_probe))
+            tables.append((lineage_indexes(node_name), lineage_probe))
+
+        ms = lambda t: "-" if t is None else "{:.2f}".format(t)
+        out.write("{:<48} {:>12} {:>12}\n".format("table", "before (ms)",
+                                                  "after (ms)"))
+        for ((table, indexes), make_probe) in tables:
+            if not table_exists(cur, table):
+                continue
+
+            probe = make_probe(cur, table)
+            before = None if probe is None else time_query(cur, *probe)
+            for index in obsolete.get(table, []):
+                cur.execute("DROP INDEX IF EXISTS {};".format(index))
+            for (index, columns) in indexes:
+                cur.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({});"
+                            .format(index, table, columns))
+            cur.execute("ANALYZE {};".format(table))
+            conn.commit()
+            after = None if probe is None else time_query(cur, *probe)
+            conn.rollback()
+
+            out.write("{:<48} {:>12} {:>12}\n".format(table, ms(before),
+                                                      ms(after)))
+
+        for (table, index, definition) in script_indexes(cur):
+            if not table_exists(cur, table):
+                continue
+            cur.execute("CREATE INDEX IF NOT EXISTS {} ON {} {};"
+                        .format(index, table, definition))
+            cur.execute("ANALYZE {};".format(table))
+            conn.commit()
+            out.write("{:<48} {:>12} {:>12}\n".format(index, "-", "-"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    args = parser.parse_args()
+    ensure_indexes(psycopg2.connect(args.dsn))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Per-request instrumentation of the frontend.
+
+Every request is given a Profile that records the SQL statements it executes,
+the rows it fetches, and the time it spends executing SQL and serializing
+JSON. The profile follows the request into the worker threads it uses (see
+using), and finished profiles are aggregated per endpoint by Metrics, which
+renders them in the Prometheus text format.
+
+SQL is recorded by Cursor, a psycopg2 cursor class that the connection pool
+installs on every connection, and JSON serialization by JSONEncoder, which
+the flask app uses to serialize every response. If a profile is created with
+explain=True, every SELECT is also run with EXPLAIN ANALYZE and its plan is
+recorded.
+"""
+
+import contextlib
+import threading
+import time
+
+import flask
+import psycopg2.extensions
+
+_local = threading.local()
+
+class Profile(object):
+    """The SQL statements executed, and the time spent executing SQL and
+    serializing JSON, on behalf of one request. Profiles are shared by the
+    threads working on the request, so they are thread-safe."""
+    def __init__(self, explain=False):
+        self.explain = explain
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self.statements = []
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.json_seconds = 0.0
+
+    def add_statement(self, query, seconds, plan=None):
+        statement = {
+            "query": " ".join(query.split()),
+            "seconds": seconds,
+            "rows": 0,
+        }
+        if plan is not None:
+            statement["plan"] = plan
+        with self._lock:
+            self.statements.append(statement)
+            self.sql_seconds += seconds
+        return statement
+
+    def add_fetch(self, statement, rows, seconds):
+        with self._lock:
+            if statement is not None:
+                statement["rows"] += rows
+                statement["seconds"] += seconds
+            self.rows += rows
+            self.sql_seconds += seconds
+
+    def add_json(self, seconds):
+        with self._lock:
+            self.json_seconds += seconds
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def report(self):
+        with self._lock:
+            return {
+                "seconds": self.elapsed(),
+                "sql_seconds": self.sql_seconds,
+                "json_seconds": self.json_seconds,
+                "rows": self.rows,
+                "statements": list(self.statements),
+            }
+
+def current():
+    """The profile of the request the current thread is working on, or
+    None."""
+    return getattr(_local, "profile", None)
+
+def start(explain=False):
+    _local.profile = Profile(explain)
+    return _local.profile
+
+def finish():
+    profile = current()
+    _local.profile = None
+    return profile
+
+@contextlib.contextmanager
+def using(profile):
+    """Record into `profile` from the current thread, e.g. a worker thread
+    running a query on behalf of a request."""
+    previous = current()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+class Cursor(psycopg2.extensions.cursor):
+    """A cursor that records its statements and fetches into the current
+    profile. It works both as a client-side and as a named cursor."""
+    _statement = None
+
+    def execute(self, query, vars=None):
+        profile = current()
+        if profile is None:
+            return super(Cursor, self).execute(query, vars)
+
+        start = time.time()
+        result = super(Cursor, self).execute(query, vars)
+        seconds = time.time() - start
+        plan = None
+        if profile.explain and query.lstrip().upper().startswith(
+                ("SELECT", "WITH")):
+            plan = self._explain(query, vars)
+        self._statement = profile.add_statement(query, seconds, plan)
+        return result
+
+    def _explain(self, query, vars):
+        # EXPLAIN ANALYZE runs the statement again, on a plain cursor so that
+        # it isn't recorded itself.
+        sql = self.mogrify(query, vars)
+        with self.connection.cursor(
+                cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute("EXPLAIN ANALYZE " + sql)
+            return [row[0] for row in cur.fetchall()]
+
+    def _fetch(self, fetch, count):
+        profile = current()
+        if profile is None:
+            return fetch()
+        start = time.time()
+        rows = fetch()
+        profile.add_fetch(self._statement, count(rows), time.time() - start)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super(Cursor, self).fetchone,
+                           lambda row: 0 if row is None else 1)
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        return self._fetch(lambda: super(Cursor, self).fetchmany(size), len)
+
+    def fetchall(self):
+        return self._fetch(super(Cursor, self).fetchall, len)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield row
+
+class JSONEncoder(flask.json.JSONEncoder):
+    """flask's JSON encoder, timed."""
+    def encode(self, o):
+        profile = current()
+        if profile is None:
+            return super(JSONEncoder, self).encode(o)
+        start = time.time()
+        s = super(JSONEncoder, self).encode(o)
+        profile.add_json(time.time() - start)
+        return s
+
+# The upper bounds, in seconds, of the latency histogram's buckets.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Metrics(object):
+    """Per-endpoint request latency histograms and SQL and JSON totals."""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, seconds, profile):
+        # SQL time is summed across the threads working on a request, so it
+        # can exceed the request's latency.
+        python_seconds = max(0.0, seconds - profile.sql_seconds -
+                             profile.json_seconds)
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "seconds": 0.0,
+                    "statements": 0,
+                    "rows": 0,
+                    "sql_seconds": 0.0,
+                    "json_seconds": 0.0,
+                    "python_seconds": 0.0,
+                }
+            e = self._endpoints[endpoint]
+            for (i, bound) in enumerate(self.buckets):
+                if seconds <= bound:
+                    e["buckets"][i] += 1
+            e["count"] += 1
+            e["seconds"] += seconds
+            e["statements"] += len(profile.statements)
+            e["rows"] += profile.rows
+            e["sql_seconds"] += profile.sql_seconds
+            e["json_seconds"] += profile.json_seconds
+            e["python_seconds"] += python_seconds
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            endpoints = sorted((name, dict(e, buckets=list(e["buckets"])))
+                               for (name, e) in self._endpoints.items())
+
+        lines = []
+        def metric(name, type_, help_):
+            lines.append("# HELP {} {}".format(name, help_))
+            lines.append("# TYPE {} {}".format(name, type_))
+
+        name = "fluent_request_duration_seconds"
+        metric(name, "histogram", "Request latency.")
+        for (endpoint, e) in endpoints:
+            for (bound, count) in zip(self.buckets, e["buckets"]):
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'
+                             .format(name, endpoint, bound, count))
+            lines.append('{}_bucket{{endpoint="{}",le="+Inf"}} {}'
+                         .format(name, endpoint, e["count"]))
+            lines.append('{}_sum{{endpoint="{}"}} {!r}'
+                         .format(name, endpoint, e["seconds"]))
+            lines.append('{}_count{{endpoint="{}"}} {}'
+                         .format(name, endpoint, e["count"]))
+
+        for (key, name, help_) in [
+                ("statements", "fluent_sql_statements_total",
+                 "SQL statements executed."),
+                ("rows", "fluent_sql_rows_fetched_total", "Rows fetched."),
+                ("sql_seconds", "fluent_sql_seconds_total",
+                 "Time spent executing SQL and fetching rows."),
+                ("json_seconds", "fluent_json_seconds_total",
+                 "Time spent serializing JSON."),
+                ("python_seconds", "fluent_python_seconds_total",
+                 "Time spent in neither SQL nor JSON serialization.")]:
+            metric(name, "counter", help_)
+            for (endpoint, e) in endpoints:
+                lines.append('{}{{endpoint="{}"}} {!r}'
+                             .format(name, endpoint, e[key]))
+        return "\n".join(lines) + "\n"
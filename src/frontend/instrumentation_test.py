@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+import instrumentation
+
+class MetricsTest(unittest.TestCase):
+    def test_prometheus(self):
+        profile = instrumentation.Profile()
+        statement = profile.add_statement("SELECT *\n  FROM t;", 0.25)
+        profile.add_fetch(statement, 3, 0.25)
+        profile.add_json(0.5)
+        self.assertEqual(statement["query"], "SELECT * FROM t;")
+        self.assertEqual(statement["rows"], 3)
+
+        metrics = instrumentation.Metrics(buckets=[1.0, 2.0])
+        metrics.observe("nodes", 1.5, profile)
+        metrics.observe("nodes", 0.5, instrumentation.Profile())
+        lines = metrics.prometheus().splitlines()
+        for line in [
+                'fluent_request_duration_seconds_bucket{endpoint="nodes",'
+                'le="1.0"} 1',
+                'fluent_request_duration_seconds_bucket{endpoint="nodes",'
+                'le="2.0"} 2',
+                'fluent_request_duration_seconds_bucket{endpoint="nodes",'
+                'le="+Inf"} 2',
+                'fluent_request_duration_seconds_count{endpoint="nodes"} 2',
+                'fluent_sql_statements_total{endpoint="nodes"} 1',
+                'fluent_sql_rows_fetched_total{endpoint="nodes"} 3',
+                'fluent_sql_seconds_total{endpoint="nodes"} 0.5',
+                'fluent_python_seconds_total{endpoint="nodes"} 1.0']:
+            self.assertIn(line, lines)
+
+    def test_profile_follows_request_into_threads(self):
+        profile = instrumentation.start()
+        self.addCleanup(instrumentation.finish)
+
+        seen = []
+        def worker():
+            seen.append(instrumentation.current())
+            with instrumentation.using(profile):
+                seen.append(instrumentation.current())
+            seen.append(instrumentation.current())
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None, profile, None])
+
+if __name__ == "__main__":
+    unittest.main()
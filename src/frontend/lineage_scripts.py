@@ -0,0 +1,56 @@
+import threading
+
+class ScriptCache(object):
+    """A thread-safe cache of compiled python black box lineage scripts.
+
+    A node registers a python script whose methods compute the lineage of its
+    black box collections (see RegisterBlackBoxPythonLineageScript in
+    fluent/fluent_executor.h). Compiling and running the script is expensive
+    relative to the lineage query itself, so we do it once per node and
+    script: entries are keyed by node name and tagged with a hash of the
+    script's contents. If a node's stored script changes, its hash changes,
+    and the stale entry is replaced the next time it's looked up.
+
+        cache = ScriptCache()
+        namespace = cache.get("node", script_hash, lambda: script)
+        lineage = namespace["read_lineage"](cur, id_)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._namespaces = {} # node name -> (script hash, namespace)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, node_name, script_hash, load_script):
+        """The namespace of node_name's script, whose contents hash to
+        script_hash. On a miss, load_script() is called to fetch the script.
+        """
+        with self._lock:
+            entry = self._namespaces.get(node_name)
+            if entry is not None and entry[0] == script_hash:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # We exec the script into a plain dict rather than a module because
+        # python 2 clears a module's globals when the module is garbage
+        # collected, which would break the methods we hand out.
+        code = compile(load_script(), "<{} lineage>".format(node_name), "exec")
+        namespace = {"__name__": "{}_lineage".format(node_name)}
+        exec code in namespace
+
+        with self._lock:
+            self._namespaces[node_name] = (script_hash, namespace)
+        return namespace
+
+    def clear(self):
+        with self._lock:
+            self._namespaces = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._namespaces),
+            }
@@ -0,0 +1,285 @@
+"""Live tailing of nodes with postgres notifications.
+
+To follow a running node without polling its tables, ensure_triggers
+installs triggers on the node's tables that notify the `fluent_tail` channel
+with the node's name and the logical time of every insert, delete, and
+lineage row a node commits:
+
+    CREATE TRIGGER n_c_tail_insert AFTER INSERT ON n_c
+    FOR EACH ROW EXECUTE PROCEDURE fluent_tail_notify('n', 'time_inserted');
+
+postgres only folds identical notifications sent by one transaction into one,
+and nodes commit every statement on its own (see PqxxClient), so a node sends
+a notification per row it writes. A single Tail thread per frontend listens
+on the channel and tracks the max logical time of every node, and any number
+of viewers wait on it (see Tail.wait) rather than on the database.
+
+A node can commit more rows at its current logical time, so a time is only
+complete, and sent to viewers, once the node has moved past it. Viewers that
+follow a node in step want the same ticks at the same time, so Tail.ticks
+fetches each range of ticks once and hands it to all of them.
+
+Creating a trigger locks a table against the node writing to it and needs
+the table's owner, so the frontend never does it. Install the triggers for
+every node of an existing database with
+
+    python live.py --dsn "dbname=vagrant"
+
+or `python main.py --ensure-indexes`, and again after new nodes start. The
+tail polls the max logical time of nodes without triggers instead.
+"""
+
+import argparse
+import collections
+import select
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import checkpoint
+import db
+import indexes
+
+CHANNEL = "fluent_tail"
+
+NOTIFY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION fluent_tail_notify() RETURNS trigger AS $$
+    BEGIN
+      PERFORM pg_notify('fluent_tail',
+                        TG_ARGV[0] || ' ' || (to_jsonb(NEW) ->> TG_ARGV[1]));
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+def triggers(node_name, collection_names):
+    """The (table, trigger, event, time column) of every trigger to install
+    for a node."""
+    for collection_name in collection_names:
+        table = "{}_{}".format(node_name, collection_name)
+        yield (table, table + "_tail_insert", "INSERT", "time_inserted")
+        yield (table, table + "_tail_delete", "UPDATE OF time_deleted",
+               "time_deleted")
+    table = "{}_lineage".format(node_name)
+    yield (table, table + "_tail_insert", "INSERT", "time")
+
+def triggers_installed(cur, node_name, collection_names):
+    """Whether every notification trigger of a node's existing tables is
+    installed."""
+    names = [trigger for (table, trigger, _, _) in triggers(node_name,
+                                                            collection_names)
+             if indexes.table_exists(cur, table)]
+    cur.execute("""
+        SELECT COUNT(DISTINCT tgname)
+        FROM pg_trigger
+        WHERE tgname = ANY(%s);
+    """, (names,))
+    return cur.fetchone()[0] == len(names)
+
+def ensure_triggers(conn, node_name, collection_names):
+    """Install any missing notification triggers on a node's tables, and
+    commit."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT to_regproc('fluent_tail_notify') IS NOT NULL;
+        """)
+        if not cur.fetchone()[0]:
+            cur.execute(NOTIFY_FUNCTION)
+        for (table, trigger, event, column) in triggers(node_name,
+                                                        collection_names):
+            if not indexes.table_exists(cur, table):
+                continue
+            cur.execute("""
+                SELECT 1
+                FROM pg_trigger
+                WHERE tgrelid = to_regclass(%s) AND tgname = %s;
+            """, (table, trigger))
+            if cur.fetchone() is not None:
+                continue
+            when = ("WHEN (NEW.{} IS NOT NULL)".format(column)
+                    if event.startswith("UPDATE") else "")
+            cur.execute("""
+                CREATE TRIGGER {} AFTER {} ON {}
+                FOR EACH ROW {}
+                EXECUTE PROCEDURE fluent_tail_notify(%s, %s);
+            """.format(trigger, event, table, when), (node_name, column))
+    conn.commit()
+
+def event(time_, data):
+    """A server-sent event for the tick at logical time `time_`. Its id lets
+    a reconnecting EventSource resume after it (see Last-Event-ID)."""
+    return "id: {}\nevent: tick\ndata: {}\n\n".format(time_, data)
+
+KEEPALIVE = ": keepalive\n\n"
+
+class _Ticks(object):
+    # A range of ticks, fetched by one viewer and waited for by the rest.
+    def __init__(self):
+        self.done = threading.Event()
+        self.ticks = None
+
+class Tail(threading.Thread):
+    """A daemon thread that listens for the notifications sent by the
+    triggers that ensure_triggers installs and tracks the max logical time of
+    every node. The thread listens on a connection of its own to the
+    database of `pool`, which it reopens every `reconnect_period` seconds if
+    it is lost, and polls the max time of watched nodes without triggers
+    every `poll_period` seconds. The `cache_size` most recent ranges of ticks
+    fetched for viewers are kept for other viewers (see ticks).
+
+        tail = Tail(db.ConnectionPool("dbname=vagrant"))
+        tail.start()
+        tail.watch("node", ["collection"])
+        max_time = tail.wait("node", after=41, timeout=15)
+    """
+    def __init__(self, pool, reconnect_period=5.0, poll_period=1.0,
+                 cache_size=64):
+        super(Tail, self).__init__(name="tail")
+        self.daemon = True
+        self.pool = pool
+        self.reconnect_period = reconnect_period
+        self.poll_period = poll_period
+        self.cache_size = cache_size
+        self._cond = threading.Condition(threading.Lock())
+        self._max_times = {} # node name -> max logical time
+        self._watched = set()
+        self._polled = set() # watched nodes without triggers
+        self._ticks = collections.OrderedDict() # (node, after, upto) -> _Ticks
+
+    def watch(self, node_name, collection_names):
+        """Start tracking a node, by its notifications if its triggers are
+        installed and by polling otherwise."""
+        with self._cond:
+            if node_name in self._watched:
+                return
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            installed = triggers_installed(cur, node_name, collection_names)
+            max_time = checkpoint.node_max_time(cur, node_name)
+        with self._cond:
+            self._watched.add(node_name)
+            if not installed:
+                self._polled.add(node_name)
+        self.advance({node_name: max_time})
+
+    def advance(self, max_times):
+        with self._cond:
+            for (node_name, max_time) in max_times.items():
+                if max_time is not None and max_time > self._max_times.get(
+                        node_name, max_time - 1):
+                    self._max_times[node_name] = max_time
+            self._cond.notify_all()
+
+    def max_time(self, node_name):
+        with self._cond:
+            return self._max_times.get(node_name)
+
+    def wait(self, node_name, after, timeout):
+        """Block until `node_name` has a complete logical time after `after`
+        or `timeout` seconds pass, and return the node's max logical time.
+        Every time before the max time is complete."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._max_times.get(node_name, after + 1) <= after + 1:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._max_times.get(node_name)
+
+    def ticks(self, node_name, after, upto, fetch):
+        """The ticks of `node_name` in (after, upto], as returned by
+        fetch(node_name, after, upto). Viewers that follow a node in step ask
+        for the same ranges, so a range is only fetched by the first viewer
+        to ask for it, while the rest wait for and share its result."""
+        key = (node_name, after, upto)
+        with self._cond:
+            entry = self._ticks.get(key)
+            fetching = entry is None
+            if fetching:
+                entry = self._ticks[key] = _Ticks()
+                while len(self._ticks) > self.cache_size:
+                    self._ticks.popitem(last=False)
+        if not fetching:
+            entry.done.wait()
+            # If the first viewer's fetch failed, try again on our own.
+            return fetch(*key) if entry.ticks is None else entry.ticks
+
+        try:
+            entry.ticks = fetch(*key)
+        except:
+            with self._cond:
+                if self._ticks.get(key) is entry:
+                    del self._ticks[key]
+            raise
+        finally:
+            entry.done.set()
+        return entry.ticks
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except (psycopg2.Error, db.PoolTimeout):
+                pass
+            time.sleep(self.reconnect_period)
+
+    def _listen(self):
+        conn = psycopg2.connect(self.pool.dsn)
+        try:
+            conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute("LISTEN {};".format(CHANNEL))
+                # We may have missed notifications while we weren't
+                # listening.
+                with self._cond:
+                    watched = list(self._watched)
+                self.advance({node_name: checkpoint.node_max_time(cur,
+                                                                  node_name)
+                              for node_name in watched})
+
+            last_poll = time.time()
+            while True:
+                max_times = {}
+                if select.select([conn], [], [],
+                                 self.poll_period) != ([], [], []):
+                    conn.poll()
+                    while len(conn.notifies) > 0:
+                        (node_name, max_time) = conn.notifies.pop(0) \
+                            .payload.rsplit(" ", 1)
+                        max_times[node_name] = max(
+                            int(max_time), max_times.get(node_name, 0))
+                with self._cond:
+                    polled = list(self._polled)
+                if (len(polled) > 0 and
+                        time.time() - last_poll >= self.poll_period):
+                    with conn.cursor() as cur:
+                        for node_name in polled:
+                            max_times[node_name] = checkpoint.node_max_time(
+                                cur, node_name)
+                    last_poll = time.time()
+                self.advance(max_times)
+        finally:
+            conn.close()
+
+def ensure_all_triggers(conn, out=sys.stdout):
+    """Install any missing notification triggers on every node's tables,
+    writing a line per node to `out`."""
+    with conn.cursor() as cur:
+        node_collections = indexes.node_collections(cur)
+    for (node_name, collection_names) in sorted(node_collections.items()):
+        ensure_triggers(conn, node_name, collection_names)
+        out.write("Installed triggers for {}.\n".format(node_name))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Install live tail triggers on every node's tables.")
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    args = parser.parse_args()
+    ensure_all_triggers(psycopg2.connect(args.dsn))
+
+if __name__ == "__main__":
+    main()
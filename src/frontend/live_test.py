@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+
+import live
+
+class TailTest(unittest.TestCase):
+    def setUp(self):
+        # wait and advance never touch the pool.
+        self.tail = live.Tail(pool=None)
+
+    def test_wait_returns_once_a_time_is_complete(self):
+        self.tail.advance({"n": 5})
+        self.assertEqual(self.tail.wait("n", 3, timeout=10), 5)
+        # Time 5 isn't complete until the node moves past it.
+        self.assertEqual(self.tail.wait("n", 4, timeout=0.01), 5)
+        threading.Timer(0.01, self.tail.advance, [{"n": 6}]).start()
+        self.assertEqual(self.tail.wait("n", 4, timeout=10), 6)
+
+    def test_max_time_only_grows(self):
+        self.tail.advance({"n": 5, "m": None})
+        self.tail.advance({"n": 2})
+        self.assertEqual(self.tail.max_time("n"), 5)
+        self.assertEqual(self.tail.max_time("m"), None)
+        self.assertEqual(self.tail.wait("m", 0, timeout=0.01), None)
+
+    def test_ticks_are_fetched_once(self):
+        calls = []
+        started = threading.Event()
+        def fetch(node_name, after, upto):
+            calls.append((node_name, after, upto))
+            started.set()
+            time.sleep(0.05)
+            return ["tick"]
+
+        results = []
+        def view():
+            results.append(self.tail.ticks("n", 3, 5, fetch))
+        first = threading.Thread(target=view)
+        first.start()
+        started.wait()
+        others = [threading.Thread(target=view) for _ in range(4)]
+        for thread in others:
+            thread.start()
+        for thread in [first] + others:
+            thread.join()
+        self.assertEqual(calls, [("n", 3, 5)])
+        self.assertEqual(results, [["tick"]] * 5)
+
+        # Another range is another fetch.
+        self.assertEqual(self.tail.ticks("n", 5, 6, fetch), ["tick"])
+        self.assertEqual(len(calls), 2)
+
+    def test_failed_fetch_isnt_shared(self):
+        def fail(node_name, after, upto):
+            raise ValueError()
+        self.assertRaises(ValueError, self.tail.ticks, "n", 3, 5, fail)
+        self.assertEqual(self.tail.ticks("n", 3, 5, lambda *key: [key]),
+                         [("n", 3, 5)])
+
+    def test_event(self):
+        self.assertEqual(live.event(7, '{"time": 7}'),
+                         'id: 7\nevent: tick\ndata: {"time": 7}\n\n')
+
+if __name__ == "__main__":
+    unittest.main()
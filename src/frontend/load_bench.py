@@ -0,0 +1,180 @@
+"""Replay browsing sessions against the frontend as history grows.
+
+For every history length in `--history`, a synthetic lineage database is
+generated (see synthetic.py) and `--sessions` browsing sessions are replayed
+against the frontend by `--clients` concurrent clients. A session
+
+    1. lists the nodes (/nodes),
+    2. selects a random node at a random time (/node_snapshot),
+    3. steps forwards or backwards in time `--steps` times
+       (/node_collection_delta),
+    4. reads one collection in full (/node_collection), and
+    5. expands the backwards and forwards lineage of a random tuple
+       `--depth` levels deep (/backwards_lineage_closure, /forwards_lineage).
+
+The frontend is served in this process. For example,
+
+    python load_bench.py --dsn "dbname=fluent_synthetic" --history 100,1000
+
+prints a CSV of history, endpoint, requests, and p50 and p99 latency in
+milliseconds. The database at `--dsn` is reset for every history length.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib
+import urllib2
+
+import psycopg2
+
+import checkpoint
+import db
+import indexes
+import main
+import max_times
+import metadata
+import pool_bench
+import synthetic
+
+def percentile(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+class Session(object):
+    def __init__(self, base_url, rng, history, steps, depth):
+        self.base_url = base_url
+        self.rng = rng
+        self.history = history
+        self.steps = steps
+        self.depth = depth
+        self.latencies = collections.defaultdict(list) # endpoint -> seconds
+
+    def get(self, endpoint, **args):
+        url = "{}/{}?{}".format(self.base_url, endpoint, urllib.urlencode(args))
+        start = time.time()
+        data = urllib2.urlopen(url).read()
+        self.latencies[endpoint].append(time.time() - start)
+        return json.loads(data)
+
+    def run(self):
+        nodes = self.get("nodes")
+        node_name = self.rng.choice(nodes)[0]
+        time_ = self.rng.randint(1, self.history)
+        snapshot = self.get("node_snapshot", node_name=node_name, time=time_)
+
+        now = time_
+        for _ in range(self.steps):
+            to = min(self.history, max(1, now + self.rng.choice([-1, 1])))
+            self.get("node_collection_delta", node_name=node_name,
+                     **{"from": now, "to": to})
+            now = to
+
+        collections_ = [c for c in snapshot["collections"]
+                        if len(c["tuples"]) > 0]
+        if len(collections_) == 0:
+            return
+        collection = self.rng.choice(collections_)
+        self.get("node_collection", node_name=node_name,
+                 collection_name=collection["name"], time=time_)
+
+        t = self.rng.choice(collection["tuples"])
+        self.get("backwards_lineage_closure", node_name=node_name,
+                 collection_name=collection["name"], hash=t[0], time=time_,
+                 depth=self.depth)
+        self.get("forwards_lineage", node_name=node_name,
+                 collection_name=collection["name"], hash=t[0], time=t[1],
+                 depth=self.depth)
+
+def forget_database():
+    # The database was just reset, so nothing the frontend cached about the
+    # last one still holds: node metadata and max times, compiled lineage
+    # scripts, whether Checkpoints exists, and the ticks of live tails.
+    main.metadata_cache = metadata.MetadataCache(
+        check_interval=main.metadata_cache.check_interval,
+        settle_time=main.metadata_cache.settle_time,
+        version_column=main.metadata_cache.version_column)
+    main.max_time_cache = max_times.MaxTimeCache(
+        check_interval=main.max_time_cache.check_interval)
+    main.script_cache.clear()
+    checkpoint._catalog_exists = False
+    pool_bench.use_pool(main.pool)
+
+def replay(base_url, num_sessions, num_clients, history, steps, depth, seed):
+    # Returns a dict mapping every endpoint to the latencies of its requests.
+    rng = random.Random(seed)
+    sessions = [Session(base_url, random.Random(rng.random()), history, steps,
+                        depth)
+                for _ in range(num_sessions)]
+    def client(i):
+        for session in sessions[i::num_clients]:
+            session.run()
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = collections.defaultdict(list)
+    for session in sessions:
+        for (endpoint, seconds) in session.latencies.items():
+            latencies[endpoint].extend(seconds)
+    return latencies
+
+def bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", required=True,
+                        help="The database to reset and fill.")
+    parser.add_argument("--history", default="100,1000,10000",
+                        help="Comma-separated history lengths.")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--collections", type=int, default=4)
+    parser.add_argument("--churn", type=int, default=2)
+    parser.add_argument("--live", type=int, default=100)
+    parser.add_argument("--fan_in", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--ensure_indexes", action="store_true",
+                        help="Create the frontend's indexes after generating "
+                             "each database.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    pool_bench.use_pool(db.ConnectionPool(
+        args.dsn, maxconn=args.clients * 4,
+        cursor_factory=main.pool.cursor_factory))
+    server = pool_bench.serve("localhost", args.port)
+    base_url = "http://localhost:{}".format(args.port)
+
+    print "history,endpoint,requests,p50 (ms),p99 (ms)"
+    for history in [int(h) for h in args.history.split(",")]:
+        conn = psycopg2.connect(args.dsn)
+        synthetic.generate(conn, args.nodes, args.collections, history,
+                           args.churn, args.live, args.fan_in, seed=args.seed)
+        if args.ensure_indexes:
+            with open(os.devnull, "w") as devnull:
+                indexes.ensure_indexes(conn, out=devnull)
+        conn.close()
+        forget_database()
+
+        latencies = replay(base_url, args.sessions, args.clients, history,
+                           args.steps, args.depth, args.seed)
+        for (endpoint, seconds) in sorted(latencies.items()):
+            print "{},{},{},{:.2f},{:.2f}".format(
+                history, endpoint, len(seconds),
+                percentile(seconds, 0.5) * 1000,
+                percentile(seconds, 0.99) * 1000)
+    server.shutdown()
+
+if __name__ == "__main__":
+    bench()
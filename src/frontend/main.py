@@ -1,98 +1,755 @@
-import imp
+import argparse
+import collections
+import decimal
+import functools
+import hashlib
+import itertools
+import multiprocessing.pool
+import os
+import sqlite3
 import sys
+import threading
 
 import flask
 import psycopg2
 
+import backends
+import checkpoint
+import columnar
+import db
+import indexes
+import instrumentation
+import lineage_scripts
+import live
+import max_times
+import metadata
+import value_search
+import sqlite_db
+
 app = flask.Flask(__name__)
-db = psycopg2.connect("dbname=vagrant")
+app.json_encoder = instrumentation.JSONEncoder
+
+# Connections are checked out of the pool once per request (see get_db) and
+# returned when the request ends, so concurrent requests never share a
+# connection. Nothing connects to postgres until the first request arrives.
+# If FLUENT_SQLITE_DB is set, the frontend reads a sqlite file exported by
+# sqlite_db.py instead. The queries that differ between the two are built by
+# `backend` (see backends.py).
+if os.environ.get("FLUENT_SQLITE_DB"):
+    backend = backends.SqliteBackend(
+        sqlite_db.ConnectionPool(os.environ["FLUENT_SQLITE_DB"]))
+else:
+    backend = backends.PostgresBackend(db.ConnectionPool(
+        os.environ.get("FLUENT_DB_DSN", "dbname=vagrant"),
+        minconn=int(os.environ.get("FLUENT_DB_POOL_MIN", 1)),
+        maxconn=int(os.environ.get("FLUENT_DB_POOL_MAX", 16)),
+        timeout=float(os.environ.get("FLUENT_DB_POOL_TIMEOUT", 30)),
+        cursor_factory=instrumentation.Cursor))
+pool = backend.pool
+
+# Per-endpoint latency, SQL, and JSON metrics, served at /metrics. See
+# instrumentation.py.
+request_metrics = instrumentation.Metrics()
+
+# Worker threads used to run independent queries (e.g. one per collection)
+# concurrently. Every task checks out its own connection from `pool`.
+QUERY_THREADS = int(os.environ.get("FLUENT_QUERY_THREADS", 8))
+workers = multiprocessing.pool.ThreadPool(QUERY_THREADS)
+
+# The number of tuples fetched from postgres at a time when streaming a
+# collection.
+STREAM_BATCH_SIZE = int(os.environ.get("FLUENT_STREAM_BATCH_SIZE", 1000))
+
+# The metadata of every node, shared by all requests. The cache is checked for
+# new nodes at most every FLUENT_METADATA_CHECK_INTERVAL seconds.
+metadata_cache = metadata.MetadataCache(
+    check_interval=float(os.environ.get("FLUENT_METADATA_CHECK_INTERVAL", 5)),
+    version_column=backend.node_version)
+
+# Compiled python black box lineage scripts, shared by all requests.
+script_cache = lineage_scripts.ScriptCache()
+
+# The max logical time of every node, used to tell which responses can never
+# change (see immutable_before). Clients reuse those responses for
+# FLUENT_IMMUTABLE_MAX_AGE seconds (a day by default) and then revalidate
+# them, since the database may have been reset since; 0 makes them revalidate
+# every time.
+max_time_cache = max_times.MaxTimeCache(
+    check_interval=float(os.environ.get("FLUENT_MAX_TIME_CHECK_INTERVAL", 1)))
+IMMUTABLE_MAX_AGE = int(os.environ.get("FLUENT_IMMUTABLE_MAX_AGE", 86400))
+
+# Changing the format of a cacheable response must change this, so that
+# clients don't reuse responses cached by an older frontend.
+ETAG_VERSION = 2
+
+# If FLUENT_CHECKPOINT_INTERVAL is set, every collection is checkpointed every
+# FLUENT_CHECKPOINT_INTERVAL logical times in the background. See
+# checkpoint.py.
+if int(os.environ.get("FLUENT_CHECKPOINT_INTERVAL", 0)) > 0:
+    checkpointer = checkpoint.Checkpointer(
+        pool, int(os.environ["FLUENT_CHECKPOINT_INTERVAL"]),
+        float(os.environ.get("FLUENT_CHECKPOINT_PERIOD", 60)))
+    checkpointer.start()
+
+# Viewers of /live_tail wait on a single thread that listens for the changes
+# that nodes commit (see live.py), started by the first viewer, and share the
+# ticks it fetches for them. Nodes without the triggers that --ensure-indexes
+# installs are polled every FLUENT_LIVE_TAIL_POLL_PERIOD seconds. A tail sends
+# at most FLUENT_LIVE_TAIL_MAX_TICKS logical times per query, and a comment
+# every FLUENT_LIVE_TAIL_KEEPALIVE seconds that it has nothing to send, so
+# that closed connections are noticed.
+tail = (live.Tail(pool, poll_period=float(
+            os.environ.get("FLUENT_LIVE_TAIL_POLL_PERIOD", 1)))
+        if backend.name == "postgres" else None)
+tail_lock = threading.Lock()
+LIVE_TAIL_MAX_TICKS = int(os.environ.get("FLUENT_LIVE_TAIL_MAX_TICKS", 100))
+LIVE_TAIL_KEEPALIVE = float(os.environ.get("FLUENT_LIVE_TAIL_KEEPALIVE", 15))
 
 # Helper Functions #############################################################
+def get_db():
+    if not hasattr(flask.g, "db"):
+        flask.g.db = pool.getconn()
+    return flask.g.db
+
+def release_db(discard=False):
+    conn = flask.g.pop("db", None)
+    if conn is not None:
+        pool.putconn(conn, discard=discard)
+
+def profiling():
+    # Whether the request asked for its profile (see finish_profile).
+    return flask.request.args.get("profile") == "1"
+
+@app.before_request
+def start_profile():
+    instrumentation.start(explain=profiling())
+
+@app.after_request
+def finish_profile(response):
+    # With ?profile=1, a JSON response `r` is replaced with {"result": r,
+    # "profile": p} where p has the request's statements, their timings, and
+    # their EXPLAIN ANALYZE plans. Streamed responses are buffered first so
+    # that their statements are included.
+    profile = instrumentation.current()
+    if profile is None:
+        return response
+    if (profiling() and response.status_code == 200 and
+            response.mimetype == "application/json"):
+        result = response.get_data()
+        report = flask.json.dumps(profile.report())
+        response.set_data('{"result": ' + result + ', "profile": ' + report +
+                          '}')
+
+    # Streamed responses keep running queries after this, so the request is
+    # only recorded once the response has been sent.
+    endpoint = flask.request.endpoint
+    def record():
+        if instrumentation.current() is profile:
+            instrumentation.finish()
+        if endpoint is not None:
+            request_metrics.observe(endpoint, profile.elapsed(), profile)
+    response.call_on_close(record)
+    return response
+
+@app.teardown_appcontext
+def teardown_db(exception):
+    release_db(discard=isinstance(exception, db.CONNECTION_ERRORS))
+
+def run_with_cursor(f, *args):
+    try:
+        with get_db().cursor() as cur:
+            return f(cur, *args)
+    except db.CONNECTION_ERRORS:
+        # The pooled connection was broken (e.g. postgres restarted since it
+        # was last health checked). All of our queries are reads, so it's safe
+        # to retry once on a fresh connection.
+        release_db(discard=True)
+        with get_db().cursor() as cur:
+            return f(cur, *args)
+
 def with_cursor(f, *args):
-    with db.cursor() as cur:
-        return flask.jsonify(f(cur, *args))
+    return flask.jsonify(run_with_cursor(f, *args))
+
+def run_with_pooled_cursor(f, *args):
+    # Like run_with_cursor, but checks out a connection for just this call
+    # instead of using the request's connection. This is safe to call from
+    # worker threads.
+    try:
+        with pool.connection() as conn, conn.cursor() as cur:
+            return f(cur, *args)
+    except db.CONNECTION_ERRORS:
+        with pool.connection() as conn, conn.cursor() as cur:
+            return f(cur, *args)
+
+def map_with_pooled_cursors(f, args_list):
+    # Returns [f(cur, *args) for args in args_list], with the calls run
+    # concurrently by `workers` on separate connections. The calls are
+    # recorded in the request's profile.
+    profile = instrumentation.current()
+    def run(args):
+        with instrumentation.using(profile):
+            return run_with_pooled_cursor(f, *args)
+    return workers.map(run, args_list)
 
 def escape(x):
-    if type(x) == long:
+    # javascript numbers are doubles, so 64-bit integers (and numeric columns,
+    # which hold unsigned ones) are sent as strings.
+    if type(x) in (long, decimal.Decimal):
         return str(x)
     else:
         return x
 
+def deleted_as_of(row, time, columns=(2, 4)):
+    # A row of a collection as it was at logical time `time`: if the tuple was
+    # deleted after `time`, its deletion times (in `columns`) are None.
+    # Responses about a time are cached once the node has moved past it (see
+    # immutable_before), so they mustn't show deletions that came later.
+    if row[2] is None or row[2] <= time:
+        return row
+    return tuple(None if i in columns else x for (i, x) in enumerate(row))
+
+# Whether a tuple inserted at `time_inserted` and deleted at `time_deleted` (or
+# None if it hasn't been deleted) is visible at logical time `time`. This
+# mirrors the WHERE clause used in checkpoint.time_travel_query.
+def visible_at(time_inserted, time_deleted, time):
+    return ((time_inserted == time and time_inserted == time_deleted) or
+            (time_inserted <= time and (time_deleted is None or
+                                        time_deleted > time)))
+
 def fetch_only_row(cur):
     rows = cur.fetchall()
     assert len(rows) == 1, rows
     return rows[0]
 
+def etag_(request, node_version):
+    # A strong ETag for a response that is determined by its path and
+    # arguments, the database it was read from, and the version of the row
+    # of the node it's about in Nodes, which changes if the node's history is
+    # reset.
+    key = repr((ETAG_VERSION, backend.identity(get_db), node_version,
+                request.path, sorted(request.args.items(multi=True))))
+    return hashlib.sha1(key).hexdigest()
+
+def immutable_before(*time_args):
+    # Decorates an endpoint whose response, given a `node_name` argument and
+    # the logical times in the `time_args` arguments, never changes once the
+    # node has moved past all of those times. Such responses are sent with a
+    # strong ETag, and requests with a matching If-None-Match header are
+    # answered with a 304 without running a single query (unless a cache is
+    # stale).
+    def decorator(f):
+        @functools.wraps(f)
+        def endpoint():
+            node_name = flask.request.args.get("node_name")
+            times = [flask.request.args.get(a, type=int) for a in time_args]
+            if node_name is None or None in times or profiling():
+                return f()
+            try:
+                node_version = metadata_(None, node_name).node(
+                    node_name)["version"]
+            except KeyError:
+                return f()
+
+            # A reset node starts over from its first logical time, so max
+            # times are kept per version of the node.
+            key = (node_name, node_version)
+            immutable = lambda: max_time_cache.before(key, max(times))
+            if not immutable() and max_time_cache.stale(key):
+                max_time_cache.update(key, run_with_cursor(
+                    checkpoint.node_max_time, node_name))
+            if not immutable():
+                return f()
+
+            etag = etag_(flask.request, node_version)
+            if flask.request.if_none_match.contains(etag):
+                response = flask.Response(status=304)
+            else:
+                response = flask.make_response(f())
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.public = True
+            if IMMUTABLE_MAX_AGE > 0:
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            else:
+                response.cache_control.no_cache = True
+            return response
+        return endpoint
+    return decorator
+
 # Functions ####################################################################
-def nodes_(cur):
-    cur.execute("SELECT name, address FROM nodes;")
-    return cur.fetchall()
+def metadata_(cur=None, node_name=None):
+    # The metadata cache, refreshed first if it may be out of date (e.g. if
+    # `node_name` isn't in it). See metadata.py. Only a refresh touches the
+    # database, using `cur` or, if cur is None, the request's connection.
+    if metadata_cache.stale(node_name):
+        if cur is None:
+            run_with_cursor(metadata_cache.refresh)
+        else:
+            metadata_cache.refresh(cur)
+    return metadata_cache
+
+def node_(name, cur=None):
+    return metadata_(cur, name).node(name)
+
+def nodes_():
+    return metadata_().nodes()
+
+def node_address_(name):
+    return node_(name)["address"]
+
+def node_bootstrap_rules_(name):
+    return node_(name)["bootstrap_rules"]
+
+def node_rules_(name):
+    return node_(name)["rules"]
+
+def node_collection_names_(name):
+    return node_(name)["collections"].keys()
 
-def node_address_(cur, name):
+def collection_metadata_(cur, node_name, collection_name):
+    # Fetch type, column names, and black box.
+    collection = node_(node_name, cur)["collections"][collection_name]
+    return {
+        "type": collection["type"],
+        "column_names": collection["column_names"],
+        "lineage_type": collection["lineage_type"],
+    }
+
+def node_collection_page_(cur, node_name, collection_name, time, after_hash,
+                          limit):
+    # At most `limit` of the tuples in a collection at `time`, in order of
+    # hash, starting after the tuple with hash `after_hash` (or from the
+    # beginning if after_hash is None). Since a tuple can't be inserted while
+    # it's already in a collection, hashes are unique at any one time. The
+    # hash to pass as `after_hash` to get the next page is returned in
+    # "next_after_hash", which is None on the last page.
+    collection = collection_metadata_(cur, node_name, collection_name)
+    checkpoint_time = checkpoint.nearest_checkpoint(cur, node_name,
+                                                    collection_name, time)
+    (query, args) = checkpoint.time_travel_query(node_name, collection_name,
+                                                 checkpoint_time, time)
     cur.execute("""
-        SELECT N.address
-        FROM Nodes N
-        WHERE N.name = %s;
-    """, (name,))
+        SELECT *
+        FROM ({}) C
+        WHERE %s IS NULL OR C.hash > %s
+        ORDER BY C.hash
+        LIMIT %s;
+    """.format(query), args + (after_hash, after_hash, limit))
     rows = cur.fetchall()
-    assert len(rows) == 1, rows
-    return rows[0][0]
+    collection["tuples"] = [[escape(x) for x in deleted_as_of(t, time)]
+                            for t in rows]
+    if len(rows) == limit and limit > 0:
+        collection["next_after_hash"] = escape(rows[-1][0])
+    else:
+        collection["next_after_hash"] = None
+    return collection
 
-def node_bootstrap_rules_(cur, name):
-    cur.execute("""
-        SELECT R.rule
-        FROM Nodes N, Rules R
-        WHERE N.name = %s AND N.id = R.node_id AND R.is_bootstrap
-        ORDER BY R.rule_number;
-    """, (name,))
-    return [t[0] for t in cur.fetchall()]
-
-def node_rules_(cur, name):
-    cur.execute("""
-        SELECT R.rule
-        FROM Nodes N, Rules R
-        WHERE N.name = %s AND N.id = R.node_id AND (NOT R.is_bootstrap)
-        ORDER BY R.rule_number;
-    """, (name,))
-    return [t[0] for t in cur.fetchall()]
-
-def node_collection_names_(cur, name):
-    cur.execute("""
-        SELECT C.collection_name
-        FROM Nodes N, Collections C
-        WHERE N.name = %s AND N.id = C.node_id;
-    """, (name,))
-    return [t[0] for t in cur.fetchall()]
+def open_node_collection_(node_name, collection_name, time, batch_size,
+                          partial=True, columnar_=False):
+    # The JSON of a collection's metadata and its tuples at `time`, with
+    # deletions after `time` left out (see deleted_as_of), as its first string
+    # and an iterator of the rest. Tuples are read, starting from the nearest
+    # checkpoint, through a server-side cursor `batch_size` at a time, so
+    # memory use doesn't depend on the size of the collection. If `columnar_`
+    # is true, every batch is sent as a block of the columnar JSON format (see
+    # columnar.py) rather than as rows. The first string has the first batch.
+    # A pooled connection is held until the last batch is read, so a
+    # collection that fits in one batch holds none once this returns, and
+    # otherwise the iterator holds one until it is exhausted or closed. If
+    # `partial` is false, a collection that doesn't fit in one batch isn't
+    # read at all, and None is returned instead. This is safe to call from
+    # worker threads.
+    def generate():
+        discard = False
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                collection = collection_metadata_(cur, node_name,
+                                                  collection_name)
+                checkpoint_time = checkpoint.nearest_checkpoint(
+                    cur, node_name, collection_name, time)
+            (query, args) = checkpoint.time_travel_query(
+                node_name, collection_name, checkpoint_time, time)
+            if columnar_:
+                collection["format"] = "columnar"
+                header = flask.json.dumps(collection)
+                chunk = header[:-1] + ', "blocks": ['
+                query = columnar.query(query, backend.epoch_ms)
+            else:
+                header = flask.json.dumps(collection)
+                chunk = header[:-1] + ', "tuples": ['
 
-def node_collection_(cur, node_name, collection_name, time):
-    collection = {}
+            cur = conn.cursor(name="node_collection")
+            cur.execute(query, args)
+            first = True
+            while conn is not None:
+                rows = cur.fetchmany(batch_size)
+                if first and len(rows) == batch_size and not partial:
+                    return
+                if len(rows) < batch_size:
+                    # The last batch, which we send without the connection.
+                    cur.close()
+                    pool.putconn(conn)
+                    conn = None
+                if len(rows) > 0 and columnar_:
+                    # The physical deletion time is also appended in
+                    # milliseconds.
+                    chunk += ("" if first else ",") + columnar.encode_block(
+                        collection, [deleted_as_of(t, time, (2, 4, len(t) - 1))
+                                     for t in rows])
+                    first = False
+                elif len(rows) > 0:
+                    chunk += ("" if first else ",") + ",".join(
+                        flask.json.dumps([escape(x)
+                                          for x in deleted_as_of(t, time)])
+                        for t in rows)
+                    first = False
+                if conn is not None:
+                    yield chunk
+                    chunk = ""
+            yield chunk + "]}"
+        except db.CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            if conn is not None:
+                pool.putconn(conn, discard=discard)
 
-    # Fetch type, column names, and black box.
+    # We eagerly generate the first string so that a bad node or collection
+    # name fails the request rather than truncating the response.
+    chunks = generate()
+    try:
+        return (next(chunks), chunks)
+    except StopIteration:
+        return None
+
+def stream_node_collection_(node_name, collection_name, time, batch_size,
+                            columnar_=False):
+    # open_node_collection_ as a single iterator of strings. The request's
+    # connection is returned first, so that the request never holds two.
+    release_db()
+    (first, chunks) = open_node_collection_(node_name, collection_name, time,
+                                            batch_size, columnar_=columnar_)
+    return itertools.chain([first], chunks)
+
+def binary_node_collection_(cur, node_name, collection_name, time):
+    # The tuples in a collection at `time` in the binary columnar format
+    # described in columnar.py, as a string.
+    collection = collection_metadata_(cur, node_name, collection_name)
+    checkpoint_time = checkpoint.nearest_checkpoint(cur, node_name,
+                                                    collection_name, time)
+    (query, args) = checkpoint.time_travel_query(node_name, collection_name,
+                                                 checkpoint_time, time)
+    cur.execute(columnar.query(query, backend.epoch_ms), args)
+    # The physical deletion time is also appended in milliseconds.
+    rows = [deleted_as_of(r, time, (2, 4, len(r) - 1))
+            for r in cur.fetchall()]
+    return columnar.encode_binary(collection, rows)
+
+def node_collection_delta_(cur, node_name, collection_name, from_, to):
+    # A tuple can only be visible at one of `from_` and `to` but not the other
+    # if it was inserted or deleted somewhere between them.
+    (low, high) = (min(from_, to), max(from_, to))
     cur.execute("""
-        SELECT
-          C.collection_type,
-          C.column_names,
-          C.lineage_type
-        FROM Nodes N, Collections C
-        WHERE N.name = %s AND N.id = C.node_id AND collection_name = %s;
-    """, (node_name, collection_name))
-    row = fetch_only_row(cur)
-    (type_, column_names, lineage_type) = row
-    collection["type"] = type_
-    collection["column_names"] = column_names
-    collection["lineage_type"] = lineage_type
+        SELECT *
+        FROM {}_{}
+        WHERE (time_inserted >= %s AND time_inserted <= %s) OR
+              (time_deleted >= %s AND time_deleted <= %s)
+    """.format(node_name, collection_name), (low, high, low, high))
+
+    delta = {"inserted": [], "deleted": []}
+    for t in cur.fetchall():
+        before = visible_at(t[1], t[2], from_)
+        after = visible_at(t[1], t[2], to)
+        if after and not before:
+            delta["inserted"].append([escape(x) for x in deleted_as_of(t, to)])
+        elif before and not after:
+            delta["deleted"].append([escape(t[0]), t[1]])
+    return delta
+
+def node_delta_(node_name, from_, to):
+    collection_names = node_collection_names_(node_name)
+    release_db()
+    args_list = [(node_name, collection_name, from_, to)
+                 for collection_name in collection_names]
+    deltas = map_with_pooled_cursors(node_collection_delta_, args_list)
+    return dict(zip(collection_names, deltas))
+
+def search_matches_(cur, node_name, collection_names, value):
+    # For every collection, a condition (SQL and arguments) comparing every
+    # user column that `value` parses as a value of to it (see
+    # value_search.py), in a single query.
+    tables = ["{}_{}".format(node_name, c) for c in collection_names]
+    cur.execute(*backend.column_types(tables))
+    types = {(table.lower(), column.lower()): type_
+             for (table, column, type_) in cur.fetchall()}
+    node = node_(node_name, cur)
+    matches = {}
+    for (collection_name, table) in zip(collection_names, tables):
+        column_names = node["collections"][collection_name]["column_names"]
+        parsed = [(c, t, value_search.parse(t, value))
+                  for c in column_names
+                  for t in [types.get((table.lower(), c.lower()))]]
+        matches[collection_name] = [value_search.condition(c, t, v)
+                                    for (c, t, v) in parsed
+                                    if v is not None]
+    return matches
 
-    # Fetch tuples.
+def search_collection_(cur, node_name, collection_name, matches, from_, to,
+                       after, limit):
+    # The first `limit` tuples, in order of (time_inserted, hash), of a
+    # collection that meet a condition in `matches`, that are visible at some
+    # time in [from_, to] (either of which may be None). If `after` isn't
+    # None, only tuples after the (time_inserted, collection_name, hash)
+    # `after` in search order are returned.
+    conditions = ["(" + " OR ".join(sql for (sql, _) in matches) + ")"]
+    args = [x for (_, args) in matches for x in args]
+    if to is not None:
+        conditions.append("time_inserted <= %s")
+        args.append(to)
+    if from_ is not None:
+        conditions.append("(time_deleted IS NULL OR time_deleted > %s OR "
+                          "(time_inserted = time_deleted AND "
+                          "time_deleted = %s))")
+        args += [from_, from_]
+    if after is not None:
+        (after_time, after_collection, after_hash) = after
+        if collection_name > after_collection:
+            conditions.append("time_inserted >= %s")
+            args.append(after_time)
+        elif collection_name == after_collection:
+            conditions.append("(time_inserted > %s OR "
+                              "(time_inserted = %s AND hash > %s))")
+            args += [after_time, after_time, after_hash]
+        else:
+            conditions.append("time_inserted > %s")
+            args.append(after_time)
     cur.execute("""
         SELECT *
         FROM {}_{}
-        WHERE (time_inserted = %s AND time_inserted = time_deleted) OR
-              (time_inserted <= %s AND (time_deleted IS NULL OR
-                                        time_deleted > %s))
-    """.format(node_name, collection_name), (time, time, time))
-    collection["tuples"] = [[escape(x) for x in t] for t in cur.fetchall()]
+        WHERE {}
+        ORDER BY time_inserted, hash
+        LIMIT %s;
+    """.format(node_name, collection_name, " AND ".join(conditions)),
+                tuple(args) + (limit,))
+    return cur.fetchall()
 
-    return collection
+def search_(node_name, value, collection_names, from_, to, after, limit):
+    # The tuples of a node's collections (or of `collection_names` if it
+    # isn't empty) with a user column equal to `value`, visible at some time
+    # in [from_, to], in order of (time_inserted, collection_name, hash) and
+    # `limit` at a time. Every collection is searched concurrently using its
+    # value indexes. The next page starts after the next_after_* fields.
+    if len(collection_names) == 0:
+        collection_names = node_collection_names_(node_name)
+    matches = run_with_cursor(search_matches_, node_name, collection_names,
+                              value)
+    release_db()
+    # One more tuple than we need tells us whether there's another page.
+    args_list = [(node_name, c, matches[c], from_, to, after, limit + 1)
+                 for c in collection_names if len(matches[c]) > 0]
+    results = map_with_pooled_cursors(search_collection_, args_list)
+    found = sorted((t[1], args[1], t[0], t)
+                   for (args, rows) in zip(args_list, results)
+                   for t in rows)
+
+    page = {
+        "tuples": [{
+            "collection_name": collection_name,
+            "tuple": [escape(x) for x in t],
+        } for (_, collection_name, _, t) in found[:limit]],
+        "next_after_time": None,
+        "next_after_collection": None,
+        "next_after_hash": None,
+    }
+    if len(found) > limit and limit > 0:
+        (time, collection_name, hash, _) = found[limit - 1]
+        page["next_after_time"] = time
+        page["next_after_collection"] = collection_name
+        page["next_after_hash"] = escape(hash)
+    return page
+
+def node_ticks_(cur, node_name, after, upto):
+    # Everything `node_name` did at every logical time in (after, upto], as a
+    # list of ticks in order of time. A tick has the tuples inserted into
+    # and the (hash, time_inserted) of the tuples deleted from every
+    # collection, and the lineage of the tuples inserted. Times at which the
+    # node did nothing have no tick.
+    ticks = collections.defaultdict(lambda: {
+        "inserted": {},
+        "deleted": {},
+        "lineage": [],
+    })
+    for collection_name in node_(node_name, cur)["collections"]:
+        cur.execute("""
+            SELECT *
+            FROM {}_{}
+            WHERE (time_inserted > %s AND time_inserted <= %s) OR
+                  (time_deleted > %s AND time_deleted <= %s);
+        """.format(node_name, collection_name), (after, upto, after, upto))
+        for t in cur.fetchall():
+            if after < t[1] <= upto:
+                ticks[t[1]]["inserted"].setdefault(collection_name, []) \
+                    .append([escape(x) for x in t])
+            if t[2] is not None and after < t[2] <= upto:
+                ticks[t[2]]["deleted"].setdefault(collection_name, []) \
+                    .append([escape(t[0]), t[1]])
+
+    cur.execute("""
+        SELECT L.time, L.collection_name, L.tuple_hash, N.name,
+               L.dep_collection_name, L.dep_tuple_hash, L.dep_time
+        FROM {}_lineage L, Nodes N
+        WHERE L.time > %s AND L.time <= %s AND L.dep_node_id = N.id
+        ORDER BY L.time;
+    """.format(node_name), (after, upto))
+    for row in cur.fetchall():
+        ticks[row[0]]["lineage"].append({
+            "collection_name": row[1],
+            "hash": escape(row[2]),
+            "dep_node_name": row[3],
+            "dep_collection_name": row[4],
+            "dep_hash": escape(row[5]),
+            "dep_time": row[6],
+        })
+
+    for (time, tick) in ticks.items():
+        tick["time"] = time
+    return [ticks[time] for time in sorted(ticks)]
+
+def tick_events_(node_name, after, upto):
+    # The server-sent events of the ticks of `node_name` in (after, upto].
+    return [live.event(tick["time"], flask.json.dumps(tick))
+            for tick in run_with_pooled_cursor(node_ticks_, node_name, after,
+                                               upto)]
+
+def live_tail_(node_name, after):
+    # An endless stream of server-sent events, one per tick of `node_name`
+    # after logical time `after` (see live.py). The stream only holds a
+    # connection while it fetches ticks, which other streams at the same
+    # time share (see live.Tail.ticks). It never ends, so its queries aren't
+    # recorded in its request's profile.
+    with tail_lock:
+        if not tail.is_alive():
+            tail.start()
+    collection_names = node_collection_names_(node_name)
+    # Watching checks out a connection of its own.
+    release_db()
+    tail.watch(node_name, collection_names)
+    if after is None:
+        max_time = tail.max_time(node_name)
+        after = -1 if max_time is None else max_time - 1
+
+    def generate(after):
+        with instrumentation.using(None):
+            while True:
+                max_time = tail.wait(node_name, after, LIVE_TAIL_KEEPALIVE)
+                if max_time is None or max_time <= after + 1:
+                    yield live.KEEPALIVE
+                    continue
+                upto = min(max_time - 1, after + LIVE_TAIL_MAX_TICKS)
+                for event in tail.ticks(node_name, after, upto, tick_events_):
+                    yield event
+                after = upto
+    return generate(after)
+
+def node_metadata_(name):
+    return {
+        "name": name,
+        "address": node_address_(name),
+        "bootstrap_rules": node_bootstrap_rules_(name),
+        "rules": node_rules_(name),
+        "collection_names": node_collection_names_(name),
+    }
+
+def stream_node_snapshot_(node_name, time, batch_size, columnar_=False):
+    # The JSON of a node's metadata and of every one of its collections at
+    # `time` (see open_node_collection_), as an iterator of strings. `workers`
+    # read the collections concurrently, as many ahead of the one being sent
+    # as there are workers, so that their queries overlap while memory use
+    # stays bounded by a batch per collection read ahead. Collections that
+    # don't fit in a batch are instead streamed once they're reached, so
+    # that no connection waits on the client while another request waits on
+    # it.
+    snapshot = node_metadata_(node_name)
+    snapshot["time"] = time
+    header = flask.json.dumps(snapshot)
+    release_db()
+
+    profile = instrumentation.current()
+    def open_(collection_name):
+        with instrumentation.using(profile):
+            return (collection_name, open_node_collection_(
+                node_name, collection_name, time, batch_size, partial=False,
+                columnar_=columnar_))
+
+    def generate():
+        names = iter(snapshot["collection_names"])
+        opening = collections.deque()
+        current = None
+        def open_next():
+            for collection_name in names:
+                opening.append(workers.apply_async(open_, (collection_name,)))
+                break
+        try:
+            for _ in range(QUERY_THREADS):
+                open_next()
+            yield header[:-1] + ', "collections": ['
+            first = True
+            while len(opening) > 0:
+                (collection_name, opened) = opening.popleft().get()
+                open_next()
+                if opened is None:
+                    opened = open_node_collection_(
+                        node_name, collection_name, time, batch_size,
+                        columnar_=columnar_)
+                (chunk, current) = opened
+                yield ("" if first else ",") + '{"name": ' + \
+                    flask.json.dumps(collection_name) + ", " + chunk[1:]
+                first = False
+                for chunk in current:
+                    yield chunk
+            yield "]}"
+        finally:
+            # A response cut short (e.g. by the client going away) gives back
+            # the connection of the collection it was sending. Collections
+            # read ahead hold none.
+            if current is not None:
+                current.close()
+    return generate()
+
+def hydrate_lineage_(cur, lineage_tuples, max_time=None):
+    # Fetch the tuple of every lineage tuple `t` into t["tuple"], as it was
+    # when it was inserted (see deleted_as_of), since it may be deleted at
+    # any time by a node other than the one whose lineage we're expanding. If
+    # t["time"] is None, it is resolved to the time of the most recent
+    # insertion of the tuple at or before `max_time`, or at or before
+    # t["max_time"] if present (in which case t["max_time"] is removed).
+    #
+    # Rather than issuing a query per lineage tuple, we issue one query per
+    # (node, collection), so the number of queries does not grow with the
+    # number of lineage tuples.
+    groups = collections.OrderedDict()
+    for t in lineage_tuples:
+        key = (t["node_name"], t["collection_name"])
+        groups.setdefault(key, []).append(t)
+
+    for ((node_name, collection_name), ts) in groups.items():
+        (keys, args) = backend.keys([
+            ("hash", "bigint", [int(t["hash"]) for t in ts]),
+            ("time", "integer", [t["time"] for t in ts]),
+            ("max_time", "integer",
+             [t.get("max_time", max_time) for t in ts])])
+        cur.execute(backend.latest_insertions(
+            "{}_{}".format(node_name, collection_name), keys), args)
+        rows = cur.fetchall()
+        assert len(rows) == len(ts), (len(rows), len(ts))
+        for row in rows:
+            t = ts[row[0] - 1]
+            t.pop("max_time", None)
+            t["tuple"] = deleted_as_of(row[1:], row[2])
+            t["time"] = row[2]
+    return lineage_tuples
 
 def regular_backwards_lineage_(cur, node_name, collection_name, hash, time):
     # The time of the most recent insertion of the tuple.
@@ -123,39 +780,17 @@ def regular_backwards_lineage_(cur, node_name, collection_name, hash, time):
               time = %s;
     """.format(node_name), (collection_name, hash, latest_insert_time))
     lineage_tuples = []
-    rows = [t for t in cur.fetchall()]
-    for row in rows:
-        t = {
+    for row in cur.fetchall():
+        lineage_tuples.append({
             "node_name": row[0],
             "collection_name": row[1],
             "hash": escape(row[2]),
             "time": row[3],
-        }
+        })
 
-        # TODO(mwhittaker): Document.
-        if t["time"] is None:
-            cur.execute("""
-                SELECT MAX(time_inserted)
-                FROM {}_{}
-                WHERE hash = %s AND time_inserted <= %s
-            """.format(t["node_name"], t["collection_name"]),
-            (t["hash"], latest_insert_time))
-            time_rows = cur.fetchall()
-            assert len(time_rows) == 1, time_rows
-            t["time"] = time_rows[0][0]
-
-        cur.execute("""
-            SELECT *
-            FROM {}_{}
-            WHERE hash = %s AND time_inserted = %s
-        """.format(t["node_name"], t["collection_name"]),
-        (t["hash"], t["time"]))
-        tuple_rows = cur.fetchall()
-        assert len(tuple_rows) == 1, tuple_rows
-        t["tuple"] = tuple_rows[0]
-
-        lineage_tuples.append(t)
-    return lineage_tuples
+    # Network lineage doesn't record the time a dependency was inserted, so
+    # we use the time it was most recently inserted before our tuple.
+    return hydrate_lineage_(cur, lineage_tuples, latest_insert_time)
 
 def sql_backwards_lineage_(cur, node_name, collection_name, id_):
     cur.execute("""
@@ -163,67 +798,360 @@ def sql_backwards_lineage_(cur, node_name, collection_name, id_):
         FROM {}_{}_lineage(%s);
     """.format(node_name, collection_name), (id_,))
     lineage_tuples = []
-    rows = cur.fetchall()
-    for row in rows:
-        t = {
+    for row in cur.fetchall():
+        lineage_tuples.append({
             "node_name": row[0],
             "collection_name": row[1],
             "hash": escape(row[2]),
             "time": row[3],
-        }
+        })
+    return hydrate_lineage_(cur, lineage_tuples)
 
-        cur.execute("""
-            SELECT *
-            FROM {}_{}
-            WHERE hash = %s AND time_inserted = %s
-        """.format(t["node_name"], t["collection_name"]),
-        (t["hash"], t["time"]))
-        tuple_rows = cur.fetchall()
-        assert len(tuple_rows) == 1, tuple_rows
-        t["tuple"] = tuple_rows[0]
-
-        lineage_tuples.append(t)
-    return lineage_tuples
-
-def python_backwards_lineage_(cur, node_name, collection_name, id_):
-    # Fetch the lineage script.
-    cur.execute("""
-        SELECT python_lineage_script
-        FROM Nodes
-        WHERE name = %s;
-    """, (node_name,))
-    (script,) = fetch_only_row(cur)
-    module = imp.new_module("module")
-    exec script in module.__dict__
-
-    # Fetch the method name.
+def python_lineage_method_(cur, node_name, collection_name):
+    # A function of a cursor and a list of black box ids that returns a dict
+    # mapping every id to its lineage. A script's lineage method takes a
+    # single id, but if the script also defines the method with a `_batch`
+    # suffix (e.g. read_lineage_batch for read_lineage), which takes a list
+    # of ids and returns such a dict, we call it instead to look up all of
+    # the ids at once.
+    #
+    # Fetch the method name and a hash of the lineage script, and only fetch
+    # and compile the script itself if it isn't already in script_cache.
     cur.execute("""
-        SELECT C.python_lineage_method
-        FROM Collections C, Nodes N
+        SELECT md5(N.python_lineage_script), C.python_lineage_method
+        FROM Nodes N, Collections C
         WHERE N.name = %s AND N.id = C.node_id AND C.collection_name = %s;
     """, (node_name, collection_name))
-    (method_name,) = fetch_only_row(cur)
-    method = getattr(module, method_name)
+    (script_hash, method_name) = fetch_only_row(cur)
+
+    def load_script():
+        cur.execute("""
+            SELECT python_lineage_script
+            FROM Nodes
+            WHERE name = %s;
+        """, (node_name,))
+        return fetch_only_row(cur)[0]
 
+    namespace = script_cache.get(node_name, script_hash, load_script)
+    batch_method = namespace.get(method_name + "_batch")
+    if batch_method is not None:
+        return batch_method
+    method = namespace[method_name]
+    return lambda cur, ids: {id_: method(cur, id_) for id_ in ids}
+
+def python_backwards_lineage_(cur, node_name, collection_name, id_):
+    method = python_lineage_method_(cur, node_name, collection_name)
     lineage_tuples = []
-    for (node_name, collection_name, hash_, time) in method(cur, id_):
-        t = {
+    for (node_name, collection_name, hash_, time) in method(cur, [id_])[id_]:
+        lineage_tuples.append({
             "node_name": node_name,
             "collection_name": collection_name,
             "hash": escape(hash_),
             "time": time,
-        }
+        })
+    return hydrate_lineage_(cur, lineage_tuples)
+
+def collections_metadata_(cur):
+    # A dict mapping (node name, collection name) to the collection's lineage
+    # type and column names.
+    metadata = {}
+    for node in metadata_(cur).all_nodes():
+        for (collection_name, collection) in node["collections"].items():
+            metadata[(node["name"], collection_name)] = {
+                "lineage_type": collection["lineage_type"],
+                "column_names": collection["column_names"],
+            }
+    return metadata
+
+def tuple_id_(t):
+    # The same as fluent.tuple_id_to_string in static/index.js.
+    return "_".join([t["node_name"], t["collection_name"], str(t["hash"]),
+                     str(t["time"])])
 
+def black_box_id_(t, column_names):
+    # The id of a black box request or response, which has an `id` column.
+    # Remember that the first five columns of every tuple are header columns.
+    return t["tuple"][5 + column_names.index("id")]
+
+def expand_backwards_lineage_(cur, frontier, metadata):
+    # Returns a list of (t, dependency) pairs for every dependency of every
+    # hydrated lineage tuple t in frontier. Dependencies are not hydrated.
+    # Every node's lineage table and every black box collection is queried
+    # once, regardless of the size of the frontier.
+    regular = collections.OrderedDict()
+    black_box = collections.OrderedDict()
+    for t in frontier:
+        meta = metadata[(t["node_name"], t["collection_name"])]
+        if meta["lineage_type"] == "regular":
+            regular.setdefault(t["node_name"], []).append(t)
+        else:
+            key = (t["node_name"], t["collection_name"])
+            black_box.setdefault(key, []).append(t)
+
+    edges = []
+    for (node_name, ts) in regular.items():
+        (keys, args) = backend.keys([
+            ("collection_name", "text", [t["collection_name"] for t in ts]),
+            ("hash", "bigint", [int(t["hash"]) for t in ts]),
+            ("time", "integer", [t["time"] for t in ts])])
         cur.execute("""
-            SELECT *
-            FROM {}_{}
-            WHERE hash = %s AND time_inserted = %s
-        """.format(t["node_name"], t["collection_name"]),
-            (t["hash"], t["time"]))
-        t["tuple"] = fetch_only_row(cur)
+            SELECT K.i, N.name, L.dep_collection_name, L.dep_tuple_hash,
+                   L.dep_time
+            FROM {}, {}_lineage L, Nodes N
+            WHERE L.collection_name = K.collection_name AND
+                  L.tuple_hash = K.hash AND
+                  L.time = K.time AND
+                  N.id = L.dep_node_id;
+        """.format(keys, node_name), args)
+        for row in cur.fetchall():
+            t = ts[row[0] - 1]
+            edges.append((t, {
+                "node_name": row[1],
+                "collection_name": row[2],
+                "hash": escape(row[3]),
+                "time": row[4],
+                "max_time": t["time"],
+            }))
 
-        lineage_tuples.append(t)
-    return lineage_tuples
+    for ((node_name, collection_name), ts) in black_box.items():
+        meta = metadata[(node_name, collection_name)]
+        ids = [black_box_id_(t, meta["column_names"]) for t in ts]
+        if meta["lineage_type"] == "sql":
+            assert backend.sql_lineage, backend.name
+            cur.execute("""
+                SELECT K.i, L.*
+                FROM unnest(%s::bigint[]) WITH ORDINALITY AS K(id, i),
+                     LATERAL {}_{}_lineage(K.id) L;
+            """.format(node_name, collection_name), (ids,))
+            rows = [(ts[row[0] - 1], row[1:]) for row in cur.fetchall()]
+        else:
+            assert meta["lineage_type"] == "python", meta["lineage_type"]
+            method = python_lineage_method_(cur, node_name, collection_name)
+            lineages = method(cur, ids)
+            rows = [(t, row) for (t, id_) in zip(ts, ids)
+                    for row in lineages[id_]]
+        for (t, row) in rows:
+            edges.append((t, {
+                "node_name": row[0],
+                "collection_name": row[1],
+                "hash": escape(row[2]),
+                "time": row[3],
+            }))
+    return edges
+
+def tuple_history_(cur, node_name, collection_name, hash, lineage):
+    # Every insertion of a tuple, in order of time, from one lookup of the
+    # collection's (hash, time_inserted) primary key. Every row has the
+    # logical and physical times the tuple was inserted and deleted (or None
+    # if it hasn't been). If `lineage` is true, the backwards lineage of
+    # every insertion is returned in "lineage", in the same order, using a
+    # constant number of queries per node and collection.
+    history = collection_metadata_(cur, node_name, collection_name)
+    cur.execute("""
+        SELECT *
+        FROM {}_{}
+        WHERE hash = %s
+        ORDER BY time_inserted;
+    """.format(node_name, collection_name), (hash,))
+    rows = cur.fetchall()
+    history["hash"] = str(hash)
+    history["tuples"] = [[escape(x) for x in t] for t in rows]
+    if not lineage:
+        return history
+
+    insertions = [{
+        "node_name": node_name,
+        "collection_name": collection_name,
+        "hash": str(hash),
+        "time": row[1],
+        "tuple": row,
+    } for row in rows]
+    dependencies = expand_backwards_lineage_(cur, insertions,
+                                             collections_metadata_(cur))
+    hydrate_lineage_(cur, [dep for (_, dep) in dependencies])
+    index = {id(t): i for (i, t) in enumerate(insertions)}
+    history["lineage"] = [[] for _ in insertions]
+    for (t, dep) in dependencies:
+        history["lineage"][index[id(t)]].append(dep)
+    return history
+
+def tuple_label_(t):
+    # The same as the tuple label computed in static/index.js: the tuple's
+    # non-header columns formatted the way JavaScript would format them.
+    def format_(x):
+        if x is None:
+            return ""
+        elif type(x) == bool:
+            return "true" if x else "false"
+        else:
+            return unicode(x)
+    return "(" + ",".join(format_(x) for x in t["tuple"][5:]) + ")"
+
+def backwards_lineage_closure_(cur, node_name, collection_name, hash, time,
+                               depth):
+    # The backwards lineage of a tuple, expanded transitively `depth` levels
+    # deep, as cytoscape nodes and edges. Every level is expanded in a constant
+    # number of queries per node and collection (see
+    # expand_backwards_lineage_ and hydrate_lineage_), and every tuple is
+    # expanded at most once.
+    metadata = collections_metadata_(cur)
+    root = {
+        "node_name": node_name,
+        "collection_name": collection_name,
+        "hash": str(hash),
+        "time": None,
+    }
+    hydrate_lineage_(cur, [root], time)
+
+    visited = collections.OrderedDict([(tuple_id_(root), root)])
+    edges = collections.OrderedDict()
+    frontier = [root]
+    for _ in range(depth):
+        if len(frontier) == 0:
+            break
+
+        dependencies = expand_backwards_lineage_(cur, frontier, metadata)
+
+        # Hydrate every dependency we haven't seen yet. Network lineage
+        # doesn't have times, so we can't tell if we've seen those until
+        # they're hydrated.
+        to_hydrate = collections.OrderedDict()
+        resolved = []
+        for (t, dep) in dependencies:
+            if dep["time"] is not None and tuple_id_(dep) in visited:
+                resolved.append((t, visited[tuple_id_(dep)]))
+            else:
+                max_time = dep.get("max_time") if dep["time"] is None else None
+                key = (tuple_id_(dep), max_time)
+                resolved.append((t, to_hydrate.setdefault(key, dep)))
+        hydrate_lineage_(cur, to_hydrate.values())
+
+        frontier = []
+        for (t, dep) in resolved:
+            dep_id = tuple_id_(dep)
+            if dep_id not in visited:
+                visited[dep_id] = dep
+                frontier.append(dep)
+            edges[(dep_id, tuple_id_(t))] = None
+
+    return lineage_graph_(visited.values(), edges.keys())
+
+def forwards_lineage_(cur, node_name, collection_name, hash, time, depth,
+                      fanout):
+    # The tuples derived from a tuple, expanded transitively `depth` levels
+    # deep, as cytoscape nodes and edges. Every level is expanded with a
+    # single query over the lineage tables of every node, using the
+    # (dep_node_id, dep_collection_name, dep_tuple_hash, dep_time) index that
+    # indexes.py creates, so the cost of a level depends on the number of
+    # tuples found rather than the size of the lineage tables. At most
+    # `fanout` dependents of any one tuple are expanded; tuples with more are
+    # marked as truncated.
+    #
+    # Note that the lineage of black box collections is computed backwards
+    # on demand, so tuples derived through a black box can't be found.
+    node_ids = {node["name"]: node["id"]
+                for node in metadata_(cur).all_nodes()}
+    lineage_tables = " UNION ALL ".join("""
+        SELECT K.i, CAST(%s AS text) AS node_name, L.collection_name,
+               L.tuple_hash,
+               L.time
+        FROM K, {}_lineage L
+        WHERE L.dep_node_id = K.node_id AND
+              L.dep_collection_name = K.collection_name AND
+              L.dep_tuple_hash = K.hash AND
+              L.dep_time = K.time
+    """.format(name) for name in node_ids.keys())
+
+    root = {
+        "node_name": node_name,
+        "collection_name": collection_name,
+        "hash": str(hash),
+        "time": time,
+    }
+    hydrate_lineage_(cur, [root])
+
+    visited = collections.OrderedDict([(tuple_id_(root), root)])
+    edges = collections.OrderedDict()
+    frontier = [root]
+    for _ in range(depth):
+        if len(frontier) == 0:
+            break
+
+        # A tuple may be derived from the same dependency by more than one
+        # rule, so we remove duplicates before ranking.
+        (keys, args) = backend.keys([
+            ("node_id", "bigint",
+             [node_ids[t["node_name"]] for t in frontier]),
+            ("collection_name", "text",
+             [t["collection_name"] for t in frontier]),
+            ("hash", "bigint", [int(t["hash"]) for t in frontier]),
+            ("time", "bigint", [t["time"] for t in frontier])])
+        cur.execute("""
+            WITH K AS (SELECT * FROM {})
+            SELECT i, node_name, collection_name, tuple_hash, time
+            FROM (
+              SELECT D.*,
+                     ROW_NUMBER() OVER (PARTITION BY i
+                                        ORDER BY time, node_name,
+                                                 collection_name,
+                                                 tuple_hash) AS rank
+              FROM (SELECT DISTINCT * FROM ({}) U) D
+            ) R
+            WHERE rank <= %s;
+        """.format(keys, lineage_tables),
+        args + tuple(node_ids.keys()) + (fanout + 1,))
+
+        dependents = []
+        counts = collections.Counter()
+        for (i, node_name_, collection_name_, hash_, time_) in cur.fetchall():
+            t = frontier[i - 1]
+            counts[i] += 1
+            if counts[i] > fanout:
+                t["truncated"] = True
+                continue
+            dependents.append((t, {
+                "node_name": node_name_,
+                "collection_name": collection_name_,
+                "hash": escape(hash_),
+                "time": time_,
+            }))
+
+        to_hydrate = collections.OrderedDict()
+        for (_, dep) in dependents:
+            if tuple_id_(dep) not in visited:
+                to_hydrate.setdefault(tuple_id_(dep), dep)
+        hydrate_lineage_(cur, to_hydrate.values())
+
+        frontier = to_hydrate.values()
+        visited.update(to_hydrate)
+        for (t, dep) in dependents:
+            edges[(tuple_id_(t), tuple_id_(dep))] = None
+
+    return lineage_graph_(visited.values(), edges.keys())
+
+def lineage_graph_(tuples, edges):
+    # Hydrated lineage tuples and (source id, target id) pairs as cytoscape
+    # nodes and edges.
+    nodes = []
+    for t in tuples:
+        data = {
+            "id": tuple_id_(t),
+            "node_name": t["node_name"],
+            "collection_name": t["collection_name"],
+            "hash": t["hash"],
+            "time": t["time"],
+            "tuple": tuple_label_(t),
+        }
+        if t.get("truncated"):
+            data["truncated"] = True
+        nodes.append({"group": "nodes", "data": data})
+    return {
+        "nodes": nodes,
+        "edges": [{"group": "edges", "data": {
+                       "source": source,
+                       "target": target,
+                   }} for (source, target) in edges],
+    }
 
 # Endpoints ####################################################################
 @app.route("/")
@@ -232,43 +1160,93 @@ def index():
 
 @app.route("/nodes")
 def nodes():
-    return with_cursor(nodes_)
+    return flask.jsonify(nodes_())
 
 @app.route("/node_address")
 def node_address():
     node_name = flask.request.args.get("node_name", "")
     assert node_name is not None
-    return with_cursor(node_address_, node_name)
+    return flask.jsonify(node_address_(node_name))
 
 @app.route("/node_bootstrap_rules")
 def node_bootstrap_rules():
     node_name = flask.request.args.get("node_name", "")
     assert node_name is not None
-    return with_cursor(node_bootstrap_rules_, node_name)
+    return flask.jsonify(node_bootstrap_rules_(node_name))
 
 @app.route("/node_rules")
 def node_rules():
     node_name = flask.request.args.get("node_name", "")
     assert node_name is not None
-    return with_cursor(node_rules_, node_name)
+    return flask.jsonify(node_rules_(node_name))
 
 @app.route("/node_collection_names")
 def node_collection_names():
     node_name = flask.request.args.get("node_name", "")
     assert node_name is not None
-    return with_cursor(node_collection_names_, node_name)
+    return flask.jsonify(node_collection_names_(node_name))
 
 @app.route("/node_collection")
+@immutable_before("time")
 def node_collection():
     node_name = flask.request.args.get("node_name")
     collection_name = flask.request.args.get("collection_name")
     time = flask.request.args.get("time", type=int)
+    after_hash = flask.request.args.get("after_hash", type=int)
+    limit = flask.request.args.get("limit", type=int)
+    format_ = flask.request.args.get("format", "rows")
+    encoding = flask.request.args.get("encoding", "json")
     assert node_name is not None
     assert collection_name is not None
     assert time is not None
-    return with_cursor(node_collection_, node_name, collection_name, time)
+    assert format_ in ["rows", "columnar"], format_
+    assert encoding in ["json", "binary"], encoding
+    if format_ == "columnar" and encoding == "binary":
+        assert limit is None
+        data = run_with_cursor(binary_node_collection_, node_name,
+                               collection_name, time)
+        return flask.Response(data, mimetype="application/octet-stream")
+    elif limit is not None:
+        assert format_ == "rows"
+        return with_cursor(node_collection_page_, node_name, collection_name,
+                           time, after_hash, limit)
+    else:
+        chunks = stream_node_collection_(node_name, collection_name, time,
+                                         STREAM_BATCH_SIZE,
+                                         format_ == "columnar")
+        return flask.Response(chunks, mimetype="application/json")
+
+@app.route("/node_collection_delta")
+@immutable_before("from", "to")
+def node_collection_delta():
+    node_name = flask.request.args.get("node_name")
+    collection_name = flask.request.args.get("collection_name")
+    from_ = flask.request.args.get("from", type=int)
+    to = flask.request.args.get("to", type=int)
+    assert node_name is not None
+    assert from_ is not None
+    assert to is not None
+    if collection_name is None:
+        return flask.jsonify(node_delta_(node_name, from_, to))
+    else:
+        return with_cursor(node_collection_delta_, node_name, collection_name,
+                           from_, to)
+
+@app.route("/node_snapshot")
+@immutable_before("time")
+def node_snapshot():
+    node_name = flask.request.args.get("node_name")
+    time = flask.request.args.get("time", type=int)
+    format_ = flask.request.args.get("format", "rows")
+    assert node_name is not None
+    assert time is not None
+    assert format_ in ["rows", "columnar"], format_
+    chunks = stream_node_snapshot_(node_name, time, STREAM_BATCH_SIZE,
+                                   format_ == "columnar")
+    return flask.Response(chunks, mimetype="application/json")
 
 @app.route("/regular_backwards_lineage")
+@immutable_before("time")
 def regular_backwards_lineage():
     node_name = flask.request.args.get("node_name", "")
     collection_name = flask.request.args.get("collection_name", "")
@@ -281,6 +1259,95 @@ def regular_backwards_lineage():
     return with_cursor(regular_backwards_lineage_, node_name, collection_name,
                        hash, time)
 
+@app.route("/backwards_lineage_closure")
+@immutable_before("time")
+def backwards_lineage_closure():
+    node_name = flask.request.args.get("node_name")
+    collection_name = flask.request.args.get("collection_name")
+    hash = flask.request.args.get("hash", type=int)
+    time = flask.request.args.get("time", type=int)
+    depth = flask.request.args.get("depth", 1, type=int)
+    assert node_name is not None
+    assert collection_name is not None
+    assert hash is not None
+    assert time is not None
+    return with_cursor(backwards_lineage_closure_, node_name, collection_name,
+                       hash, time, depth)
+
+@app.route("/forwards_lineage")
+def forwards_lineage():
+    node_name = flask.request.args.get("node_name")
+    collection_name = flask.request.args.get("collection_name")
+    hash = flask.request.args.get("hash", type=int)
+    time = flask.request.args.get("time", type=int)
+    depth = flask.request.args.get("depth", 1, type=int)
+    fanout = flask.request.args.get("fanout", 100, type=int)
+    assert node_name is not None
+    assert collection_name is not None
+    assert hash is not None
+    assert time is not None
+    return with_cursor(forwards_lineage_, node_name, collection_name, hash,
+                       time, depth, fanout)
+
+@app.route("/tuple_history")
+def tuple_history():
+    node_name = flask.request.args.get("node_name")
+    collection_name = flask.request.args.get("collection_name")
+    hash = flask.request.args.get("hash", type=int)
+    lineage = flask.request.args.get("lineage") == "1"
+    assert node_name is not None
+    assert collection_name is not None
+    assert hash is not None
+    return with_cursor(tuple_history_, node_name, collection_name, hash,
+                       lineage)
+
+@app.route("/live_tail")
+def live_tail():
+    # A reconnecting EventSource resumes after the last tick it received.
+    node_name = flask.request.args.get("node_name")
+    after = flask.request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = flask.request.args.get("from", type=int)
+    assert node_name is not None
+    assert tail is not None, "live tails need postgres"
+    response = flask.Response(live_tail_(node_name, after),
+                              mimetype="text/event-stream")
+    response.cache_control.no_cache = True
+    # Stop proxies such as nginx from buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/search")
+def search():
+    node_name = flask.request.args.get("node_name")
+    value = flask.request.args.get("value")
+    collection_names = flask.request.args.getlist("collection_name")
+    from_ = flask.request.args.get("from", type=int)
+    to = flask.request.args.get("to", type=int)
+    after_time = flask.request.args.get("after_time", type=int)
+    after_collection = flask.request.args.get("after_collection")
+    after_hash = flask.request.args.get("after_hash", type=int)
+    limit = flask.request.args.get("limit", 100, type=int)
+    assert node_name is not None
+    assert value is not None
+    after = None
+    if after_time is not None:
+        assert after_collection is not None
+        assert after_hash is not None
+        after = (after_time, after_collection, after_hash)
+    return flask.jsonify(search_(node_name, value, collection_names, from_,
+                                 to, after, limit))
+
+@app.route("/metrics")
+def metrics():
+    return flask.Response(request_metrics.prometheus(),
+                          content_type="text/plain; version=0.0.4; "
+                                       "charset=utf-8")
+
+@app.route("/python_lineage_script_cache")
+def python_lineage_script_cache():
+    return flask.jsonify(script_cache.stats())
+
 @app.route("/sql_backwards_lineage")
 def sql_backwards_lineage():
     node_name = flask.request.args.get("node_name", "")
@@ -301,3 +1368,26 @@ def python_backwards_lineage():
     assert id_ is not None
     return with_cursor(python_backwards_lineage_, node_name, collection_name,
                        id_)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ensure-indexes", action="store_true",
+                        help="Create the indexes the frontend relies on "
+                             "(see indexes.py) and the live tail triggers "
+                             "(see live.py), and exit.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.ensure_indexes:
+        with pool.connection() as conn:
+            indexes.ensure_indexes(conn)
+            if backend.name == "postgres":
+                live.ensure_all_triggers(conn)
+    else:
+        # Load the metadata cache before the first request needs it.
+        try:
+            run_with_pooled_cursor(metadata_cache.refresh)
+        except (psycopg2.Error, sqlite3.Error, db.PoolTimeout):
+            pass
+        app.run(host=args.host, port=args.port, threaded=True)
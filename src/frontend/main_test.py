@@ -0,0 +1,311 @@
+import unittest
+
+import main
+import value_search
+
+# A cursor that records the queries executed against it and answers them with
+# `respond(query, args)`.
+class FakeCursor(object):
+    def __init__(self, respond):
+        self.respond = respond
+        self.queries = []
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.queries.append(query)
+        self.rows = self.respond(query, args)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+# Returns a lineage of `fan_in` tuples split across two collections of two
+# nodes, with every other tuple missing its time (like network lineage).
+def lineage(fan_in):
+    return [("n" + str(i % 2), "c" + str(i % 2), 100 + i,
+             None if i % 2 == 0 else i)
+            for i in range(fan_in)]
+
+def respond(fan_in, python_script=None):
+    def respond_(query, args):
+        if "unnest" in query:
+            # Hydration of a group of lineage tuples.
+            (hashes, times, max_time) = args
+            return [(i + 1, h, t or max_time, None, "now", None, "x")
+                    for (i, (h, t)) in enumerate(zip(hashes, times))]
+        elif "python_lineage_method" in query:
+            return [(hash(python_script), "lineage")]
+        elif "python_lineage_script" in query:
+            return [(python_script,)]
+        elif "MAX(time_inserted)" in query:
+            return [(42,)]
+        else:
+            # The lineage of the tuple itself.
+            return lineage(fan_in)
+    return respond_
+
+class BackwardsLineageTest(unittest.TestCase):
+    def query_counts(self, f):
+        return [f(fan_in) for fan_in in [1, 10, 100, 1000]]
+
+    def test_regular_backwards_lineage_query_count(self):
+        def num_queries(fan_in):
+            cur = FakeCursor(respond(fan_in))
+            tuples = main.regular_backwards_lineage_(cur, "n", "c", 1, 42)
+            self.assertEqual(len(tuples), fan_in)
+            for t in tuples:
+                self.assertIsNotNone(t["time"])
+                self.assertIsNotNone(t["tuple"])
+            return len(cur.queries)
+        self.assertEqual(self.query_counts(num_queries), [3, 4, 4, 4])
+
+    def test_sql_backwards_lineage_query_count(self):
+        def num_queries(fan_in):
+            cur = FakeCursor(respond(fan_in))
+            tuples = main.sql_backwards_lineage_(cur, "n", "c", 1)
+            self.assertEqual(len(tuples), fan_in)
+            return len(cur.queries)
+        self.assertEqual(self.query_counts(num_queries), [2, 3, 3, 3])
+
+    def test_python_backwards_lineage_query_count(self):
+        def num_queries(fan_in):
+            script = "def lineage(cur, id_):\n    return {}\n".format(
+                [(n, c, h, 1) for (n, c, h, _) in lineage(fan_in)])
+            cur = FakeCursor(respond(fan_in, script))
+            tuples = main.python_backwards_lineage_(cur, "n", "c", 1)
+            self.assertEqual(len(tuples), fan_in)
+            return len(cur.queries)
+        # The first query fetches the script's hash and the second fetches
+        # the script itself, since it changes with every fan-in.
+        self.assertEqual(self.query_counts(num_queries), [3, 4, 4, 4])
+
+    def test_batched_python_lineage_method_is_called_once(self):
+        # Every id depends on the network tuple with hash 100 + id, and the
+        # script counts the queries its batched method would run.
+        script = "\n".join([
+            "def lineage(cur, id_):",
+            "    raise AssertionError('not batched')",
+            "def lineage_batch(cur, ids):",
+            "    cur.execute('batch')",
+            "    return {i: [('m', 'c', 100 + i, None)] for i in ids}",
+        ])
+        metadata = {("n", "c"): {"lineage_type": "python",
+                                 "column_names": ["id"]}}
+        frontier = [{"node_name": "n", "collection_name": "c",
+                     "tuple": [None] * 5 + [id_]} for id_ in range(10)]
+        cur = FakeCursor(respond(0, script))
+        edges = main.expand_backwards_lineage_(cur, frontier, metadata)
+        self.assertEqual(cur.queries.count("batch"), 1)
+        self.assertEqual([(t["tuple"][5], dep["hash"]) for (t, dep) in edges],
+                         [(id_, 100 + id_) for id_ in range(10)])
+
+class TupleHistoryTest(unittest.TestCase):
+    def setUp(self):
+        metadata = {"type": "Table", "column_names": ["x"],
+                    "lineage_type": "regular"}
+        for f in ["collection_metadata_", "collections_metadata_"]:
+            self.addCleanup(setattr, main, f, getattr(main, f))
+        main.collection_metadata_ = lambda cur, n, c: dict(metadata)
+        main.collections_metadata_ = lambda cur: {("n", "c"): metadata}
+
+    def test_lineage_query_count(self):
+        # Tuple 7 is inserted at every time in [0, insertions) and derived
+        # from a network tuple each time.
+        def respond_(query, args):
+            if "ORDER BY time_inserted" in query:
+                return [(7, t, t + 1, "now", "later", t)
+                        for t in range(insertions)]
+            elif "_lineage L" in query:
+                (_, _, times) = args
+                return [(i + 1, "m", "c", long(100 + t), None)
+                        for (i, t) in enumerate(times)]
+            else:
+                (hashes, _, max_times) = args
+                return [(i + 1, h, t, None, "now", None, "y")
+                        for (i, (h, t)) in enumerate(zip(hashes, max_times))]
+
+        for insertions in [1, 10, 100]:
+            cur = FakeCursor(respond_)
+            history = main.tuple_history_(cur, "n", "c", 7, True)
+            self.assertEqual(len(cur.queries), 3)
+            self.assertEqual([t[1] for t in history["tuples"]],
+                             range(insertions))
+            self.assertEqual([[(d["hash"], d["time"]) for d in lineage]
+                              for lineage in history["lineage"]],
+                             [[("{}".format(100 + t), t)]
+                              for t in range(insertions)])
+
+class NodeTicksTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "node_", main.node_)
+        main.node_ = lambda name, cur=None: {"collections": {"c": {}}}
+
+    def test_ticks_are_grouped_by_time(self):
+        # Tuple 1 is inserted at 1 and deleted at 3, and tuple 2, derived
+        # from tuple 1, is inserted at 2. Nothing happens at 4.
+        def respond_(query, args):
+            if "_lineage L" in query:
+                return [(2, "c", long(2), "n", "c", long(1), 1)]
+            return [(long(1), 1, 3, "now", "later", 10),
+                    (long(2), 2, None, "now", None, 20)]
+
+        cur = FakeCursor(respond_)
+        ticks = main.node_ticks_(cur, "n", 1, 4)
+        self.assertEqual([t["time"] for t in ticks], [2, 3])
+        self.assertEqual(ticks[0]["inserted"],
+                         {"c": [["2", 2, None, "now", None, 20]]})
+        self.assertEqual([l["dep_hash"] for l in ticks[0]["lineage"]], ["1"])
+        self.assertEqual(ticks[1], {"time": 3, "inserted": {},
+                                    "deleted": {"c": [["1", 1]]},
+                                    "lineage": []})
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "node_", main.node_)
+        main.node_ = lambda name, cur=None: {"collections": {
+            "c": {"column_names": ["x", "name", "ts"]},
+            "d": {"column_names": ["flag"]},
+        }}
+
+    def test_value_matches_columns_it_parses_as(self):
+        def respond_(query, args):
+            return [("n_c", "x", "integer"), ("n_c", "name", "text"),
+                    ("n_c", "ts", "timestamp with time zone"),
+                    ("n_d", "flag", "boolean")]
+
+        matches = main.search_matches_(FakeCursor(respond_), "n", ["c", "d"],
+                                       "42")
+        self.assertEqual(matches, {"c": [
+            ("x = %s", [42]), ("(name = %s AND md5(name) = md5(%s))",
+                               ["42", "42"])], "d": []})
+        matches = main.search_matches_(FakeCursor(respond_), "n", ["c", "d"],
+                                       "true")
+        self.assertEqual(matches, {
+            "c": [("(name = %s AND md5(name) = md5(%s))", ["true", "true"])],
+            "d": [("flag = %s", [True])]})
+
+    def test_non_ascii_value_matches_text_columns(self):
+        def respond_(query, args):
+            return [("n_c", "x", "integer"), ("n_c", "name", "text")]
+
+        matches = main.search_matches_(FakeCursor(respond_), "n", ["c"],
+                                       u"caf\xe9")
+        self.assertEqual(matches["c"][0][1], ["caf\xc3\xa9"] * 2)
+
+    def test_pages_resume_after_the_last_tuple(self):
+        cur = FakeCursor(lambda query, args: [])
+        for collection_name in ["b", "c", "d"]:
+            main.search_collection_(cur, "n", collection_name,
+                                    [("x = %s", [42])], None, None,
+                                    (7, "c", 99), 10)
+        self.assertEqual([q.split("WHERE")[1].split("ORDER")[0].split()
+                          for q in cur.queries], [
+            ["(x", "=", "%s)", "AND", "time_inserted", ">", "%s"],
+            ["(x", "=", "%s)", "AND", "(time_inserted", ">", "%s", "OR",
+             "(time_inserted", "=", "%s", "AND", "hash", ">", "%s))"],
+            ["(x", "=", "%s)", "AND", "time_inserted", ">=", "%s"],
+        ])
+
+    def test_unbounded_text_columns_are_indexed_by_md5(self):
+        types = [("hash", "bigint"), ("x", "integer"), ("data", "text"),
+                 ("ts", "timestamp with time zone")]
+        self.assertEqual(value_search.value_indexes("n_c", types),
+                         [("n_c_x_idx", "x"),
+                          ("n_c_data_md5_idx", "md5(data)")])
+        self.assertEqual(value_search.value_indexes("n_c", types,
+                                                    hashed=False),
+                         [("n_c_x_idx", "x"), ("n_c_data_idx", "data")])
+        self.assertEqual(value_search.obsolete_indexes("n_c", types),
+                         ["n_c_data_idx"])
+
+class PythonLineageScriptCacheTest(unittest.TestCase):
+    def test_script_is_compiled_once(self):
+        script = "def lineage(cur, id_):\n    return []\n"
+        cache = main.lineage_scripts.ScriptCache()
+        self.addCleanup(setattr, main, "script_cache", main.script_cache)
+        main.script_cache = cache
+        cur = FakeCursor(respond(0, script))
+        for _ in range(3):
+            self.assertEqual(main.python_backwards_lineage_(cur, "n", "c", 1),
+                             [])
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "size": 1})
+
+    def test_changed_script_is_recompiled(self):
+        cache = main.lineage_scripts.ScriptCache()
+        load = lambda x: lambda: "x = {}\n".format(x)
+        self.assertEqual(cache.get("n", "h1", load(1))["x"], 1)
+        self.assertEqual(cache.get("n", "h1", load(2))["x"], 1)
+        self.assertEqual(cache.get("n", "h2", load(2))["x"], 2)
+        self.assertEqual(cache.get("m", "h1", load(3))["x"], 3)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 3, "size": 2})
+
+class ImmutableResponseTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "max_time_cache", main.max_time_cache)
+        main.max_time_cache = main.max_times.MaxTimeCache(check_interval=60)
+        main.max_time_cache.update(("n", "v1"), 10)
+
+        # Node n is at version v1 of its row in Nodes.
+        def respond_(query, args):
+            if "address" in query:
+                return [(1, "n", "n:8000")]
+            elif "FROM Nodes" in query:
+                return [(1, "v1")]
+            return []
+        self.addCleanup(setattr, main, "metadata_cache", main.metadata_cache)
+        main.metadata_cache = main.metadata.MetadataCache(check_interval=60)
+        main.metadata_cache.refresh(FakeCursor(respond_))
+        self.addCleanup(setattr, main.backend, "identity",
+                        main.backend.identity)
+        main.backend.identity = lambda get_conn: "db"
+
+        # None of these requests should touch the database.
+        def getconn():
+            raise AssertionError("getconn called")
+        self.addCleanup(setattr, main.pool, "getconn", main.pool.getconn)
+        main.pool.getconn = getconn
+
+    def etag(self, url):
+        with main.app.test_request_context(url):
+            return main.etag_(main.flask.request, "v1")
+
+    def test_matching_etag_is_not_modified(self):
+        url = "/node_collection?node_name=n&collection_name=c&time=9"
+        etag = self.etag(url)
+        response = main.app.test_client().get(
+            url, headers={"If-None-Match": '"{}"'.format(etag)})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], '"{}"'.format(etag))
+        self.assertIn("max-age=86400", response.headers["Cache-Control"])
+
+    def test_later_deletions_are_left_out(self):
+        # Tuple 1 is inserted at 2 and deleted at 5, tuple 2 at 3 and 3.
+        row = (1, 2, 5, "t2", "t5", "x")
+        self.assertEqual(main.deleted_as_of(row, 4),
+                         (1, 2, None, "t2", None, "x"))
+        self.assertEqual(main.deleted_as_of(row, 5), row)
+        row = (2, 3, 3, "t3", "t3", "x")
+        self.assertEqual(main.deleted_as_of(row, 3), row)
+        self.assertEqual(main.deleted_as_of((3, 3, None, "t3", None), 3),
+                         (3, 3, None, "t3", None))
+
+    def test_etag_depends_on_database(self):
+        url = "/node_collection?node_name=n&collection_name=c&time=9"
+        etag = self.etag(url)
+        main.backend.identity = lambda get_conn: "another db"
+        self.assertNotEqual(self.etag(url), etag)
+        with main.app.test_request_context(url):
+            self.assertNotEqual(main.etag_(main.flask.request, "v2"), etag)
+
+    def test_max_time_only_grows(self):
+        key = ("n", "v1")
+        main.max_time_cache.update(key, 5)
+        main.max_time_cache.update(key, None)
+        self.assertTrue(main.max_time_cache.before(key, 9))
+        self.assertFalse(main.max_time_cache.before(key, 10))
+        self.assertFalse(main.max_time_cache.before(("n", "v2"), 0))
+
+if __name__ == "__main__":
+    unittest.main()
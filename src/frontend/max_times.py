@@ -0,0 +1,48 @@
+import threading
+import time
+
+class MaxTimeCache(object):
+    """A thread-safe cache of the largest logical time of every node.
+
+    A node never changes its state at a logical time once it has moved past
+    it, so anything computed from a node's state at times before its max
+    time can be cached forever. Max times only grow, so a cached max time is
+    always a lower bound on the real one: if `time` is less than the cached
+    max time, it is also less than the real max time, no matter how stale the
+    cache is. A stale cache can only make us miss an opportunity to cache.
+
+    An entry is stale if it is older than `check_interval` seconds.
+
+        cache = MaxTimeCache()
+        if cache.stale("node"):
+            cache.update("node", checkpoint.node_max_time(cur, "node"))
+        cache.before("node", 10)
+    """
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._max_times = {} # node name -> (max time, time checked)
+
+    def stale(self, node_name):
+        with self._lock:
+            entry = self._max_times.get(node_name)
+        return entry is None or time.time() - entry[1] > self.check_interval
+
+    def update(self, node_name, max_time):
+        with self._lock:
+            entry = self._max_times.get(node_name)
+            if entry is not None and entry[0] is not None and \
+                    (max_time is None or max_time < entry[0]):
+                max_time = entry[0]
+            self._max_times[node_name] = (max_time, time.time())
+
+    def get(self, node_name):
+        """The cached max time of a node, or None if it isn't known."""
+        with self._lock:
+            entry = self._max_times.get(node_name)
+        return None if entry is None else entry[0]
+
+    def before(self, node_name, time_):
+        """Whether the node is known to have moved past `time_`."""
+        max_time = self.get(node_name)
+        return max_time is not None and time_ < max_time
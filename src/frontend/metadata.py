@@ -0,0 +1,149 @@
+import collections
+import threading
+import time
+
+class MetadataCache(object):
+    """A thread-safe, in-process cache of the metadata of every node.
+
+    A node writes its metadata (its row in Nodes and its rows in Rules and
+    Collections) once, when it starts (see PqxxClient::Init, AddRule, and
+    AddCollection in lineagedb/pqxx_client.h), so there's no need to query it
+    on every request. Instead, we cache it and only go back to the database
+    when a node appears that we haven't seen before.
+
+    To notice new nodes, the cache is stale if it hasn't been checked in the
+    last `check_interval` seconds or if someone looks up a node it doesn't
+    know about. Refreshing a stale cache fetches the ids in Nodes and only
+    loads the metadata of new nodes. A node registers its rules, collections,
+    and black box lineage a little while after it inserts itself into Nodes,
+    so nodes first seen less than `settle_time` seconds ago are reloaded on
+    every refresh.
+
+    A node's row in Nodes is replaced when the database is reset, possibly
+    with the same id. `version_column` is an expression that changes when
+    the row does (e.g. postgres' xmin), and a node whose version has changed
+    is reloaded as if it were new. node(name)["version"] is its value.
+
+        cache = MetadataCache()
+        if cache.stale("node"):
+            cache.refresh(cur)
+        cache.node("node")["address"]
+    """
+    def __init__(self, check_interval=5.0, settle_time=30.0,
+                 version_column="NULL"):
+        self.check_interval = check_interval
+        self.settle_time = settle_time
+        self.version_column = version_column
+        self._lock = threading.Lock()
+        self._nodes = collections.OrderedDict() # name -> node
+        self._first_seen = {}                   # id -> time first seen
+        self._last_check = None
+
+    def stale(self, node_name=None):
+        with self._lock:
+            if (self._last_check is None or
+                    time.time() - self._last_check > self.check_interval):
+                return True
+            return node_name is not None and node_name not in self._nodes
+
+    def refresh(self, cur):
+        now = time.time()
+        cur.execute("SELECT id, {} FROM Nodes;".format(self.version_column))
+        versions = collections.OrderedDict(cur.fetchall())
+        ids = versions.keys()
+
+        with self._lock:
+            known = {node["id"]: node for node in self._nodes.values()}
+            replaced = set(id_ for (id_, node) in known.items()
+                           if node["version"] != versions.get(id_))
+            known = {id_: node for (id_, node) in known.items()
+                     if id_ not in replaced}
+            first_seen = {id_: now if id_ in replaced
+                          else self._first_seen.get(id_, now)
+                          for id_ in ids}
+        to_load = [id_ for id_ in ids
+                   if id_ not in known or
+                   now - first_seen[id_] < self.settle_time]
+        loaded = self._load(cur, to_load) if len(to_load) > 0 else {}
+        for (id_, node) in loaded.items():
+            node["version"] = versions[id_]
+
+        nodes = collections.OrderedDict()
+        for id_ in ids:
+            node = loaded.get(id_, known.get(id_))
+            if node is not None:
+                nodes[node["name"]] = node
+        with self._lock:
+            self._nodes = nodes
+            self._first_seen = first_seen
+            self._last_check = now
+
+    def nodes(self):
+        """The [name, address] of every node."""
+        with self._lock:
+            return [[n["name"], n["address"]] for n in self._nodes.values()]
+
+    def node(self, node_name):
+        """A dict with the id, name, address, version, bootstrap_rules, rules,
+        and collections of a node. collections maps the name of every
+        collection (in the order they were registered) to a dict with the
+        collection's type, column_names, lineage_type, and
+        python_lineage_method. Raises KeyError if there is no such node. The
+        dict must not be modified."""
+        with self._lock:
+            return self._nodes[node_name]
+
+    def all_nodes(self):
+        with self._lock:
+            return self._nodes.values()
+
+    @staticmethod
+    def _load(cur, ids):
+        # Returns a dict mapping each of `ids` to its node. The ids are passed
+        # as a list of placeholders rather than an array, which sqlite
+        # doesn't have.
+        nodes = {}
+        placeholders = ", ".join(["%s"] * len(ids))
+        ids = tuple(ids)
+        cur.execute("""
+            SELECT id, name, address
+            FROM Nodes
+            WHERE id IN ({});
+        """.format(placeholders), ids)
+        for (id_, name, address) in cur.fetchall():
+            nodes[id_] = {
+                "id": id_,
+                "name": name,
+                "address": address,
+                "bootstrap_rules": [],
+                "rules": [],
+                "collections": collections.OrderedDict(),
+            }
+
+        cur.execute("""
+            SELECT node_id, is_bootstrap, rule
+            FROM Rules
+            WHERE node_id IN ({})
+            ORDER BY rule_number;
+        """.format(placeholders), ids)
+        for (node_id, is_bootstrap, rule) in cur.fetchall():
+            if node_id in nodes:
+                key = "bootstrap_rules" if is_bootstrap else "rules"
+                nodes[node_id][key].append(rule)
+
+        cur.execute("""
+            SELECT node_id, collection_name, collection_type, column_names,
+                   lineage_type, python_lineage_method
+            FROM Collections
+            WHERE node_id IN ({});
+        """.format(placeholders), ids)
+        for (node_id, name, type_, column_names, lineage_type,
+             python_lineage_method) in cur.fetchall():
+            if node_id in nodes:
+                nodes[node_id]["collections"][name] = {
+                    "type": type_,
+                    "column_names": column_names,
+                    "lineage_type": lineage_type,
+                    "python_lineage_method": python_lineage_method,
+                }
+        return nodes
@@ -0,0 +1,77 @@
+import unittest
+
+import main_test
+import metadata
+
+# Answers the queries MetadataCache issues from a list of (id, name) nodes,
+# each with one rule, one bootstrap rule, and one collection.
+def respond(nodes):
+    def respond_(query, args):
+        if "FROM Rules" in query:
+            return [row for (id_, name) in nodes if id_ in args
+                    for row in [(id_, True, name + "_b"),
+                                (id_, False, name + "_r")]]
+        elif "FROM Collections" in query:
+            return [(id_, "c", "Table", ["x"], "regular", None)
+                    for (id_, _) in nodes if id_ in args]
+        elif "address" in query:
+            return [(id_, name, name + ":8000")
+                    for (id_, name) in nodes if id_ in args]
+        else:
+            return list(nodes)
+    return respond_
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_only_new_nodes_are_loaded(self):
+        nodes = [(1, "a")]
+        cache = metadata.MetadataCache(settle_time=0)
+        self.assertTrue(cache.stale())
+
+        cur = main_test.FakeCursor(respond(nodes))
+        cache.refresh(cur)
+        self.assertEqual(len(cur.queries), 4)
+        self.assertFalse(cache.stale("a"))
+        self.assertEqual(cache.nodes(), [["a", "a:8000"]])
+        self.assertEqual(cache.node("a")["rules"], ["a_r"])
+        self.assertEqual(cache.node("a")["bootstrap_rules"], ["a_b"])
+        self.assertEqual(cache.node("a")["collections"].keys(), ["c"])
+
+        # Nothing has changed, so only the ids are fetched.
+        cur.queries = []
+        cache.refresh(cur)
+        self.assertEqual(len(cur.queries), 1)
+
+        # An unknown node makes the cache stale, and only it is loaded.
+        self.assertTrue(cache.stale("b"))
+        nodes.append((2, "b"))
+        cur.queries = []
+        cache.refresh(cur)
+        self.assertEqual(len(cur.queries), 4)
+        self.assertEqual(cache.nodes(), [["a", "a:8000"], ["b", "b:8000"]])
+
+    def test_replaced_nodes_are_reloaded(self):
+        # The ids query answers (id, name), so a node's name is its version.
+        nodes = [(1, "a")]
+        cache = metadata.MetadataCache(settle_time=0)
+        cur = main_test.FakeCursor(respond(nodes))
+        cache.refresh(cur)
+        self.assertEqual(cache.node("a")["version"], "a")
+
+        # The database is reset, and a new node gets the old one's id.
+        nodes[0] = (1, "b")
+        cur.queries = []
+        cache.refresh(cur)
+        self.assertEqual(len(cur.queries), 4)
+        self.assertEqual(cache.nodes(), [["b", "b:8000"]])
+        self.assertEqual(cache.node("b")["version"], "b")
+
+    def test_young_nodes_are_reloaded(self):
+        cache = metadata.MetadataCache(settle_time=3600)
+        cur = main_test.FakeCursor(respond([(1, "a")]))
+        cache.refresh(cur)
+        cur.queries = []
+        cache.refresh(cur)
+        self.assertEqual(len(cur.queries), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Measure frontend request throughput with concurrent clients.
+
+The frontend is served by a threaded werkzeug server in this process and
+hammered by 1, 8, and 32 client threads (by default). Every client repeatedly
+issues a GET for the given path for `--seconds` seconds. The path should be one
+that queries the database, unlike /nodes and the other node metadata that the
+frontend caches (see metadata.py). For example,
+
+    python pool_bench.py --path "/node_collection?node_name=n&collection_name=c&time=10"
+
+prints a CSV of clients, requests, seconds, and requests per second. Run it
+with `--pool_max 1` to see how the frontend behaves with a single shared
+connection.
+"""
+
+import argparse
+import logging
+import threading
+import time
+import urllib2
+
+from werkzeug.serving import make_server
+
+import backends
+import checkpoint
+import db
+import live
+import main
+
+def use_pool(pool):
+    # Points the frontend at `pool`: its backend, and the live tail and
+    # background checkpointer that check connections out of the backend's
+    # pool, are rebuilt around it.
+    old_pool = main.pool
+    main.pool = pool
+    main.backend = backends.PostgresBackend(pool)
+    main.tail = live.Tail(pool, poll_period=main.tail.poll_period)
+    if hasattr(main, "checkpointer"):
+        main.checkpointer.stop()
+        main.checkpointer = checkpoint.Checkpointer(
+            pool, main.checkpointer.interval, main.checkpointer.period)
+        main.checkpointer.start()
+    if old_pool is not pool:
+        old_pool.closeall()
+
+def serve(host, port):
+    server = make_server(host, port, main.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def run_clients(url, num_clients, seconds):
+    counts = [0] * num_clients
+    errors = [0] * num_clients
+    deadline = time.time() + seconds
+
+    def client(i):
+        while time.time() < deadline:
+            try:
+                urllib2.urlopen(url).read()
+                counts[i] += 1
+            except urllib2.URLError:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(num_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (sum(counts), sum(errors), time.time() - start)
+
+def bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    parser.add_argument(
+        "--path",
+        default="/node_collection?node_name=n&collection_name=c&time=10")
+    parser.add_argument("--clients", default="1,8,32")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--pool_min", type=int, default=1)
+    parser.add_argument("--pool_max", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    use_pool(db.ConnectionPool(args.dsn, minconn=args.pool_min,
+                               maxconn=args.pool_max,
+                               cursor_factory=main.pool.cursor_factory))
+    server = serve("127.0.0.1", args.port)
+    url = "http://127.0.0.1:{}{}".format(args.port, args.path)
+
+    # Warm up the pool so that connection setup isn't measured.
+    run_clients(url, args.pool_max, 1)
+
+    print "clients,requests,errors,seconds,requests_per_second"
+    for num_clients in [int(c) for c in args.clients.split(",")]:
+        (requests, errors, seconds) = run_clients(url, num_clients,
+                                                  args.seconds)
+        print "{},{},{},{:.2f},{:.1f}".format(num_clients, requests, errors,
+                                              seconds, requests / seconds)
+    server.shutdown()
+
+if __name__ == "__main__":
+    bench()
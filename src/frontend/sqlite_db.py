@@ -0,0 +1,360 @@
+"""Export a lineage database to a single sqlite file for offline analysis.
+
+The exported file has the same tables as the postgres database (Nodes, Rules,
+Collections, Checkpoints, and every `{node}_{collection}`, `{node}_lineage`,
+and `{node}_{collection}_checkpoint` table) with the same columns, and the
+indexes the frontend's queries rely on (see indexes.py). Point the frontend at
+it with FLUENT_SQLITE_DB to browse a trace without a database server:
+
+    python sqlite_db.py --dsn "dbname=vagrant" --out trace.db
+    FLUENT_SQLITE_DB=trace.db python main.py
+
+Column types are declared with the postgres type names that the frontend
+cares about (bigint, boolean, numeric, timestamptz, and json for arrays), and
+connect converts them back to the same python types psycopg2 returns.
+Timestamps are stored as ISO 8601 strings in UTC, and numerics (e.g. the
+numeric(20) columns that hold unsigned 64-bit integers) as decimal strings,
+since a sqlite REAL would round them. The export reads every table in a
+single REPEATABLE READ transaction, so it's consistent even while nodes are
+writing. The plpgsql functions that compute sql
+black box lineage are not exported.
+
+Connections returned by connect behave like the subset of psycopg2
+connections that the frontend uses: queries use %s placeholders, cursors are
+context managers, and named (server-side) cursors are ordinary cursors, since
+sqlite reads rows lazily anyway.
+"""
+
+# datetime.strptime imports _strptime on first use, which isn't thread-safe.
+import _strptime
+import argparse
+import contextlib
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import psycopg2
+
+import indexes
+import value_search
+
+# The sqlite type declared for a column of every postgres type (as named by
+# information_schema.columns.data_type). Other types are stored as text. The
+# first word of a declared type picks its converter (see connect), and a type
+# containing "text" has text affinity, so sqlite never turns numerics into
+# REALs.
+TYPES = {
+    "bigint": "bigint",
+    "integer": "integer",
+    "smallint": "integer",
+    "boolean": "boolean",
+    "real": "real",
+    "double precision": "real",
+    "numeric": "numeric text",
+    "text": "text",
+    "character varying": "text",
+    "timestamp with time zone": "timestamptz",
+    "ARRAY": "json",
+}
+
+class UTC(datetime.tzinfo):
+    def utcoffset(self, dt):
+        return datetime.timedelta(0)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return "UTC"
+
+def format_timestamp(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC()).replace(tzinfo=None)
+    return dt.isoformat(" ") + "+00:00"
+
+def parse_timestamp(s):
+    s = s[:-len("+00:00")]
+    format_ = "%Y-%m-%d %H:%M:%S.%f" if "." in s else "%Y-%m-%d %H:%M:%S"
+    return datetime.datetime.strptime(s, format_).replace(tzinfo=UTC())
+
+sqlite3.register_converter("bigint", long)
+sqlite3.register_converter("boolean", lambda s: bool(int(s)))
+sqlite3.register_converter("numeric", decimal.Decimal)
+sqlite3.register_converter("timestamptz", parse_timestamp)
+sqlite3.register_converter("json", json.loads)
+
+# sqlite integers are signed 64-bit integers, so larger ones (e.g. a search
+# for an unsigned 64-bit value) are passed as decimal strings, which compare
+# equal to the strings numerics are stored as.
+sqlite3.register_adapter(long, lambda x: x if -2 ** 63 <= x < 2 ** 63
+                         else str(x))
+
+# Postgres functions used by the frontend's (and lineage scripts') otherwise
+# portable queries.
+def _greatest(*xs):
+    # Like postgres' GREATEST, and unlike sqlite's max, NULLs are ignored.
+    xs = [x for x in xs if x is not None]
+    return max(xs) if len(xs) > 0 else None
+
+def _md5(s):
+    return None if s is None else hashlib.md5(s).hexdigest()
+
+def _octet_length(s):
+    return None if s is None else len(s)
+
+class Cursor(object):
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self.connection = connection
+        self.itersize = 2000
+        self.arraysize = 1
+
+    def execute(self, query, args=None):
+        # psycopg2 placeholders are %s, and a literal % is written %%.
+        query = re.sub(r"%([s%])",
+                       lambda m: "?" if m.group(1) == "s" else "%", query)
+        self._cursor.execute(query, () if args is None else args)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(self.arraysize if size is None
+                                      else size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+class Connection(object):
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = False
+
+    def cursor(self, name=None):
+        return Cursor(self._conn.cursor(), self)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+def connect(path):
+    """A connection to the sqlite database at `path`. The connection may be
+    used by any thread, but by one at a time."""
+    if not os.path.exists(path):
+        # sqlite would otherwise create an empty database.
+        raise sqlite3.OperationalError("no such database: " + path)
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+    conn.text_factory = str
+    tables = set(name.lower() for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table';"))
+    conn.create_function("to_regclass", 1,
+                         lambda t: t if t.lower() in tables else None)
+    conn.create_function("greatest", -1, _greatest)
+    conn.create_function("md5", 1, _md5)
+    conn.create_function("octet_length", 1, _octet_length)
+    return Connection(conn)
+
+class ConnectionPool(object):
+    """A thread-safe pool of connections to a sqlite database, with the same
+    interface as db.ConnectionPool. Opening a sqlite connection is cheap, so
+    connections are opened on demand and idle ones are kept for reuse.
+
+        pool = ConnectionPool("trace.db")
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._idle = []
+        self._size = 0
+
+    def getconn(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+            self._size += 1
+        try:
+            return connect(self.path)
+        except:
+            with self._lock:
+                self._size -= 1
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        if discard or conn.closed:
+            conn.close()
+        with self._lock:
+            if discard or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {"size": self._size, "idle": len(self._idle)}
+
+def sqlite_value(x):
+    if isinstance(x, datetime.datetime):
+        return format_timestamp(x)
+    elif isinstance(x, list):
+        return json.dumps(x)
+    elif isinstance(x, decimal.Decimal):
+        return str(x)
+    return x
+
+def table_columns(cur, table):
+    """The (name, sqlite type) of every column of a postgres table."""
+    return [(name, TYPES.get(type_, "text")) for (name, type_) in
+            indexes.column_types(cur, table)]
+
+def copy_table(pg_conn, sqlite_conn, table, batch_size=10000):
+    """Create `table` in sqlite and copy its rows from postgres. Returns the
+    number of rows copied."""
+    with pg_conn.cursor() as cur:
+        columns = table_columns(cur, table)
+    sqlite_conn.execute("CREATE TABLE {} ({});".format(
+        table, ", ".join("{} {}".format(c, t) for (c, t) in columns)))
+    insert = "INSERT INTO {} VALUES ({});".format(
+        table, ", ".join("?" for _ in columns))
+
+    num_rows = 0
+    with pg_conn.cursor(name="export") as cur:
+        cur.itersize = batch_size
+        cur.execute("SELECT * FROM {};".format(table))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            sqlite_conn.executemany(insert, [[sqlite_value(x) for x in row]
+                                             for row in rows])
+            num_rows += len(rows)
+    return num_rows
+
+def export(pg_conn, path, out=None):
+    """Export the lineage database on `pg_conn` to a new sqlite database at
+    `path`, writing a line per table to `out` if it isn't None."""
+    assert not os.path.exists(path), path
+    sqlite_conn = sqlite3.connect(path)
+    sqlite_conn.text_factory = str
+    # Every table is copied in the same snapshot, so that, e.g., lineage
+    # never refers to tuples inserted after the collection was copied.
+    pg_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    with pg_conn.cursor() as cur:
+        node_collections = indexes.node_collections(cur)
+        tables = ["Nodes", "Rules", "Collections"]
+        if indexes.table_exists(cur, "checkpoints"):
+            tables.append("Checkpoints")
+        # (table, [(index, columns)]) for every table to index.
+        to_index = [("Nodes", [("nodes_name_idx", "name")]),
+                    ("Collections",
+                     [("collections_node_idx", "node_id, collection_name")]),
+                    ("Rules", [("rules_node_idx", "node_id, rule_number")])]
+        for (node_name, collection_names) in sorted(node_collections.items()):
+            for collection_name in collection_names:
+                (table, table_indexes) = indexes.collection_indexes(
+                    node_name, collection_name)
+                tables.append(table)
+                # sqlite has no limit on the size of index entries, and
+                # can't index the md5 function we define in connect.
+                table_indexes += value_search.value_indexes(
+                    table, indexes.column_types(cur, table), hashed=False)
+                to_index.append((table, [(table + "_pkey",
+                                          "hash, time_inserted")] +
+                                        table_indexes))
+                checkpoint_table = table + "_checkpoint"
+                if indexes.table_exists(cur, checkpoint_table):
+                    tables.append(checkpoint_table)
+                    to_index.append((checkpoint_table, [(
+                        checkpoint_table + "_pkey",
+                        "time, hash, time_inserted")]))
+            (table, table_indexes) = indexes.lineage_indexes(node_name)
+            tables.append(table)
+            to_index.append((table, table_indexes))
+
+    for table in tables:
+        start = time.time()
+        num_rows = copy_table(pg_conn, sqlite_conn, table)
+        sqlite_conn.commit()
+        if out is not None:
+            out.write("{:<48} {:>10} rows {:>8.2f}s\n".format(
+                table, num_rows, time.time() - start))
+    pg_conn.rollback()
+
+    for (table, table_indexes) in to_index:
+        for (index, columns) in table_indexes:
+            sqlite_conn.execute("CREATE INDEX {} ON {} ({});"
+                                .format(index, table, columns))
+    sqlite_conn.execute("ANALYZE;")
+    sqlite_conn.commit()
+    sqlite_conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", default="dbname=vagrant")
+    parser.add_argument("--out", required=True,
+                        help="The sqlite file to create.")
+    args = parser.parse_args()
+
+    start = time.time()
+    export(psycopg2.connect(args.dsn), args.out, out=sys.stdout)
+    print "Exported to {} in {:.2f}s.".format(args.out, time.time() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import datetime
+import decimal
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import backends
+import main
+import sqlite_db
+
+# A node `n` with a collection `c` whose tuple 2 was derived from tuple 1.
+SCHEMA = """
+    CREATE TABLE Nodes (id bigint, name text, address text,
+                        python_lineage_script text);
+    CREATE TABLE Rules (node_id bigint, rule_number integer,
+                        is_bootstrap boolean, rule text);
+    CREATE TABLE Collections (node_id bigint, collection_name text,
+                              collection_type text, column_names json,
+                              lineage_type text, python_lineage_method text);
+    CREATE TABLE n_c (hash bigint, time_inserted integer,
+                      time_deleted integer,
+                      physical_time_inserted timestamptz,
+                      physical_time_deleted timestamptz, x integer);
+    CREATE TABLE n_lineage (dep_node_id bigint, dep_collection_name text,
+                            dep_tuple_hash bigint, dep_time bigint,
+                            rule_number integer, inserted boolean,
+                            physical_time timestamptz, collection_name text,
+                            tuple_hash bigint, time integer);
+    INSERT INTO Nodes VALUES (1, 'n', 'tcp://n:8000', NULL);
+    INSERT INTO Rules VALUES (1, 0, 0, 'c <= c');
+    INSERT INTO Collections VALUES (1, 'c', 'Table', '["x"]', 'regular',
+                                    NULL);
+    INSERT INTO n_c VALUES
+        (1, 1, 3, '2017-06-01 00:00:00.010000+00:00',
+         '2017-06-01 00:00:00.030000+00:00', 10),
+        (2, 2, NULL, '2017-06-01 00:00:00.020000+00:00', NULL, 20);
+    INSERT INTO n_lineage VALUES
+        (1, 'c', 1, 1, 0, 1, NULL, 'c', 2, 2);
+"""
+
+class SqliteBackendTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "trace.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self.addCleanup(setattr, main, "backend", main.backend)
+        self.addCleanup(setattr, main, "metadata_cache", main.metadata_cache)
+        main.backend = backends.SqliteBackend(sqlite_db.ConnectionPool(path))
+        main.metadata_cache = main.metadata.MetadataCache()
+        self.conn = main.backend.pool.getconn()
+        self.addCleanup(main.backend.pool.putconn, self.conn)
+        self.cur = self.conn.cursor()
+
+    def test_types_match_psycopg2(self):
+        collection = main.collection_metadata_(self.cur, "n", "c")
+        self.assertEqual(collection["column_names"], ["x"])
+        main.checkpoint.execute_time_travel(self.cur, "n", "c", 2)
+        (t1, t2) = sorted([main.escape(x) for x in t]
+                          for t in self.cur.fetchall())
+        self.assertEqual(t1[:3], ["1", 1, 3])
+        self.assertEqual(t1[3], datetime.datetime(
+            2017, 6, 1, 0, 0, 0, 10000, tzinfo=sqlite_db.UTC()))
+        self.assertEqual(t2[4], None)
+
+    def test_numerics_are_exact(self):
+        big = decimal.Decimal(2 ** 64 - 1)
+        self.cur.execute("CREATE TABLE t (x {});".format(
+            sqlite_db.TYPES["numeric"]))
+        self.cur.execute("INSERT INTO t VALUES (%s), (%s);",
+                         (sqlite_db.sqlite_value(big),
+                          sqlite_db.sqlite_value(decimal.Decimal(7))))
+        self.cur.execute("SELECT x FROM t WHERE x = %s;", (2 ** 64 - 1,))
+        self.assertEqual(self.cur.fetchall(), [(big,)])
+        self.cur.execute("SELECT x FROM t WHERE x = %s;", (7L,))
+        self.assertEqual(self.cur.fetchall(), [(decimal.Decimal(7),)])
+        self.assertEqual(main.escape(big), "18446744073709551615")
+
+    def test_lineage(self):
+        lineage = main.regular_backwards_lineage_(self.cur, "n", "c", 2, 2)
+        self.assertEqual([(t["hash"], t["time"], t["tuple"][-1])
+                          for t in lineage], [("1", 1, 10)])
+
+        graph = main.forwards_lineage_(self.cur, "n", "c", 1, 1, 2, 10)
+        self.assertEqual(sorted(n["data"]["id"] for n in graph["nodes"]),
+                         ["n_c_1_1", "n_c_2_2"])
+        self.assertEqual([(e["data"]["source"], e["data"]["target"])
+                          for e in graph["edges"]],
+                         [("n_c_1_1", "n_c_2_2")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,13 +24,36 @@ fluent.strip_header = function(tuple) {
 }
 
 // https://plainjs.com/javascript/ajax/send-ajax-get-and-post-requests-47/
-fluent.ajax_get = function(url, on_success) {
+//
+// on_error, if given, is called with the request if it fails (including if
+// it can't reach the frontend at all).
+fluent.ajax_get = function(url, on_success, on_error) {
   var xhr = window.XMLHttpRequest ? new XMLHttpRequest()
     : new ActiveXObject('Microsoft.XMLHTTP');
   xhr.open('GET', url);
   xhr.onreadystatechange = function() {
     if (xhr.readyState > 3 && xhr.status == 200) {
       on_success(JSON.parse(xhr.responseText));
+    } else if (xhr.readyState > 3 && on_error) {
+      on_error(xhr);
+    }
+  };
+  xhr.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+  xhr.send();
+  return xhr;
+}
+
+// Like fluent.ajax_get, but passes the response to on_success as an
+// ArrayBuffer.
+fluent.ajax_get_binary = function(url, on_success, on_error) {
+  var xhr = new XMLHttpRequest();
+  xhr.open('GET', url);
+  xhr.responseType = 'arraybuffer';
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState > 3 && xhr.status == 200) {
+      on_success(xhr.response);
+    } else if (xhr.readyState > 3 && on_error) {
+      on_error(xhr);
     }
   };
   xhr.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
@@ -64,6 +87,10 @@ fluent.NodeNameAddress = function(name, address) {
 // time: number
 // collections: Collection list
 // clicked_hash: string option
+//
+// collections_time is the logical time that collections currently reflect.
+// It lags behind time while a delta is being fetched (see
+// fluent.sync_collections).
 fluent.Node = function(name, address, bootstrap_rules, rules, time,
                        collections, clicked_hash) {
   assert(typeof(name) === "string");
@@ -76,12 +103,14 @@ fluent.Node = function(name, address, bootstrap_rules, rules, time,
   this.time = time;
   this.collections = collections;
   this.clicked_hash = clicked_hash;
+  this.collections_time = time;
+  this.syncing = false;
 }
 
 // name: string,
 // type: string,
 // column_names: string list,
-// tuples: string list list,
+// tuples: ColumnarTuples,
 fluent.Collection = function(name, type, column_names, lineage_type, tuples) {
   assert(typeof(name) === "string", typeof(name));
   assert(typeof(type) === "string", typeof(type));
@@ -93,6 +122,50 @@ fluent.Collection = function(name, type, column_names, lineage_type, tuples) {
   this.tuples = tuples;
 }
 
+// The tuples of a collection stored column by column, as returned by
+// fluent.decode_columnar and fluent.decode_columnar_binary. Columns are
+// decoded in place, so no object is allocated per tuple; use get to read a
+// value, or row to build a tuple the way /node_collection returns them.
+//
+// length: number
+// columns: (array | typed array) list
+fluent.ColumnarTuples = function(length, columns) {
+  this.length = length;
+  this.columns = columns;
+  // Vue doesn't walk frozen objects, so the columns aren't made reactive one
+  // value at a time. A delta replaces the tuples instead (see apply_delta).
+  Object.freeze(this);
+}
+
+// The j'th column of the i'th tuple. Hashes are returned as strings, and
+// missing deletion times as null.
+fluent.ColumnarTuples.prototype.get = function(i, j) {
+  var x = this.columns[j][i];
+  if (j === 0) {
+    return typeof(x) === "string" ? x : x.toString();
+  } else if ((j === 2 && x === -1) || (j === 4 && isNaN(x))) {
+    return null;
+  }
+  return x;
+}
+
+fluent.ColumnarTuples.prototype.row = function(i) {
+  var row = [];
+  for (var j = 0; j < this.columns.length; ++j) {
+    row.push(this.get(i, j));
+  }
+  return row;
+}
+
+// Every tuple as a row, for rendering.
+fluent.ColumnarTuples.prototype.rows = function() {
+  var rows = [];
+  for (var i = 0; i < this.length; ++i) {
+    rows.push(this.row(i));
+  }
+  return rows;
+}
+
 // node_name: string
 // collection_name: string
 // hash: string
@@ -112,6 +185,11 @@ fluent.tuple_id_to_string = function(tid) {
   return [tid.node_name, tid.collection_name, tid.hash, tid.time].join("_");
 }
 
+// The number of hops of lineage fetched when a tuple is clicked, and the
+// maximum number of tuples derived from any one tuple that are fetched.
+fluent.lineage_depth = 5;
+fluent.lineage_fanout = 25;
+
 // AJAX Endpoints //////////////////////////////////////////////////////////////
 fluent.ajax = {};
 
@@ -151,6 +229,10 @@ fluent.ajax.node_collection_names = function(node_name, callback) {
 //   column_names: string list,
 //   tuples: string list list,
 // }
+//
+// /node_collection also accepts `limit` and `after_hash` parameters to fetch
+// a collection one page at a time, in which case the response also includes
+// the `next_after_hash` of the next page (or null on the last page).
 fluent.ajax.node_collection = function(node_name, collection_name, time, callback) {
   var url = "/node_collection" +
     "?node_name=" + node_name +
@@ -159,6 +241,82 @@ fluent.ajax.node_collection = function(node_name, collection_name, time, callbac
   fluent.ajax_get(url, callback);
 }
 
+// node_collection_columnar: string -> string -> int -> bool -> {
+//   type: string,
+//   column_names: string list,
+//   lineage_type: string,
+//   tuples: ColumnarTuples,
+// }
+//
+// The same as node_collection, but fetched in the columnar format described
+// in columnar.py, optionally binary encoded.
+fluent.ajax.node_collection_columnar = function(node_name, collection_name,
+                                                time, binary, callback) {
+  var url = "/node_collection" +
+    "?node_name=" + node_name +
+    "&collection_name=" + collection_name +
+    "&time=" + time +
+    "&format=columnar";
+  if (binary) {
+    fluent.ajax_get_binary(url + "&encoding=binary", function(buffer) {
+      callback(fluent.decode_columnar_binary(buffer));
+    });
+  } else {
+    fluent.ajax_get(url, function(response) {
+      callback(fluent.decode_columnar(response));
+    });
+  }
+}
+
+// node_collection_delta: string -> int -> int -> {
+//   <collection name>: {
+//     inserted: string list list,
+//     deleted: [string, int] list,
+//   },
+//   ...
+// }
+fluent.ajax.node_collection_delta = function(node_name, from, to, callback,
+                                             on_error) {
+  var url = "/node_collection_delta" +
+    "?node_name=" + node_name +
+    "&from=" + from +
+    "&to=" + to;
+  fluent.ajax_get(url, callback, on_error);
+}
+
+// node_snapshot: string -> int -> {
+//   name: string,
+//   address: string,
+//   bootstrap_rules: string list,
+//   rules: string list,
+//   time: int,
+//   collection_names: string list,
+//   collections: {
+//     name: string,
+//     type: string,
+//     column_names: string list,
+//     lineage_type: string,
+//     tuples: ColumnarTuples,
+//   } list,
+// }
+//
+// The response is streamed one collection after another, so the frontend
+// never holds a whole collection in memory. Its collections are fetched in
+// the columnar format and decoded with fluent.decode_columnar.
+fluent.ajax.node_snapshot = function(node_name, time, callback, on_error) {
+  var url = "/node_snapshot" +
+    "?node_name=" + node_name +
+    "&time=" + time +
+    "&format=columnar";
+  fluent.ajax_get(url, function(snapshot) {
+    for (var i = 0; i < snapshot.collections.length; ++i) {
+      var c = snapshot.collections[i];
+      c.tuples = fluent.decode_columnar(c).tuples;
+    }
+    callback(snapshot);
+  }, on_error);
+}
+
 // regular_backwards_lineage: string -> string -> int -> int -> TupleId list
 fluent.ajax.regular_backwards_lineage = function(node_name, collection_name,
                                                  hash, time, callback) {
@@ -170,6 +328,105 @@ fluent.ajax.regular_backwards_lineage = function(node_name, collection_name,
   fluent.ajax_get(url, callback);
 }
 
+// backwards_lineage_closure: string -> string -> string -> int -> int -> {
+//   nodes: cytoscape node list,
+//   edges: cytoscape edge list,
+// }
+fluent.ajax.backwards_lineage_closure = function(node_name, collection_name,
+                                                 hash, time, depth, callback) {
+  var url = "/backwards_lineage_closure" +
+    "?node_name=" + node_name +
+    "&collection_name=" + collection_name +
+    "&hash=" + hash +
+    "&time=" + time +
+    "&depth=" + depth;
+  fluent.ajax_get(url, callback);
+}
+
+// forwards_lineage: string -> string -> string -> int -> int -> int -> {
+//   nodes: cytoscape node list,
+//   edges: cytoscape edge list,
+// }
+fluent.ajax.forwards_lineage = function(node_name, collection_name, hash, time,
+                                        depth, fanout, callback) {
+  var url = "/forwards_lineage" +
+    "?node_name=" + node_name +
+    "&collection_name=" + collection_name +
+    "&hash=" + hash +
+    "&time=" + time +
+    "&depth=" + depth +
+    "&fanout=" + fanout;
+  fluent.ajax_get(url, callback);
+}
+
+// tuple_history: string -> string -> string -> bool -> {
+//   type: string,
+//   column_names: string list,
+//   lineage_type: string,
+//   hash: string,
+//   tuples: string list list,
+//   lineage: TupleId list list,
+// }
+//
+// Every insertion of a tuple, in order of time_inserted, with its logical
+// and physical insertion and deletion times. If `lineage` is true, lineage[i]
+// is the backwards lineage of tuples[i].
+fluent.ajax.tuple_history = function(node_name, collection_name, hash, lineage,
+                                     callback) {
+  var url = "/tuple_history" +
+    "?node_name=" + node_name +
+    "&collection_name=" + collection_name +
+    "&hash=" + hash +
+    (lineage ? "&lineage=1" : "");
+  fluent.ajax_get(url, callback);
+}
+
+// search: string -> string -> {
+//   tuples: {collection_name: string, tuple: string list} list,
+//   next_after_time: int,
+//   next_after_collection: string,
+//   next_after_hash: string,
+// }
+//
+// The first 100 tuples of a node with a user column equal to `value`, in
+// order of logical time. Pass the previous response as `after` (or null) to
+// get the next 100.
+fluent.ajax.search = function(node_name, value, after, callback) {
+  var url = "/search" +
+    "?node_name=" + node_name +
+    "&value=" + encodeURIComponent(value) +
+    (after === null ? "" :
+      "&after_time=" + after.next_after_time +
+      "&after_collection=" + after.next_after_collection +
+      "&after_hash=" + after.next_after_hash);
+  fluent.ajax_get(url, callback);
+}
+
+// live_tail: string -> int -> EventSource
+//
+// Calls `callback` with every tick of a node after logical time `from` (or
+// after its current time if `from` is null), as the node moves past it:
+//
+//   {
+//     time: int,
+//     inserted: {collection_name: string list list},
+//     deleted: {collection_name: [hash, time_inserted] list},
+//     lineage: {collection_name, hash, dep_node_name, dep_collection_name,
+//               dep_hash, dep_time} list,
+//   }
+//
+// Close the returned EventSource to stop tailing.
+fluent.ajax.live_tail = function(node_name, from, callback) {
+  var url = "/live_tail" +
+    "?node_name=" + node_name +
+    (from === null ? "" : "&from=" + from);
+  var source = new EventSource(url);
+  source.addEventListener("tick", function(e) {
+    callback(JSON.parse(e.data));
+  });
+  return source;
+}
+
 // sql_backwards_lineage: string -> string -> int -> TupleId list
 fluent.ajax.sql_backwards_lineage = function(node_name, collection_name, id,
                                              callback) {
@@ -190,69 +447,213 @@ fluent.ajax.python_backwards_lineage = function(node_name, collection_name,
   fluent.ajax_get(url, callback);
 }
 
-// Callbacks ///////////////////////////////////////////////////////////////////
-fluent.get_collections = function(node_name, collection_names, time, callback) {
-  var i = 0;
-  var collections = [];
-  var get_collections_impl = function() {
-    if (i == collection_names.length) {
-      callback(collections);
+// Columnar Decoding ///////////////////////////////////////////////////////////
+// Decode a /node_collection?format=columnar response, or a collection of a
+// /node_snapshot?format=columnar response, in place. The header columns of
+// every block are delta encoded (see columnar.py), so we replace every delta
+// with a running sum, and then join the blocks' columns.
+fluent.decode_columnar = function(response) {
+  var blocks = response.blocks;
+  var length = 0;
+  for (var b = 0; b < blocks.length; ++b) {
+    fluent.decode_columnar_block(blocks[b]);
+    length += blocks[b].length;
+  }
+
+  var columns = [];
+  if (blocks.length === 1) {
+    columns = blocks[0].columns;
+  } else {
+    for (var j = 0; j < 5 + response.column_names.length; ++j) {
+      columns.push([].concat.apply([], blocks.map(function(block) {
+        return block.columns[j];
+      })));
+    }
+  }
+  return {
+    type: response.type,
+    column_names: response.column_names,
+    lineage_type: response.lineage_type,
+    tuples: new fluent.ColumnarTuples(length, columns),
+  };
+}
+
+fluent.decode_columnar_block = function(block) {
+  var columns = block.columns;
+  var times_inserted = columns[1];
+  var times_deleted = columns[2];
+  var physical_inserted = columns[3];
+  var physical_deleted = columns[4];
+  for (var i = 0; i < block.length; ++i) {
+    if (i > 0) {
+      times_inserted[i] += times_inserted[i - 1];
+      physical_inserted[i] += physical_inserted[i - 1];
+    }
+    if (times_deleted[i] !== null) {
+      times_deleted[i] += times_inserted[i];
+    } else {
+      times_deleted[i] = -1;
+    }
+    if (physical_deleted[i] !== null) {
+      physical_deleted[i] += physical_inserted[i];
     } else {
-      var cname = collection_names[i];
-      i += 1;
-      fluent.ajax.node_collection(node_name, cname, time, function(collection) {
-        collections.push(new fluent.Collection(
-            cname, collection.type, collection.column_names,
-            collection.lineage_type, collection.tuples));
-        get_collections_impl();
-      });
+      physical_deleted[i] = NaN;
     }
   }
-  get_collections_impl();
+}
+
+// Decode a /node_collection?format=columnar&encoding=binary response. The
+// header columns are views into the response, so nothing is copied.
+fluent.decode_columnar_binary = function(buffer) {
+  var header_length = new DataView(buffer).getUint32(0, true);
+  var header = JSON.parse(new TextDecoder("utf-8").decode(
+      new Uint8Array(buffer, 4, header_length)));
+  var n = header.length;
+  var offset = 4 + header_length;
+  var hashes = new BigInt64Array(buffer, offset, n);
+  offset += 8 * n;
+  var physical_inserted = new Float64Array(buffer, offset, n);
+  offset += 8 * n;
+  var physical_deleted = new Float64Array(buffer, offset, n);
+  offset += 8 * n;
+  var times_inserted = new Int32Array(buffer, offset, n);
+  offset += 4 * n;
+  var times_deleted = new Int32Array(buffer, offset, n);
+  var columns = [hashes, times_inserted, times_deleted, physical_inserted,
+                 physical_deleted].concat(header.columns);
+  return {
+    type: header.type,
+    column_names: header.column_names,
+    lineage_type: header.lineage_type,
+    tuples: new fluent.ColumnarTuples(n, columns),
+  };
+}
+
+// Callbacks ///////////////////////////////////////////////////////////////////
+fluent.snapshot_collections = function(snapshot) {
+  var collections = [];
+  for (var i = 0; i < snapshot.collections.length; ++i) {
+    var c = snapshot.collections[i];
+    collections.push(new fluent.Collection(
+        c.name, c.type, c.column_names, c.lineage_type, c.tuples));
+  }
+  return collections;
 }
 
 fluent.select_node = function(name, time, callback) {
   var that = this;
-  fluent.ajax.node_address(name, function(address) {
-  fluent.ajax.node_bootstrap_rules(name, function(bootstrap_rules) {
-  fluent.ajax.node_rules(name, function(rules) {
-  fluent.ajax.node_collection_names(name, function(collection_names) {
-    var node = new fluent.Node(name, address, bootstrap_rules, rules, time, [],
-                               null);
-    fluent.get_collections(name, collection_names, time, function(collections) {
-      node.collections = collections;
-      that.node = node;
-      if (callback) {
-        callback();
-      }
-    });
-  });
-  });
-  });
+  fluent.ajax.node_snapshot(name, time, function(snapshot) {
+    that.node = new fluent.Node(name, snapshot.address,
+                                snapshot.bootstrap_rules, snapshot.rules, time,
+                                fluent.snapshot_collections(snapshot), null);
+    if (callback) {
+      callback();
+    }
   });
 }
 
-fluent.refresh_collections = function(node) {
+// A tuple's key is its hash and the logical time it was inserted.
+fluent.tuple_key = function(hash, time_inserted) {
+  return hash + "_" + time_inserted;
+}
+
+// Apply a delta returned by /node_collection_delta to collection. The
+// tuples that survive are copied column by column into new ColumnarTuples,
+// followed by the inserted tuples, whose header columns are stored the way
+// fluent.decode_columnar stores them.
+fluent.apply_delta = function(collection, delta) {
+  if (delta.deleted.length === 0 && delta.inserted.length === 0) {
+    return;
+  }
+
+  var deleted = {};
+  for (var i = 0; i < delta.deleted.length; ++i) {
+    var d = delta.deleted[i];
+    deleted[fluent.tuple_key(d[0], d[1])] = true;
+  }
+
+  var tuples = collection.tuples;
+  var columns = tuples.columns.map(function() { return []; });
+  var length = 0;
+  for (var i = 0; i < tuples.length; ++i) {
+    if (!deleted[fluent.tuple_key(tuples.get(i, 0), tuples.get(i, 1))]) {
+      for (var j = 0; j < columns.length; ++j) {
+        columns[j].push(tuples.columns[j][i]);
+      }
+      length += 1;
+    }
+  }
+  for (var i = 0; i < delta.inserted.length; ++i) {
+    var t = delta.inserted[i];
+    columns[0].push(t[0]);
+    columns[1].push(t[1]);
+    columns[2].push(t[2] === null ? -1 : t[2]);
+    columns[3].push(Date.parse(t[3]));
+    columns[4].push(t[4] === null ? NaN : Date.parse(t[4]));
+    for (var j = 5; j < columns.length; ++j) {
+      columns[j].push(t[j]);
+    }
+    length += 1;
+  }
+  collection.tuples = new fluent.ColumnarTuples(length, columns);
+}
+
+// Bring node.collections up to date with node.time by fetching and applying
+// the delta between node.collections_time and node.time. At most one delta
+// request is in flight per node; if node.time changes while it is in flight
+// (e.g. someone is holding down an arrow key), the steps are coalesced into a
+// single follow-up delta. If a delta request fails, the collections are
+// reloaded from a snapshot at node.time instead (see reload_collections).
+fluent.sync_collections = function(node) {
   assert(node !== null);
-  var collection_names = [];
-  for (var i in node.collections) {
-    collection_names.push(node.collections[i].name);
+  if (node.syncing || node.collections_time === node.time) {
+    return;
   }
-  var callback = function(collections) { node.collections = collections; }
-  fluent.get_collections(node.name, collection_names, node.time, callback);
+
+  var from = node.collections_time;
+  var to = node.time;
+  node.syncing = true;
+  fluent.ajax.node_collection_delta(node.name, from, to, function(deltas) {
+    for (var i = 0; i < node.collections.length; ++i) {
+      var collection = node.collections[i];
+      fluent.apply_delta(collection, deltas[collection.name]);
+    }
+    node.collections_time = to;
+    node.syncing = false;
+    fluent.sync_collections(node);
+  }, function() {
+    fluent.reload_collections(node);
+  });
+}
+
+// Replace node.collections with those of a snapshot at node.time, and then
+// catch up with any steps taken since (see sync_collections). If the
+// snapshot fails too, syncing stops until the next step tries again.
+fluent.reload_collections = function(node) {
+  assert(node !== null);
+  var time = node.time;
+  node.syncing = true;
+  fluent.ajax.node_snapshot(node.name, time, function(snapshot) {
+    node.collections = fluent.snapshot_collections(snapshot);
+    node.collections_time = time;
+    node.syncing = false;
+    fluent.sync_collections(node);
+  }, function() {
+    node.syncing = false;
+  });
 }
 
 fluent.decrement_time = function() {
   if (this.node !== null) {
     this.node.time = Math.max(0, this.node.time - 1);
-    fluent.refresh_collections(this.node);
+    fluent.sync_collections(this.node);
   }
 }
 
 fluent.increment_time = function() {
   if (this.node !== null) {
     this.node.time += 1;
-    fluent.refresh_collections(this.node);
+    fluent.sync_collections(this.node);
   }
 }
 
@@ -325,8 +726,7 @@ fluent.backwards_lineage = function(node, collection, tuple) {
   //   2. logical time deleted
   //   3. physical time inserted
   //   4. physical time deleted
-  //   5. address
-  //   6. id
+  //   ...
   var hash = tuple[0];
   var time = tuple[1];
   var target_tid = new fluent.TupleId(node.name, collection.name, hash, time);
@@ -334,33 +734,43 @@ fluent.backwards_lineage = function(node, collection, tuple) {
   this.node.clicked_hash = hash;
 
   var that = this;
-  var callback = function(lineage_tuples) {
-    for (var i = 0; i < lineage_tuples.length; ++i) {
-      var t = lineage_tuples[i];
-      var source_tid = new fluent.TupleId(
-          t.node_name, t.collection_name, t.hash, t.time);
-      fluent.add_node.call(that, source_tid, t.tuple);
-      fluent.add_edge.call(that, source_tid, target_tid);
-    }
-    that.cy.layout({
-      name: "dagre",
-      rankDir: "LR",
-      animate: true,
-      fit: false,
-    }).run();
-  }
+  var f = fluent.ajax.backwards_lineage_closure;
+  f(node.name, collection.name, hash, time, fluent.lineage_depth,
+    function(graph) { fluent.add_graph.call(that, graph); });
+}
 
-  if (collection.lineage_type === "regular") {
-    var f = fluent.ajax.regular_backwards_lineage;
-    f(node.name, collection.name, hash, time, callback);
-  } else if (collection.lineage_type === "sql") {
-    var f = fluent.ajax.sql_backwards_lineage;
-    f(node.name, collection.name, tuple[6], callback);
-  } else {
-    assert(collection.lineage_type === "python", collection.lineage_type);
-    var f = fluent.ajax.python_backwards_lineage;
-    f(node.name, collection.name, tuple[6], callback);
-  }
+fluent.forwards_lineage = function(node, collection, tuple) {
+  var hash = tuple[0];
+  var time = tuple[1];
+  this.node.clicked_hash = hash;
+
+  var that = this;
+  var f = fluent.ajax.forwards_lineage;
+  f(node.name, collection.name, hash, time, fluent.lineage_depth,
+    fluent.lineage_fanout,
+    function(graph) { fluent.add_graph.call(that, graph); });
+}
+
+// Add the cytoscape nodes and edges in graph that aren't already in the
+// lineage graph, and lay it out again.
+fluent.add_graph = function(graph) {
+  var that = this;
+  var elements = graph.nodes.concat(graph.edges).filter(function(e) {
+    if (e.group === "nodes") {
+      return that.cy.getElementById(e.data.id).size() == 0;
+    } else {
+      var selector = "edge[source='" + e.data.source + "']" +
+                     "[target='" + e.data.target + "']";
+      return that.cy.edges(selector).size() == 0;
+    }
+  });
+  this.cy.add(elements);
+  this.cy.layout({
+    name: "dagre",
+    rankDir: "LR",
+    animate: true,
+    fit: false,
+  }).run();
 }
 
 // Main ////////////////////////////////////////////////////////////////////////
@@ -374,6 +784,7 @@ function main() {
       decrement_time: fluent.decrement_time,
       increment_time: fluent.increment_time,
       backwards_lineage: fluent.backwards_lineage,
+      forwards_lineage: fluent.forwards_lineage,
     },
     updated: function() {
       if (this.node !== null) {
@@ -406,6 +817,13 @@ function main() {
           }
         }
       },
+      {
+        // Tuples with more derived tuples than fluent.lineage_fanout.
+        selector: 'node[?truncated]',
+        style: {
+          "border-style": "dashed",
+        }
+      },
       {
         selector: 'edge',
         style: {
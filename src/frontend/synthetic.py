@@ -0,0 +1,250 @@
+"""Generate a synthetic lineage database.
+
+The database has exactly the schema that fluent nodes create (see
+scripts/reset_database.sql and lineagedb/pqxx_client.h): a row in Nodes,
+Rules, and Collections for every node, a `{node}_{collection}` table for every
+collection, and a `{node}_lineage` table for every node. Every node has
+`--collections` collections. The first is a channel `c0` whose tuples are
+either received from another node's `c0` (with network lineage) or, if there
+is nothing new to receive, come from nowhere. The rest are tables `c1`, `c2`,
+... whose tuples are each derived from `--fan_in` live tuples of the node's
+earlier collections. At every one of `--history` logical times, every
+collection inserts `--churn` tuples, and deletes a random live tuple for
+every insert once it has `--live` live tuples.
+
+The database at `--dsn` is reset first, so point it at a scratch database:
+
+    createdb fluent_synthetic
+    python synthetic.py --dsn "dbname=fluent_synthetic" --nodes 4 \\
+        --collections 4 --history 1000 --churn 2 --live 100 --fan_in 3
+"""
+
+import argparse
+import datetime
+import os
+import random
+import StringIO
+import time
+
+import psycopg2
+
+RESET_DATABASE_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "..", "..", "scripts", "reset_database.sql")
+
+# The (name, type) of the columns of channels and tables.
+CHANNEL_COLUMNS = [("addr", "text"), ("x", "integer")]
+TABLE_COLUMNS = [("x", "integer"), ("y", "text")]
+
+# Tuples are inserted START + time * TICK in physical time.
+START = datetime.datetime(2017, 6, 1)
+TICK = datetime.timedelta(milliseconds=10)
+
+def node_name(i):
+    return "node{}".format(i)
+
+def collection_name(i):
+    return "c{}".format(i)
+
+def collection_columns(i):
+    return CHANNEL_COLUMNS if i == 0 else TABLE_COLUMNS
+
+def random_hash(rng):
+    return rng.getrandbits(64) - 2**63
+
+def physical_time(time_):
+    return (START + time_ * TICK).isoformat() + "+00"
+
+def create_schema(cur, nodes, num_collections, num_rules):
+    # The statements PqxxClient::Init, AddCollection, and AddRule execute.
+    with open(RESET_DATABASE_SQL) as f:
+        cur.execute(f.read())
+    for (id_, name) in nodes:
+        cur.execute("""
+            INSERT INTO Nodes (id, name, address, python_lineage_script)
+            VALUES (%s, %s, %s, NULL);
+        """, (id_, name, "tcp://{}:8000".format(name)))
+        cur.execute("""
+            CREATE TABLE {}_lineage (
+              dep_node_id          bigint                    NOT NULL,
+              dep_collection_name  text                      NOT NULL,
+              dep_tuple_hash       bigint                    NOT NULL,
+              dep_time             bigint                    NOT NULL,
+              rule_number          integer,
+              inserted             boolean                   NOT NULL,
+              physical_time        timestamp with time zone,
+              collection_name      text                      NOT NULL,
+              tuple_hash           bigint                    NOT NULL,
+              time                 integer                   NOT NULL
+            );
+        """.format(name))
+
+        for i in range(num_collections):
+            columns = collection_columns(i)
+            cur.execute("""
+                INSERT INTO Collections (node_id, collection_name,
+                                         collection_type, column_names,
+                                         lineage_type, python_lineage_method)
+                VALUES (%s, %s, %s, %s, 'regular', NULL);
+            """, (id_, collection_name(i), "Channel" if i == 0 else "Table",
+                  [c for (c, _) in columns]))
+            cur.execute("""
+                CREATE TABLE {}_{} (
+                  hash                   bigint                   NOT NULL,
+                  time_inserted          integer                  NOT NULL,
+                  time_deleted           integer,
+                  physical_time_inserted timestamp with time zone NOT NULL,
+                  physical_time_deleted  timestamp with time zone,
+                  {},
+                  PRIMARY KEY (hash, time_inserted)
+                );
+            """.format(name, collection_name(i),
+                       ", ".join("{} {} NOT NULL".format(c, t)
+                                 for (c, t) in columns)))
+
+        for rule_number in range(num_rules):
+            target = 1 + rule_number % max(1, num_collections - 1)
+            cur.execute("""
+                INSERT INTO Rules (node_id, rule_number, is_bootstrap, rule)
+                VALUES (%s, %s, false, %s);
+            """, (id_, rule_number, "{} <= ({}).map(f{})".format(
+                collection_name(target), collection_name(target - 1),
+                rule_number)))
+
+class Collection(object):
+    # The rows of a collection's table, and the indexes into them of its live
+    # tuples.
+    def __init__(self):
+        self.rows = []
+        self.live = []
+        self.live_hashes = set()
+        self.last_inserted = {} # hash -> time last inserted
+
+    def can_insert(self, hash_, time_):
+        return (hash_ not in self.live_hashes and
+                self.last_inserted.get(hash_) != time_)
+
+    def insert(self, row):
+        self.live.append(len(self.rows))
+        self.live_hashes.add(row[0])
+        self.last_inserted[row[0]] = row[1]
+        self.rows.append(row)
+
+    def delete_random(self, rng, time_):
+        i = rng.randrange(len(self.live))
+        (self.live[i], self.live[-1]) = (self.live[-1], self.live[i])
+        row = self.rows[self.live.pop()]
+        row[2] = time_
+        row[4] = physical_time(time_)
+        self.live_hashes.discard(row[0])
+
+def generate(conn, num_nodes=4, num_collections=4, history=1000, churn=2,
+             live=100, fan_in=3, num_rules=4, seed=0):
+    """Reset the database and fill it with a synthetic history. Returns a
+    dict with the number of tuples and lineage rows generated."""
+    rng = random.Random(seed)
+    nodes = [(i + 1, node_name(i)) for i in range(num_nodes)]
+    collections = [[Collection() for _ in range(num_collections)]
+                   for _ in nodes]
+    lineage = [[] for _ in nodes]
+    sent = [[] for _ in nodes] # (hash, time, values) sent on c0.
+
+    for time_ in range(1, history + 1):
+        now = physical_time(time_)
+        sendable = [len(s) for s in sent]
+        for (n, (node_id, _)) in enumerate(nodes):
+            for (c, collection) in enumerate(collections[n]):
+                for _ in range(churn):
+                    if len(collection.live) >= live:
+                        collection.delete_random(rng, time_)
+
+                    if c == 0:
+                        values = ("tcp://{}:8000".format(node_name(n)),
+                                  rng.randint(0, 10**6))
+                        hash_ = random_hash(rng)
+                        senders = [m for m in range(num_nodes)
+                                   if m != n and sendable[m] > 0]
+                        if len(senders) > 0:
+                            m = rng.choice(senders)
+                            (h, t, v) = sent[m][rng.randrange(sendable[m])]
+                            if collection.can_insert(h, time_):
+                                (hash_, values) = (h, v)
+                                lineage[n].append((
+                                    nodes[m][0], collection_name(0), h, t,
+                                    None, True, None, collection_name(0),
+                                    hash_, time_))
+                        sent[n].append((hash_, time_, values))
+                    else:
+                        values = (rng.randint(0, 10**6),
+                                  "v{}".format(rng.randint(0, 10**6)))
+                        hash_ = random_hash(rng)
+                        deps = set()
+                        for _ in range(fan_in):
+                            d = rng.randrange(c)
+                            dep = collections[n][d]
+                            if len(dep.live) > 0:
+                                row = dep.rows[rng.choice(dep.live)]
+                                deps.add((d, row[0], row[1]))
+                        for (d, h, t) in deps:
+                            lineage[n].append((
+                                node_id, collection_name(d), h, t,
+                                rng.randrange(max(1, num_rules)), True, now,
+                                collection_name(c), hash_, time_))
+                    collection.insert([hash_, time_, None, now, None] +
+                                      list(values))
+
+    with conn.cursor() as cur:
+        create_schema(cur, nodes, num_collections, num_rules)
+        for (n, (_, name)) in enumerate(nodes):
+            for (c, collection) in enumerate(collections[n]):
+                copy(cur, "{}_{}".format(name, collection_name(c)),
+                     collection.rows)
+            copy(cur, "{}_lineage".format(name), lineage[n])
+        conn.commit()
+        for (_, name) in nodes:
+            cur.execute("ANALYZE {}_lineage;".format(name))
+        conn.commit()
+
+    return {
+        "tuples": sum(len(c.rows) for cs in collections for c in cs),
+        "lineage": sum(len(l) for l in lineage),
+    }
+
+def copy(cur, table, rows):
+    # Bulk load rows into a table with COPY.
+    def format_(x):
+        if x is None:
+            return "\\N"
+        elif type(x) == bool:
+            return "t" if x else "f"
+        return str(x)
+    data = StringIO.StringIO("".join(
+        "\t".join(format_(x) for x in row) + "\n" for row in rows))
+    cur.copy_from(data, table)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", required=True,
+                        help="The database to reset and fill.")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--collections", type=int, default=4)
+    parser.add_argument("--history", type=int, default=1000,
+                        help="The number of logical times.")
+    parser.add_argument("--churn", type=int, default=2,
+                        help="Tuples inserted per collection per time.")
+    parser.add_argument("--live", type=int, default=100,
+                        help="Live tuples per collection.")
+    parser.add_argument("--fan_in", type=int, default=3,
+                        help="Dependencies of every derived tuple.")
+    parser.add_argument("--rules", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = generate(psycopg2.connect(args.dsn), args.nodes,
+                      args.collections, args.history, args.churn, args.live,
+                      args.fan_in, args.rules, args.seed)
+    print "Generated {} tuples and {} lineage rows in {:.2f}s.".format(
+        counts["tuples"], counts["lineage"], time.time() - start)
+
+if __name__ == "__main__":
+    main()
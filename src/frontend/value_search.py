@@ -0,0 +1,86 @@
+import decimal
+
+# A search value is given as a string, and compared to every user column whose
+# type it parses as. PARSERS maps the name of every searchable type, as named
+# by postgres' information_schema.columns and by sqlite_db.py exports, to a
+# function that parses a value of the type or raises ValueError. Arrays and
+# timestamps aren't searchable.
+def parse_boolean(s):
+    if s.lower() in ["t", "true"]:
+        return True
+    elif s.lower() in ["f", "false"]:
+        return False
+    raise ValueError(s)
+
+def parse_integral(s):
+    # numeric columns hold unsigned 64-bit integers (see lineagedb/to_sql.h).
+    return long(decimal.Decimal(s).to_integral_exact(
+        context=decimal.Context(traps=[decimal.Inexact,
+                                       decimal.InvalidOperation])))
+
+def parse_text(s):
+    # Values arrive as unicode, which str() would fail to encode if they
+    # aren't ASCII. Nodes write text as UTF-8 bytes, which we compare it to
+    # as is, whatever the database's encoding (e.g. SQL_ASCII).
+    return s.encode("utf-8") if isinstance(s, unicode) else s
+
+PARSERS = {
+    "boolean": parse_boolean,
+    "smallint": parse_integral,
+    "integer": parse_integral,
+    "bigint": parse_integral,
+    "numeric": parse_integral,
+    "real": float,
+    "double precision": float,
+    "character": parse_text,
+    "character varying": parse_text,
+    "text": parse_text,
+}
+
+def parse(type_, value):
+    """`value` parsed as a value of `type_`, or None if no value of the type
+    can equal it."""
+    try:
+        return PARSERS[type_](value)
+    except (KeyError, ValueError, ArithmeticError):
+        return None
+
+# Text of unbounded length. A postgres b-tree index entry must fit in a third
+# of a page, so a node inserting a longer value into a column with such an
+# index would fail. We index the md5 of these columns instead, and compare
+# both the md5 and the value when searching them.
+HASHED_TYPES = ["character varying", "text"]
+
+def condition(column, type_, value):
+    """SQL for whether `column`, of type `type_`, equals a parsed `value`,
+    and its arguments."""
+    if type_ in HASHED_TYPES:
+        return ("({0} = %s AND md5({0}) = md5(%s))".format(column),
+                [value, value])
+    return ("{} = %s".format(column), [value])
+
+# Columns every collection has before its user columns.
+HEADER_COLUMNS = ["hash", "time_inserted", "time_deleted",
+                  "physical_time_inserted", "physical_time_deleted"]
+
+def value_indexes(table, column_types, hashed=True):
+    """The (name, columns) of an index on every searchable user column of
+    `table`, given the (name, type) of its columns. Unless `hashed` is false,
+    unbounded text columns are indexed by their md5."""
+    indexes = []
+    for (column, type_) in column_types:
+        if column in HEADER_COLUMNS or type_ not in PARSERS:
+            continue
+        if hashed and type_ in HASHED_TYPES:
+            indexes.append(("{}_{}_md5_idx".format(table, column),
+                            "md5({})".format(column)))
+        else:
+            indexes.append(("{}_{}_idx".format(table, column), column))
+    return indexes
+
+def obsolete_indexes(table, column_types):
+    """The names of the plain indexes on unbounded text columns of `table`
+    that earlier versions of value_indexes created."""
+    return ["{}_{}_idx".format(table, column)
+            for (column, type_) in column_types
+            if column not in HEADER_COLUMNS and type_ in HASHED_TYPES]